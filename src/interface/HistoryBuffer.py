@@ -0,0 +1,92 @@
+'''Fixed-capacity RSSI history buffer for a node.'''
+
+from array import array
+
+class HistoryBuffer:
+    '''Preallocated ring buffer of RSSI history entries (value, time).
+    Trimming old entries only moves the head index, and once the buffer is
+    full the oldest entry is overwritten, so memory use is fixed.
+    The lists from 'values()' and 'times()' are built once per change and
+    shared between readers, so they must not be modified.'''
+
+    DEFAULT_CAPACITY = 32768
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._values = array('i', [0]) * capacity  # switched to 'd' if a non-integer value arrives
+        self._times = array('d', [0.0]) * capacity
+        self._head = 0
+        self._count = 0
+        self._lists = None  # cached (values, times) lists; cleared on change
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self._lists = None
+
+    def add(self, value, time):
+        capacity = self.capacity
+        count = self._count
+        self._lists = None
+        # if previous two entries have same value then just extend time on last entry
+        if count >= 2:
+            last = (self._head + count - 1) % capacity
+            if self._values[last] == value and self._values[last - 1] == value:
+                self._times[last] = time
+                return
+
+        if count < capacity:
+            idx = (self._head + count) % capacity
+            self._count = count + 1
+        else:  # full; overwrite oldest entry
+            idx = self._head
+            self._head = (self._head + 1) % capacity
+
+        try:
+            self._values[idx] = value
+        except (TypeError, OverflowError):
+            self._values = array('d', self._values)
+            self._values[idx] = value
+        self._times[idx] = time
+
+    def trim_before(self, time):
+        '''Drops entries older than the given time'''
+        capacity = self.capacity
+        while self._count and self._times[self._head] < time:
+            self._head = (self._head + 1) % capacity
+            self._count -= 1
+            self._lists = None
+
+    def _spans(self):
+        end = self._head + self._count
+        if end <= self.capacity:
+            return ((self._head, end),)
+        return ((self._head, self.capacity), (0, end - self.capacity))
+
+    def views(self):
+        '''Zero-copy memoryview segments (one, or two if wrapped) of values and times'''
+        values = memoryview(self._values)
+        times = memoryview(self._times)
+        spans = self._spans()
+        return [values[start:end] for start, end in spans], [times[start:end] for start, end in spans]
+
+    def _get_lists(self):
+        if self._lists is None:
+            value_views, time_views = self.views()
+            values = []
+            times = []
+            for view in value_views:
+                values.extend(view.tolist())
+            for view in time_views:
+                times.extend(view.tolist())
+            self._lists = (values, times)
+        return self._lists
+
+    def values(self):
+        return self._get_lists()[0]
+
+    def times(self):
+        return self._get_lists()[1]
@@ -1,5 +1,7 @@
 '''Node class for the RotorHazard interface.'''
 
+from HistoryBuffer import HistoryBuffer
+
 class Node:
     '''Node class represents the arduino/rx pair.'''
     def __init__(self):
@@ -11,6 +13,7 @@ class Node:
         self.multi_node_index = -1
         self.multi_curnode_index_holder = None
         self.multi_node_slot_index = -1
+        self.io_group = None  # nodes with same I/O group share a channel and are read in sequence
         self.rhfeature_flags = 0
         self.firmware_version_str = None
         self.firmware_proctype_str = None
@@ -53,8 +56,7 @@ class Node:
 
         self.under_min_lap_count = 0
 
-        self.history_values = []
-        self.history_times = []
+        self.history = HistoryBuffer() # RSSI peak/nadir history
 
         self.scan_enabled = False
         self.scan_interval = 0 # scanning frequency interval
@@ -70,6 +72,16 @@ class Node:
         self.read_block_count = 0
         self.read_error_count = 0
 
+    @property
+    def history_values(self):
+        '''RSSI history values; shared list (cached until history changes), do not modify'''
+        return self.history.values()
+
+    @property
+    def history_times(self):
+        '''RSSI history times; shared list (cached until history changes), do not modify'''
+        return self.history.times()
+
     def init(self):
         if self.api_level >= 10:
             self.api_valid_flag = True  # set flag for newer API functions supported
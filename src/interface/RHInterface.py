@@ -14,6 +14,7 @@ TEST_RX_REGISTER = 0x04     # Check if register on RX module matches set frequen
 READ_LAP_STATS = 0x05
 READ_LAP_PASS_STATS = 0x0D
 READ_LAP_EXTREMUMS = 0x0E
+READ_ALL_LAP_STATS = 0x0F    # read lap pass stats and extremums for all nodes on processor (serial)
 READ_RHFEAT_FLAGS = 0x11     # read feature flags value
 # READ_FILTER_RATIO = 0x20    # node API_level>=10 uses 16-bit value
 READ_REVISION_CODE = 0x22    # read NODE_API_LEVEL and verification value
@@ -39,6 +40,8 @@ SEND_STATUS_MESSAGE = 0x75  # send status message from server to node
 FORCE_END_CROSSING = 0x78   # kill current crossing flag regardless of RSSI value
 JUMP_TO_BOOTLOADER = 0x7E   # jump to bootloader for flash update
 
+LAP_STATS_BLOCK_SIZE = 16  # size of READ_LAP_PASS_STATS + READ_LAP_EXTREMUMS data
+
 LAPSTATS_FLAG_CROSSING = 0x01  # crossing is in progress
 LAPSTATS_FLAG_PEAK = 0x02      # reported extremum is peak
 
@@ -219,33 +222,73 @@ class RHInterface(BaseHardwareInterface):
                 logger.exception('Exception in RHInterface update_loop():')
                 gevent.sleep(UPDATE_SLEEP*10)
 
+    def read_lap_stats(self, node):
+        '''Reads lap stats for node; returns (data, readtime).'''
+        if node.api_valid_flag or node.api_level >= 5:
+            if node.api_level >= 32:
+                data = node.read_block(self, READ_LAP_PASS_STATS, 8)
+                if data != None:
+                    extremums = node.read_block(self, READ_LAP_EXTREMUMS, 8)
+                    data = data + extremums if extremums != None else None
+            elif node.api_level >= 21:
+                data = node.read_block(self, READ_LAP_STATS, 16)
+            elif node.api_level >= 18:
+                data = node.read_block(self, READ_LAP_STATS, 19)
+            elif node.api_level >= 17:
+                data = node.read_block(self, READ_LAP_STATS, 28)
+            elif node.api_level >= 13:
+                data = node.read_block(self, READ_LAP_STATS, 20)
+            else:
+                data = node.read_block(self, READ_LAP_STATS, 18)
+            server_roundtrip = node.io_response - node.io_request
+            server_oneway = server_roundtrip / 2
+            readtime = node.io_response - server_oneway
+        else:
+            data = node.read_block(self, READ_LAP_STATS, 17)
+            readtime = 0
+        return data, readtime
+
+    def read_group_lap_stats(self, nodes, results):
+        '''Reads lap stats for nodes sharing an I/O group into results (by node index).
+        Multi-node processors with API level 37+ send all nodes in one exchange.'''
+        if len(nodes) > 1 and nodes[0].api_level >= 37 and hasattr(nodes[0], 'read_all_lap_stats'):
+            blocks = nodes[0].read_all_lap_stats(self)
+            if blocks:
+                for node in nodes:
+                    node.io_request = nodes[0].io_request
+                    node.io_response = nodes[0].io_response
+                readtime = (nodes[0].io_request + nodes[0].io_response) / 2
+                for node in nodes:
+                    if node.multi_node_index < len(blocks):
+                        results[node.index] = (blocks[node.multi_node_index], readtime)
+                return
+        for node in nodes:
+            results[node.index] = self.read_lap_stats(node)
+
+    def read_nodes_lap_stats(self):
+        '''Reads lap stats for all nodes with a frequency set; I/O groups (serial ports)
+        are read concurrently. Returns dict of (data, readtime) by node index.'''
+        groups = {}
+        for node in self.nodes:
+            if node.frequency:
+                groups.setdefault(node.io_group, []).append(node)
+        results = {}
+        if len(groups) > 1:
+            gevent.joinall([gevent.spawn(self.read_group_lap_stats, nodes, results) \
+                            for nodes in groups.values()], raise_error=True)
+        else:
+            for nodes in groups.values():
+                self.read_group_lap_stats(nodes, results)
+        return results
+
     def update(self):
         upd_list = []  # list of nodes with new laps (node, new_lap_id, lap_timestamp)
         cross_list = []  # list of nodes with crossing-flag changes
         startThreshLowerNode = None
+        lap_stats = self.read_nodes_lap_stats()
         for node in self.nodes:
             if node.frequency:
-                if node.api_valid_flag or node.api_level >= 5:
-                    if node.api_level >= 32:
-                        data = node.read_block(self, READ_LAP_PASS_STATS, 8)
-                        if data != None:
-                            data.extend(node.read_block(self, READ_LAP_EXTREMUMS, 8))
-                    elif node.api_level >= 21:
-                        data = node.read_block(self, READ_LAP_STATS, 16)
-                    elif node.api_level >= 18:
-                        data = node.read_block(self, READ_LAP_STATS, 19)
-                    elif node.api_level >= 17:
-                        data = node.read_block(self, READ_LAP_STATS, 28)
-                    elif node.api_level >= 13:
-                        data = node.read_block(self, READ_LAP_STATS, 20)
-                    else:
-                        data = node.read_block(self, READ_LAP_STATS, 18)
-                    server_roundtrip = node.io_response - node.io_request
-                    server_oneway = server_roundtrip / 2
-                    readtime = node.io_response - server_oneway
-                else:
-                    data = node.read_block(self, READ_LAP_STATS, 17)
-                    readtime = 0
+                data, readtime = lap_stats.get(node.index, (None, 0))
 
                 if data != None and len(data) > 0:
                     lap_id = data[0]
@@ -3,6 +3,7 @@ import logging
 import os
 import serial # For serial comms
 import gevent
+import gevent.lock
 import time
 from time import monotonic
 
@@ -11,7 +12,8 @@ from RHInterface import READ_REVISION_CODE, READ_MULTINODE_COUNT, MAX_RETRY_COUN
                         validate_checksum, calculate_checksum, pack_8, pack_16, unpack_8, unpack_16, \
                         WRITE_CURNODE_INDEX, READ_CURNODE_INDEX, READ_NODE_SLOTIDX, \
                         READ_FW_VERSION, READ_FW_BUILDDATE, READ_FW_BUILDTIME, FW_TEXT_BLOCK_SIZE, \
-                        JUMP_TO_BOOTLOADER, READ_FW_PROCTYPE, SEND_STATUS_MESSAGE
+                        JUMP_TO_BOOTLOADER, READ_FW_PROCTYPE, SEND_STATUS_MESSAGE, \
+                        READ_ALL_LAP_STATS, LAP_STATS_BLOCK_SIZE
 
 BOOTLOADER_CHILL_TIME = 2 # Delay for USB to switch from bootloader to serial mode
 SERIAL_BAUD_RATES = [921600, 115200]
@@ -20,15 +22,25 @@ DEF_S32BPILL_SERIAL_PORTS = ["ttyAMA0", "serial0"]
 
 logger = logging.getLogger(__name__)
 
-node_io_rlock_obj = gevent.lock.RLock()  # semaphore lock for node I/O access
+port_io_rlock_objs = {}  # semaphore locks for node I/O access, by serial port
 
+def get_port_io_rlock(port):
+    '''Returns I/O lock for serial port (nodes on separate ports may be read concurrently).'''
+    rlock_obj = port_io_rlock_objs.get(port)
+    if rlock_obj is None:
+        rlock_obj = gevent.lock.RLock()
+        port_io_rlock_objs[port] = rlock_obj
+    return rlock_obj
 
 class SerialNode(Node):
     def __init__(self, index, node_serial_obj):
         Node.__init__(self)
         self.index = index
         self.serial = node_serial_obj
-        
+        self.io_group = node_serial_obj.port
+        self.io_rlock = get_port_io_rlock(node_serial_obj.port)
+        self.multi_node_count = 1  # number of nodes handled by processor
+
     def node_log(self, interface, message):
         if interface:
             interface.log(message)
@@ -43,7 +55,7 @@ class SerialNode(Node):
         '''
         Read serial data given command, and data size.
         '''
-        with node_io_rlock_obj:  # only allow one greenlet at a time
+        with self.io_rlock:  # only allow one greenlet at a time per port
             self.inc_read_block_count(interface)
             success = False
             retry_count = 0
@@ -104,7 +116,7 @@ class SerialNode(Node):
         '''
         Write serial data given command, and data.
         '''
-        with node_io_rlock_obj:  # only allow one greenlet at a time
+        with self.io_rlock:  # only allow one greenlet at a time per port
             if interface:
                 interface.inc_intf_write_block_count()
             success = False
@@ -133,6 +145,16 @@ class SerialNode(Node):
                     gevent.sleep(0.025)
             return success
 
+    def read_all_lap_stats(self, interface):
+        '''
+        Read lap stats for all nodes on multi-node processor in one exchange (API level 37+).
+        Returns list of data blocks (by multi-node index), or None if read failed.
+        '''
+        data = self.read_block(interface, READ_ALL_LAP_STATS, LAP_STATS_BLOCK_SIZE * self.multi_node_count)
+        if data is None:
+            return None
+        return [data[i:i+LAP_STATS_BLOCK_SIZE] for i in range(0, len(data), LAP_STATS_BLOCK_SIZE)]
+
     def check_set_multi_node_index(self, interface):
         # check if need to set different node index on multi-node processor and set if needed
         if self.multi_node_index == self.multi_curnode_index_holder[0]:
@@ -327,6 +349,7 @@ def discover(idxOffset, config, isS32BPillFlag=False, *args, **kwargs):
                                 format(node.serial.name, multi_count, api_level, node.serial.baudrate, \
                                 fver_log_str, ftyp_log_str, ftim_log_str))
                     node.multi_node_index = 0
+                    node.multi_node_count = multi_count
                     curnode_index_holder = [-1]  # tracker for index of current node for processor
                     node.multi_curnode_index_holder = curnode_index_holder
                     node.read_node_slot_index()
@@ -338,6 +361,7 @@ def discover(idxOffset, config, isS32BPillFlag=False, *args, **kwargs):
                         idxOffset += 1
                         node = SerialNode(index+idxOffset, node_serial_obj)
                         node.multi_node_index = nIdx
+                        node.multi_node_count = multi_count
                         node.multi_curnode_index_holder = curnode_index_holder
                         node.api_level = api_level
                         node.firmware_version_str = node_version_str
@@ -319,6 +319,17 @@ void Message::handleReadLapPassStats(mtime_t timeNowVal)
     buffer.write16(uint16_t(cmdRssiNodePtr->getState().loopTimeMicros));
 }
 
+// Fill buffer with lap pass stats and extremums for given node (no checksum)
+void Message::handleReadNodeLapStats(uint8_t nodeIdx, mtime_t timeNowVal)
+{
+    RssiNode *savedNodePtr = cmdRssiNodePtr;
+    cmdRssiNodePtr = &(RssiNode::rssiNodeArray[nodeIdx]);
+    buffer.flipForWrite();
+    handleReadLapPassStats(timeNowVal);
+    handleReadLapExtremums(timeNowVal);
+    cmdRssiNodePtr = savedNodePtr;
+}
+
 void Message::handleReadLapExtremums(mtime_t timeNowVal)
 {
     // set flag if 'crossing' in progress
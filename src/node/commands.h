@@ -4,7 +4,7 @@
 #include "io.h"
 
 // API level for node; increment when commands are modified
-#define NODE_API_LEVEL 36
+#define NODE_API_LEVEL 37
 
 class Message
 {
@@ -17,6 +17,7 @@ public:
     void handleReadCommand(bool serialFlag);
     void handleReadLapPassStats(mtime_t timeNowVal);
     void handleReadLapExtremums(mtime_t timeNowVal);
+    void handleReadNodeLapStats(uint8_t nodeIdx, mtime_t timeNowVal);
 };
 
 #define MIN_FREQ 100
@@ -28,6 +29,7 @@ public:
 #define READ_LAP_STATS 0x05
 #define READ_LAP_PASS_STATS 0x0D
 #define READ_LAP_EXTREMUMS 0x0E
+#define READ_ALL_LAP_STATS 0x0F    // read lap pass stats and extremums for all nodes (serial only)
 #define READ_RHFEAT_FLAGS 0x11     // read feature flags value
 #define READ_REVISION_CODE 0x22    // read NODE_API_LEVEL and verification value
 #define READ_NODE_RSSI_PEAK 0x23   // read 'state.nodeRssiPeak' value
@@ -525,6 +525,23 @@ void i2cTransmit()
 
 #endif
 
+// Send lap stats for all nodes on this processor in one response, with a single checksum
+void sendAllLapStats()
+{
+    mtime_t timeNowVal = millis();
+    uint8_t checksum = 0;
+    for (uint8_t nIdx=0; nIdx<RssiNode::multiRssiNodeCount; ++nIdx)
+    {
+        serialMessage.handleReadNodeLapStats(nIdx, timeNowVal);
+        checksum += serialMessage.buffer.calculateChecksum(serialMessage.buffer.size);
+        SERIALCOM.write((byte *)serialMessage.buffer.data, serialMessage.buffer.size);
+    }
+    SERIALCOM.write(checksum);
+    serialMessage.buffer.size = 0;
+    serialMessage.command = 0;
+    settingChangedFlags |= COMM_ACTIVITY | SERIAL_CMD_MSG | LAPSTATS_READ;
+}
+
 void serialEvent()
 {
     int iterCount = 0;
@@ -544,6 +561,10 @@ void serialEvent()
                     serialMessage.buffer.size = expectedSize + 1;  // include checksum byte
                 }
             }
+            else if (serialMessage.command == READ_ALL_LAP_STATS)
+            {
+                sendAllLapStats();
+            }
             else
             {
                 serialMessage.handleReadCommand(true);
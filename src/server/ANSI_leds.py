@@ -27,6 +27,9 @@ class ANSIPixel:
     def getPixelColor(self, i):
         return self.pixels[i]
 
+    def setPixels(self, buffer):
+        self.pixels = buffer.tolist()
+
     def show(self):
         start = 0
         row = 1
@@ -44,6 +44,7 @@ class Config:
         self.config['LED']['LED_CHANNEL'] = 0  # set to '1' for GPIOs 13, 19, 41, 45 or 53
         self.config['LED']['LED_STRIP'] = 'GRB'  # Strip type and colour ordering
         self.config['LED']['LED_ROWS'] = 1  # Number of rows in LED array
+        self.config['LED']['LED_MAX_FPS'] = 60  # Maximum rate at which frames are written to the LEDs (0 = no limit)
         self.config['LED']['PANEL_ROTATE'] = 0
         self.config['LED']['INVERTED_PANEL_ROWS'] = False
         self.config['LED']['SERIAL_CTRLR_PORT'] = None      # Serial port for LED-controller module
@@ -83,6 +84,8 @@ class Config:
         self.config['GENERAL']['SERIAL_PORTS'] = []
         self.config['GENERAL']['MOCK_NODES'] = 0
         self.config['GENERAL']['MOCK_NODE_SIGNAL'] = 0
+        self.config['GENERAL']['EMIT_COALESCE_MS'] = 75  # window for collapsing repeated UI list emits (0 = off)
+        self.config['GENERAL']['EVENT_WORKERS'] = 8  # greenlets running queued event handlers
         self.config['GENERAL']['LAST_MODIFIED_TIME'] = 0
 
         self.config['SECRETS']['ADMIN_USERNAME'] = 'admin'
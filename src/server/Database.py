@@ -2,16 +2,27 @@
 Database module
 '''
 
+import abc
 import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
 import RHUtils
 import logging
+import json
+import os
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+from util.GroupCommit import GroupCommit
 logger = logging.getLogger(__name__)
 
 DB_engine = None
 DB_session = None
 DB_URI = None
+DB_group_commit = None
+DB_data_version = 0  # incremented on commits that change data; never reset, so it stays unique across reinitializations
+DB_CACHE_ATTRS = {'results', '_cache_status'}  # stored results caches (writing them does not change data)
 
 Base = declarative_base()
 DB = sqlalchemy
@@ -36,6 +47,10 @@ racecontext = None
 # lap 1-N splits
 # heat 1-N node
 # round 1-N heat
+#
+# Secondary indexes cover foreign-key and attribute lookups not already served
+# by a unique constraint (SQLite indexes those; lookups on their leading
+# columns need no extra index)
 
 class Pilot(Base):
     __tablename__ = 'pilot'
@@ -81,6 +96,7 @@ class PilotAttribute(Base):
     __tablename__ = 'pilot_attribute'
     __table_args__ = (
         DB.UniqueConstraint('id', 'name'),
+        DB.Index('ix_pilot_attribute_name_value', 'name', 'value'),
     )
     id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False, primary_key=True)
     name = DB.Column(DB.String(80), nullable=False, primary_key=True)
@@ -88,6 +104,9 @@ class PilotAttribute(Base):
 
 class Heat(Base):
     __tablename__ = 'heat'
+    __table_args__ = (
+        DB.Index('ix_heat_class_id', 'class_id'),
+    )
     id = DB.Column(DB.Integer, primary_key=True)
     name = DB.Column('note', DB.String(80), nullable=True)
     auto_name = DB.Column(DB.String(80), nullable=True)
@@ -166,6 +185,7 @@ class HeatAttribute(Base):
     __tablename__ = 'heat_attribute'
     __table_args__ = (
         DB.UniqueConstraint('id', 'name'),
+        DB.Index('ix_heat_attribute_name_value', 'name', 'value'),
     )
     id = DB.Column(DB.Integer, DB.ForeignKey("heat.id"), nullable=False, primary_key=True)
     name = DB.Column(DB.String(80), nullable=False, primary_key=True)
@@ -175,6 +195,7 @@ class HeatNode(Base):
     __tablename__ = 'heat_node'
     __table_args__ = (
         DB.UniqueConstraint('heat_id', 'node_index'),
+        DB.Index('ix_heat_node_pilot_id', 'pilot_id'),
     )
     id = DB.Column(DB.Integer, primary_key=True)
     heat_id = DB.Column(DB.Integer, DB.ForeignKey("heat.id"), nullable=False)
@@ -267,6 +288,7 @@ class RaceClassAttribute(Base):
     __tablename__ = 'race_class_attribute'
     __table_args__ = (
         DB.UniqueConstraint('id', 'name'),
+        DB.Index('ix_race_class_attribute_name_value', 'name', 'value'),
     )
     id = DB.Column(DB.Integer, DB.ForeignKey("race_class.id"), nullable=False, primary_key=True)
     name = DB.Column(DB.String(80), nullable=False, primary_key=True)
@@ -294,6 +316,9 @@ class SavedRaceMeta(Base):
     __tablename__ = 'saved_race_meta'
     __table_args__ = (
         DB.UniqueConstraint('round_id', 'heat_id'),
+        DB.Index('ix_saved_race_meta_heat_id_round_id', 'heat_id', 'round_id'),
+        DB.Index('ix_saved_race_meta_class_id_round_id', 'class_id', 'round_id'),
+        DB.Index('ix_saved_race_meta_format_id', 'format_id'),
     )
     id = DB.Column(DB.Integer, primary_key=True)
     round_id = DB.Column(DB.Integer, nullable=False)
@@ -323,22 +348,111 @@ class SavedRaceMetaAttribute(Base):
     __tablename__ = 'saved_race_meta_attribute'
     __table_args__ = (
         DB.UniqueConstraint('id', 'name'),
+        DB.Index('ix_saved_race_meta_attribute_name_value', 'name', 'value'),
     )
     id = DB.Column(DB.Integer, DB.ForeignKey("saved_race_meta.id"), nullable=False, primary_key=True)
     name = DB.Column(DB.String(80), nullable=False, primary_key=True)
     value = DB.Column(DB.String(), nullable=True)
 
+class _RssiHistory(sqlalchemy.types.TypeDecorator, metaclass=abc.ABCMeta):
+    '''Stores a list of RSSI history numbers as a compressed binary blob:
+    a format byte, an array typecode byte, then zlib-compressed little-endian
+    array data. Legacy JSON text values are decoded on read, and JSON text
+    is accepted on write.'''
+    impl = DB.LargeBinary
+    cache_ok = True
+
+    FORMAT_RAW = 1
+    FORMAT_DELTA_MS = 2
+
+    @abc.abstractmethod
+    def _encode(self, values):
+        '''Returns packed blob (see '_pack()') for the given list of numbers'''
+
+    @abc.abstractmethod
+    def _decode(self, fmt, typecode, data):
+        '''Returns list of numbers for the given format, array typecode and uncompressed data'''
+
+    @staticmethod
+    def _array_bytes(typecode, items):
+        packed = array(typecode, items)
+        if sys.byteorder != 'little':
+            packed.byteswap()
+        return packed.tobytes()
+
+    @staticmethod
+    def _bytes_array(typecode, data):
+        unpacked = array(typecode)
+        unpacked.frombytes(data)
+        if sys.byteorder != 'little':
+            unpacked.byteswap()
+        return unpacked
+
+    @staticmethod
+    def _pack(fmt, typecode, data):
+        return bytes((fmt, ord(typecode))) + zlib.compress(data)
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        if isinstance(value, str):
+            value = json.loads(value)
+        return self._encode(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):  # legacy JSON text
+            return json.loads(value)
+        value = bytes(value)
+        return self._decode(value[0], chr(value[1]), zlib.decompress(value[2:]))
+
+class RssiHistoryValues(_RssiHistory):
+    '''RSSI levels; stored as uint8 or int16 when they fit'''
+    def _encode(self, values):
+        typecode = 'd'
+        if all(isinstance(val, int) for val in values):
+            if all(0 <= val <= 255 for val in values):
+                typecode = 'B'
+            elif all(-32768 <= val <= 32767 for val in values):
+                typecode = 'h'
+        return self._pack(self.FORMAT_RAW, typecode, self._array_bytes(typecode, values))
+
+    def _decode(self, fmt, typecode, data):
+        return self._bytes_array(typecode, data).tolist()
+
+class RssiHistoryTimes(_RssiHistory):
+    '''Timestamps in seconds; stored as the first time in ms (float64)
+    followed by int32 deltas in ms, i.e. at millisecond resolution'''
+    def _encode(self, values):
+        times_ms = [round(val * 1000) for val in values]
+        deltas = [times_ms[idx] - times_ms[idx - 1] for idx in range(1, len(times_ms))]
+        if deltas and (min(deltas) < -2**31 or max(deltas) >= 2**31):
+            return self._pack(self.FORMAT_RAW, 'd', self._array_bytes('d', values))
+        return self._pack(self.FORMAT_DELTA_MS, 'i',
+            self._array_bytes('d', times_ms[:1]) + self._array_bytes('i', deltas))
+
+    def _decode(self, fmt, typecode, data):
+        if fmt == self.FORMAT_DELTA_MS:
+            if not data:
+                return []
+            first = self._bytes_array('d', data[:8])[0]
+            deltas = self._bytes_array(typecode, data[8:])
+            return [time_ms / 1000 for time_ms in accumulate(deltas, initial=first)]
+        return self._bytes_array(typecode, data).tolist()
+
 class SavedPilotRace(Base):
     __tablename__ = 'saved_pilot_race'
     __table_args__ = (
         DB.UniqueConstraint('race_id', 'node_index'),
+        DB.Index('ix_saved_pilot_race_pilot_id', 'pilot_id'),
     )
     id = DB.Column(DB.Integer, primary_key=True)
     race_id = DB.Column(DB.Integer, DB.ForeignKey("saved_race_meta.id"), nullable=False)
     node_index = DB.Column(DB.Integer, nullable=False)
     pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=True)
-    history_values = DB.Column(DB.String, nullable=True)
-    history_times = DB.Column(DB.String, nullable=True)
+    history_values = DB.Column(RssiHistoryValues, nullable=True)
+    history_times = DB.Column(RssiHistoryTimes, nullable=True)
     penalty_time = DB.Column(DB.Integer, nullable=False)
     penalty_desc = DB.Column(DB.String, nullable=True)
     enter_at = DB.Column(DB.Integer, nullable=False)
@@ -350,6 +464,11 @@ class SavedPilotRace(Base):
 
 class SavedRaceLap(Base):
     __tablename__ = 'saved_race_lap'
+    __table_args__ = (
+        DB.Index('ix_saved_race_lap_pilotrace_id_lap_time_stamp', 'pilotrace_id', 'lap_time_stamp'),
+        DB.Index('ix_saved_race_lap_race_id', 'race_id'),
+        DB.Index('ix_saved_race_lap_pilot_id', 'pilot_id'),
+    )
     id = DB.Column(DB.Integer, primary_key=True)
     race_id = DB.Column(DB.Integer, DB.ForeignKey("saved_race_meta.id"), nullable=False)
     pilotrace_id = DB.Column(DB.Integer, DB.ForeignKey("saved_pilot_race.id"), nullable=False)
@@ -424,6 +543,7 @@ class RaceFormatAttribute(Base):
     __tablename__ = 'race_format_attribute'
     __table_args__ = (
         DB.UniqueConstraint('id', 'name'),
+        DB.Index('ix_race_format_attribute_name_value', 'name', 'value'),
     )
     id = DB.Column(DB.Integer, DB.ForeignKey("race_format.id"), nullable=False, primary_key=True)
     name = DB.Column(DB.String(80), nullable=False, primary_key=True)
@@ -461,22 +581,104 @@ def initialize(db_uri=None):
         cursor.execute("PRAGMA foreign_keys=ON")
         cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute("PRAGMA cache_size=-10000")
-        cursor.execute("PRAGMA synchronous=FULL")
+        # commits are not flushed to storage individually; 'DB_group_commit' syncs them in groups
+        #  (WAL keeps the database consistent; 'wait_durable()' is the durability barrier)
+        cursor.execute("PRAGMA synchronous=NORMAL")
         cursor.execute("PRAGMA busy_timeout=5000")
         cursor.close()
     
     from sqlalchemy import event
     event.listen(DB_engine, 'connect', set_pragmas)
+
+    global DB_group_commit
+    DB_group_commit = GroupCommit(logger, sync_database_files)
+    event.listen(DB_engine, 'commit', on_commit)
     
     global DB_session
-    DB_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, \
-                                             bind=DB_engine, expire_on_commit=False))
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=DB_engine, expire_on_commit=False)
+    event.listen(session_factory, 'after_flush', on_session_flush)
+    event.listen(session_factory, 'do_orm_execute', on_session_execute)
+    event.listen(session_factory, 'after_commit', on_session_commit)
+    event.listen(session_factory, 'after_rollback', on_session_rollback)
+    DB_session = scoped_session(session_factory)
     Base.query = DB_session.query_property()
 
+    global DB_data_version
+    DB_data_version += 1  # new database may hold different data
+
 def create_db_all():
     Base.metadata.create_all(bind=DB_engine)
+    create_db_indexes()
+
+def create_db_indexes():
+    '''Creates any model indexes missing from existing tables (create_all only indexes new tables).'''
+    with DB_engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def explain_query_plan(query):
+    '''Returns SQLite EXPLAIN QUERY PLAN detail strings for given ORM query.'''
+    statement = query.statement.compile(dialect=DB_engine.dialect, compile_kwargs={'literal_binds': True})
+    rows = DB_session.execute(sqlalchemy.text('EXPLAIN QUERY PLAN ' + str(statement))).fetchall()
+    return [row[-1] for row in rows]
+
+def on_commit(_conn):
+    DB_group_commit.notify()
+
+def on_session_flush(session, _flush_context):
+    if session.new or session.deleted or any(has_data_changes(obj) for obj in session.dirty):
+        session.info['data_changed'] = True
+
+def on_session_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['data_changed'] = True
+
+def on_session_commit(session):
+    if session.info.pop('data_changed', False):
+        global DB_data_version
+        DB_data_version += 1
+
+def on_session_rollback(session):
+    session.info.pop('data_changed', None)
+
+def has_data_changes(obj):
+    '''Returns True if object has changed attributes other than stored results caches.'''
+    for attr in sqlalchemy.inspect(obj).attrs:
+        if attr.key not in DB_CACHE_ATTRS and attr.history.has_changes():
+            return True
+    return False
+
+def get_data_version():
+    '''Returns token that changes whenever committed database data changes.'''
+    return DB_data_version
+
+def sync_database_files():
+    '''Flushes database and write-ahead-log files to storage.'''
+    db_path = DB_engine.url.database if DB_engine else None
+    if not db_path or db_path == ':memory:':
+        return
+    for path in (db_path + '-wal', db_path):
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def wait_durable(timeout=10):
+    '''Waits until all commits made so far have been flushed to storage.'''
+    if DB_group_commit:
+        return DB_group_commit.barrier(timeout)
+    return True
 
 def close_database():
+    global DB_group_commit
+    if DB_group_commit:
+        DB_group_commit.stop()
+        DB_group_commit = None
     global DB_session
     if DB_session:
         DB_session.remove()
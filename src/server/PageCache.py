@@ -3,8 +3,13 @@ Page Cache
 
 Stores cached results objects assembled via the Results module and database
 lap lists. If valid, served directly to results without rebuilding.
-buildToken is a monotonic timestamp so in-progress builds can be interrupted
-if new data becomes available during the build process.
+Concurrent requests share one in-progress build; a build is superseded (and
+abandoned) if a request arrives after new data has become available.
+
+The page is assembled from fragments (one per heat, one per class, and the
+event summary), each with its own data_ver/build_ver status. Invalidating a
+saved race marks its heat, class, and the event as dirty; only dirty
+fragments are rebuilt on the next request.
 
 '''
 
@@ -13,6 +18,7 @@ from time import monotonic
 from eventmanager import Evt
 import RHUtils
 import gevent
+from util.SingleFlight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -26,9 +32,11 @@ class PageCache:
         self._racecontext = RaceContext
         self._Events = Events
         self._cache = {} # Cache of complete results page
-        self._buildToken = False # Time of result generation or false if no results are being calculated
         self._valid = False # Whether cache is valid
-        self._inUpdateCacheFlag = False
+        self._data_ver = monotonic() # Time of last invalidation
+        self._flight = SingleFlight(logger, self._CACHE_TIMEOUT) # In-progress page build
+        self._fragments = {} # Cached page fragments, by (type, id)
+        self._fragment_status = {} # Fragment validity tokens, by (type, id)
 
     def get_cache(self):
         if self.get_valid(): # Output existing calculated results
@@ -39,33 +47,82 @@ class PageCache:
                 self.update_cache()
             return self._cache
 
-    def get_buildToken(self):
-        return self._buildToken
-
     def get_valid(self):
         return self._valid
 
     def set_cache(self, cache):
         self._cache = cache
 
-    def set_buildToken(self, buildToken):
-        self._buildToken = buildToken
-
     def set_valid(self, valid):
+        if not valid:
+            self._fragment_status = {} # invalidates every fragment
+            self._data_ver = monotonic()
         self._valid = valid
 
-    def check_buildToken(self, timing):
-        if self.get_buildToken():
-            gevent.sleep(0.001)
-            if self.get_buildToken() is True:
-                while True: # Pause this thread until calculations are completed
-                    gevent.sleep(0.25)
-                    if self.get_buildToken() is False:
-                        break
-                    elif monotonic() > self.get_buildToken() + self._CACHE_TIMEOUT:
-                        logger.warning('T%d: Timed out waiting for other cache build thread', timing['start'])
-                        self.set_buildToken(False)
-                        break
+    def invalidate_event(self, token=None):
+        self._invalidate_fragment(('event', None), token)
+
+    def invalidate_raceClass(self, raceClass_or_id, token=None):
+        if token is None:
+            token = monotonic()
+        class_id = self._racecontext.rhdata.resolve_id_from_raceClass_or_id(raceClass_or_id)
+        if class_id and class_id != RHUtils.CLASS_ID_NONE:
+            self._invalidate_fragment(('class', class_id), token)
+        self.invalidate_event(token)
+
+    def invalidate_heat(self, heat_or_id, token=None):
+        if token is None:
+            token = monotonic()
+        heat = self._racecontext.rhdata.resolve_heat_from_heat_or_id(heat_or_id)
+        if heat:
+            self._invalidate_fragment(('heat', heat.id), token)
+            self.invalidate_raceClass(heat.class_id, token)
+        else:
+            self.set_valid(False)
+
+    def invalidate_savedRaceMeta(self, savedRaceMeta_or_id, token=None):
+        '''Invalidates the fragments a saved race appears in: its heat, class, and the event'''
+        if token is None:
+            token = monotonic()
+        race = self._racecontext.rhdata.resolve_savedRaceMeta_from_savedRaceMeta_or_id(savedRaceMeta_or_id)
+        if race:
+            self.invalidate_heat(race.heat_id, token)
+            self.invalidate_raceClass(race.class_id, token)
+        else:
+            self.set_valid(False)
+
+    def _invalidate_fragment(self, key, token=None):
+        if token is None:
+            token = monotonic()
+        self._fragment_status[key] = {
+            'data_ver': token,
+            'build_ver': None
+        }
+        self._data_ver = token
+        self._valid = False
+
+    def _fragment_valid(self, key):
+        status = self._fragment_status.get(key)
+        return key in self._fragments and status is not None and status['data_ver'] == status['build_ver']
+
+    def _get_fragment(self, key, build_fn, *args):
+        if self._fragment_valid(key):
+            return self._fragments[key]
+
+        if key not in self._fragment_status:
+            self._fragment_status[key] = {
+                'data_ver': monotonic(),
+                'build_ver': None
+            }
+        token = self._fragment_status[key]['data_ver']
+
+        fragment = build_fn(*args)
+        self._fragments[key] = fragment
+
+        # fragment stays dirty if it was invalidated during the build
+        if self._fragment_status[key]['data_ver'] == token:
+            self._fragment_status[key]['build_ver'] = token
+        return fragment
 
     def update_cache(self):
         dbg_trace_str = ""
@@ -73,28 +130,17 @@ class PageCache:
             dbg_trace_str = RHUtils.getFnTracebackMsgStr("update_cache")
             logger.debug("Entered 'update_cache()', called from: {}".format(dbg_trace_str))
             dbg_trace_str = " (called from: {})".format(dbg_trace_str)
-        if self._inUpdateCacheFlag:
-            logger.info("Waiting for previous invocation of 'update_cache()' to finish{}".format(dbg_trace_str))
-            wait_count = 0
-            while True:
-                gevent.sleep(0.05)
-                if not self._inUpdateCacheFlag:
-                    logger.info("Previous invocation of 'update_cache()' finished; continuing{}".format(dbg_trace_str))
-                    break
-                wait_count += 1
-                if wait_count > 6000:
-                    logger.error("Timeout waiting for previous invocation of 'update_cache()' to finish{}".format(dbg_trace_str))
-                    break
-        self._inUpdateCacheFlag = True
-        try:
-            uc_result = self._do_update_cache()
-        finally:
-            self._inUpdateCacheFlag = False
+        if self._flight.inFlight('page'):
+            logger.info("Joining in-progress invocation of 'update_cache()'{}".format(dbg_trace_str))
+        data_ver = self._data_ver
+        uc_result = self._flight.run('page', data_ver, self._do_update_cache, data_ver)
+        if self._flight.inFlight('page'): # superseded; wait for newer build to finish
+            self._flight.wait('page')
         if logger.getEffectiveLevel() <= logging.DEBUG:  # if DEBUG msgs actually being logged
             logger.debug("Exiting 'update_cache()'{}".format(dbg_trace_str))
         return uc_result
 
-    def _do_update_cache(self):
+    def _do_update_cache(self, data_ver):
         '''Builds any invalid atomic result caches and creates final output'''
         timing = {
             'start': monotonic()
@@ -104,14 +150,11 @@ class PageCache:
         error_flag = False
         results = None
 
-        self.check_buildToken(timing) # Don't restart calculation if another calculation thread exists
-
         if self.get_valid(): # Output existing calculated results
             logger.info('T%d: Returning valid cache', timing['start'])
 
         else:
             timing['build_start'] = monotonic()
-            self.set_buildToken(monotonic())
 
             heats = {}
             all_heats = self._racecontext.rhdata.get_heats()
@@ -121,52 +164,22 @@ class PageCache:
                 h.group_id,
                 h.order,
             ))
+
+            # bulk-load saved races only for heats that need rebuilding
+            stale_heat_ids = {heat.id for heat in all_heats if not self._fragment_valid(('heat', heat.id))}
+            if stale_heat_ids:
+                race_data = self._racecontext.rhdata.get_savedRaceData(heat_ids=list(stale_heat_ids))
+                pilots = {pilot.id: pilot for pilot in self._racecontext.rhdata.get_pilots()}
+
             for heat in all_heats:
-                if self._racecontext.rhdata.savedRaceMetas_has_heat(heat.id):
-                    rounds = []
-                    for race in self._racecontext.rhdata.get_savedRaceMetas_by_heat(heat.id):    
-                        pilotraces = []
-                        for pilotrace in self._racecontext.rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id):
-                            gevent.sleep(0.001)
-                            laps = []
-                            for lap in self._racecontext.rhdata.get_savedRaceLaps_by_savedPilotRace(pilotrace.id):
-                                laps.append({
-                                    'id': lap.id,
-                                    'lap_time_stamp': lap.lap_time_stamp,
-                                    'lap_time': lap.lap_time,
-                                    'lap_time_formatted': lap.lap_time_formatted,
-                                    'source': lap.source,
-                                    'deleted': lap.deleted
-                                })
-
-                            pilot_data = self._racecontext.rhdata.get_pilot(pilotrace.pilot_id)
-                            if pilot_data:
-                                nodepilot = pilot_data.callsign
-                            else:
-                                nodepilot = None
-
-                            pilotraces.append({
-                                'callsign': nodepilot,
-                                'pilot_id': pilotrace.pilot_id,
-                                'node_index': pilotrace.node_index,
-                                'laps': laps
-                            })
-
-                        results = self._racecontext.rhdata.get_results_savedRaceMeta(race)
-                        rounds.append({
-                            'id': race.round_id,
-                            'start_time_formatted': race.start_time_formatted,
-                            'nodes': pilotraces,
-                            'leaderboard': results
-                        })
-
-                    results = self._racecontext.rhdata.get_results_heat(heat)
-                    heats[heat.id] = {
-                        'heat_id': heat.id,
-                        'displayname': heat.display_name,
-                        'rounds': rounds,
-                        'leaderboard': results
-                    }
+                if self._flight.isSuperseded('page', data_ver):
+                    logger.info('T%d: Abandoning superseded build', timing['start'])
+                    return True
+                if heat.id in stale_heat_ids:
+                    if heat.id in race_data['races_by_heat']:
+                        heats[heat.id] = self._get_fragment(('heat', heat.id), self._build_heat_fragment, heat, race_data, pilots)
+                elif ('heat', heat.id) in self._fragments:
+                    heats[heat.id] = self._fragments[('heat', heat.id)]
 
             timing['round_results'] = monotonic()
             logger.debug('T%d: heat_round results assembled in %.3fs', timing['start'], timing['round_results'] - timing['build_start'])
@@ -191,26 +204,30 @@ class PageCache:
             gevent.sleep(0.001)
             current_classes = {}
             for race_class in self._racecontext.rhdata.get_raceClasses():
-                results = self._racecontext.rhdata.get_results_raceClass(race_class)
-                ranking = self._racecontext.rhdata.get_ranking_raceClass(race_class)
-                current_class = {}
-                current_class['id'] = race_class.id
-                current_class['name'] = race_class.name
-                current_class['description'] = race_class.description
-                current_class['leaderboard'] = results
-                current_class['ranking'] = ranking
-
-                current_classes[race_class.id] = current_class
+                current_classes[race_class.id] = self._get_fragment(('class', race_class.id), self._build_class_fragment, race_class)
 
             timing['event'] = monotonic()
             logger.debug('T%d: results by class assembled in %.3fs', timing['start'], timing['event'] - timing['by_class'])
 
             gevent.sleep(0.001)
-            results = self._racecontext.rhdata.get_results_event()
+            results = self._get_fragment(('event', None), self._racecontext.rhdata.get_results_event)
 
             timing['event_end'] = monotonic()
             logger.debug('T%d: event results assembled in %.3fs', timing['start'], timing['event_end'] - timing['event'])
 
+            if self._flight.isSuperseded('page', data_ver):
+                logger.info('T%d: Abandoning superseded build', timing['start'])
+                return True
+
+            # drop fragments for heats and classes no longer on the page
+            page_keys = {('heat', heat_id) for heat_id in heats}
+            page_keys.update(('class', class_id) for class_id in current_classes)
+            page_keys.add(('event', None))
+            for key in set(self._fragments) | set(self._fragment_status):
+                if key not in page_keys:
+                    self._fragments.pop(key, None)
+                    self._fragment_status.pop(key, None)
+
             payload = {
                 'heats': heats,
                 'heats_by_class': heat_ids_by_class,
@@ -220,17 +237,72 @@ class PageCache:
             }
 
             self.set_cache(payload)
-            self.set_buildToken(False)
 
             if error_flag:
                 logger.warning('T%d: Cache results build failed; leaving page cache invalid', timing['start'])
                 # *** emit_priority_message(__("Results did not load completely. Please try again."), False)
                 self._Events.trigger(Evt.CACHE_FAIL)
             else:
-                self.set_valid(True)
+                # stays invalid if any fragment was invalidated while building
+                self._valid = all(self._fragment_valid(key) for key in page_keys)
                 self._Events.trigger(Evt.CACHE_READY)
 
         timing['end'] = monotonic()
 
         logger.info('T%d: Built results data in: %fs', timing['start'], timing['end'] - timing['start'])
         return not error_flag
+
+    def _build_heat_fragment(self, heat, race_data, pilots):
+        rounds = []
+        for race in race_data['races_by_heat'].get(heat.id, []):
+            pilotraces = []
+            for pilotrace in race_data['pilotraces_by_race'].get(race.id, []):
+                gevent.sleep(0.001)
+                laps = []
+                for lap in race_data['laps_by_pilotrace'].get(pilotrace.id, []):
+                    laps.append({
+                        'id': lap.id,
+                        'lap_time_stamp': lap.lap_time_stamp,
+                        'lap_time': lap.lap_time,
+                        'lap_time_formatted': lap.lap_time_formatted,
+                        'source': lap.source,
+                        'deleted': lap.deleted
+                    })
+
+                pilot_data = pilots.get(pilotrace.pilot_id)
+                if pilot_data:
+                    nodepilot = pilot_data.callsign
+                else:
+                    nodepilot = None
+
+                pilotraces.append({
+                    'callsign': nodepilot,
+                    'pilot_id': pilotrace.pilot_id,
+                    'node_index': pilotrace.node_index,
+                    'laps': laps
+                })
+
+            results = self._racecontext.rhdata.get_results_savedRaceMeta(race)
+            rounds.append({
+                'id': race.round_id,
+                'start_time_formatted': race.start_time_formatted,
+                'nodes': pilotraces,
+                'leaderboard': results
+            })
+
+        results = self._racecontext.rhdata.get_results_heat(heat)
+        return {
+            'heat_id': heat.id,
+            'displayname': heat.display_name,
+            'rounds': rounds,
+            'leaderboard': results
+        }
+
+    def _build_class_fragment(self, race_class):
+        return {
+            'id': race_class.id,
+            'name': race_class.name,
+            'description': race_class.description,
+            'leaderboard': self._racecontext.rhdata.get_results_raceClass(race_class),
+            'ranking': self._racecontext.rhdata.get_ranking_raceClass(race_class),
+        }
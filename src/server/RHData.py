@@ -6,9 +6,11 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import gevent
 import sqlalchemy
 from sqlalchemy import create_engine, MetaData, Table, inspect
 from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.orm import load_only
 from datetime import datetime
 import os
 import traceback
@@ -29,8 +31,11 @@ APP.app_context().push()
 
 Position_place_strings = None
 
+RACE_LIST_FRAGMENT_BATCH = 200  # races per pilotrace query when (re)loading race list fragments
+
 class RHData():
     _OptionsCache = {} # Local Python cache for global settings
+    _OptionsIntCache = {} # Settings parsed as int (None if empty or invalid), filled on first read
     TEAM_NAMES_LIST = [str(chr(i)) for i in range(65, 91)]  # list of 'A' to 'Z' strings
 
     def __init__(self, Events, RaceContext, SERVER_API, DB_FILE_NAME, DB_BKP_DIR_NAME):
@@ -40,6 +45,7 @@ class RHData():
         self._DB_FILE_NAME = DB_FILE_NAME
         self._DB_BKP_DIR_NAME = DB_BKP_DIR_NAME
         self._filters = RaceContext.filters
+        self._race_list_fragments = {}  # race_id -> (data_ver, pilotrace rows), see 'get_savedRaceListing'
 
     def __(self, *args, **kwargs):
         return self._racecontext.language.__(*args, **kwargs)
@@ -69,10 +75,47 @@ class RHData():
             logger.error('Error checking database integrity; err: ' + str(ex))
             return False
 
+    # Query plan diagnostics
+    def get_query_plans(self):
+        '''Returns EXPLAIN QUERY PLAN details for hot lookup queries, by query name'''
+        queries = {
+            'savedRaceLaps_by_savedPilotRace': Database.SavedRaceLap.query.filter_by(pilotrace_id=1) \
+                .order_by(Database.SavedRaceLap.lap_time_stamp),
+            'savedRaceLaps_by_savedRaceMeta': Database.SavedRaceLap.query.filter_by(race_id=1),
+            'savedPilotRaces_by_savedRaceMeta': Database.SavedPilotRace.query.filter_by(race_id=1),
+            'savedRaceMetas_by_heat': Database.SavedRaceMeta.query.filter_by(heat_id=1) \
+                .order_by(Database.SavedRaceMeta.round_id),
+            'savedRaceMetas_by_raceClass': Database.SavedRaceMeta.query.filter_by(class_id=1) \
+                .order_by(Database.SavedRaceMeta.round_id),
+            'heatNodes_by_heat': Database.HeatNode.query.filter_by(heat_id=1) \
+                .order_by(Database.HeatNode.node_index),
+            'heatNodes_by_pilot': Database.HeatNode.query.filter_by(pilot_id=1),
+            'heats_by_class': Database.Heat.query.filter_by(class_id=1),
+            'lapSplits_by_lap': Database.LapSplit.query.filter_by(node_index=0, lap_id=1),
+            'pilotAttribute': Database.PilotAttribute.query.filter_by(id=1, name='name'),
+            'pilotAttributes_by_value': Database.PilotAttribute.query.filter_by(name='name', value='value'),
+            'heatAttributes_by_value': Database.HeatAttribute.query.filter_by(name='name', value='value'),
+            'raceClassAttributes_by_value': Database.RaceClassAttribute.query.filter_by(name='name', value='value'),
+            'raceFormatAttributes_by_value': Database.RaceFormatAttribute.query.filter_by(name='name', value='value'),
+        }
+        return {name: Database.explain_query_plan(query) for name, query in queries.items()}
+
+    def log_query_plans(self):
+        '''Logs query plans for hot lookups; warns about any that scan a whole table'''
+        try:
+            for name, plan in self.get_query_plans().items():
+                if any(step.startswith('SCAN') for step in plan):
+                    logger.warning("Query plan for '{}' scans table: {}".format(name, '; '.join(plan)))
+                else:
+                    logger.debug("Query plan for '{}': {}".format(name, '; '.join(plan)))
+        except Exception as ex:
+            logger.warning('Unable to check query plans: ' + str(ex))
+
     # Caching
     def primeCache(self):
         settings = Database.GlobalSettings.query.all()
         self._OptionsCache = {} # empty cache
+        self._OptionsIntCache = {}
         for setting in settings:
             self._OptionsCache[setting.option_name] = setting.option_value
 
@@ -117,6 +160,14 @@ class RHData():
             logger.error('Error writing to database: ' + str(ex))
             return False
 
+    def wait_durable(self, timeout=10):
+        '''Waits until committed data has been flushed to storage (commits are synced in groups)'''
+        return Database.wait_durable(timeout)
+
+    def get_data_version(self):
+        '''Returns token that changes whenever committed data changes (for caching derived output)'''
+        return Database.get_data_version()
+
     def rollback(self):
         try:
             Database.DB_session.rollback()
@@ -373,6 +424,8 @@ class RHData():
             'stage_2': False,
         }
 
+        self.invalidate_savedRaceListing()
+
         migrate_db_api = 0  # default to delta5 or very old RH versions
         options_query_data = None
         pilot_query_data = None
@@ -500,6 +553,16 @@ class RHData():
                     if raceLap['pilot_id'] == 0:
                         raceLap['pilot_id'] = None
 
+            # Convert JSON RSSI history to lists (stored as compact binary)
+            if migrate_db_api < 48 and racePilot_query_data:
+                for racePilot in racePilot_query_data:
+                    for history_key in ('history_values', 'history_times'):
+                        if isinstance(racePilot.get(history_key), str):
+                            try:
+                                racePilot[history_key] = json.loads(racePilot[history_key])
+                            except ValueError:
+                                racePilot[history_key] = None
+
             recover_status['stage_0'] = True
         except Exception as ex:
             logger.warning('Error reading data from previous database (stage 0):  ' + str(ex))
@@ -973,17 +1036,17 @@ class RHData():
                         race_list.append(race)
 
             if len(race_list):
-                self._racecontext.pagecache.set_valid(False)
                 self.clear_results_event()
 
                 for race in race_list:
                     self.clear_results_savedRaceMeta(race)
+                    self._racecontext.pagecache.invalidate_savedRaceMeta(race)
 
                 self.commit()
 
         return pilot, race_list
 
-    def set_pilot_used_frequency(self, pilot_or_id, frequency):
+    def set_pilot_used_frequency(self, pilot_or_id, frequency, commit=True):
         pilot = self.resolve_pilot_from_pilot_or_id(pilot_or_id) 
         if pilot:
             if pilot.used_frequencies:
@@ -1001,7 +1064,8 @@ class RHData():
             used_freqs.append(frequency)
 
             pilot.used_frequencies = json.dumps(used_freqs)
-            self.commit()
+            if commit:
+                self.commit()
             return pilot
         return False
 
@@ -1104,6 +1168,16 @@ class RHData():
     def get_heats(self):
         return Database.Heat.query.all()
 
+    def get_heats_page(self, after_id=0, limit=None):
+        '''Returns heats with id greater than 'after_id', in id order (keyset pagination).
+        Only the columns needed for naming are loaded (not cached results).'''
+        query = Database.Heat.query.options(load_only(Database.Heat.id, Database.Heat.name, \
+            Database.Heat.auto_name, Database.Heat.class_id, Database.Heat.group_id)) \
+            .filter(Database.Heat.id > after_id).order_by(Database.Heat.id)
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
     def get_heats_by_class(self, class_id):
         return Database.Heat.query.filter_by(class_id=class_id).all()
 
@@ -1280,7 +1354,7 @@ class RHData():
             slot = None
 
         if 'name' in data:
-            self._racecontext.pagecache.set_valid(False)
+            self._racecontext.pagecache.invalidate_heat(heat)
             heat.name = data['name']
         if 'class' in data:
             old_class_id = heat.class_id
@@ -1328,7 +1402,6 @@ class RHData():
         # update source names:
         if 'name' in data:
             if heat.results:
-                self._racecontext.pagecache.set_valid(False)
                 new_result = Results.refresh_source_displayname(self._racecontext, heat.results, heat.id)
                 heat.results = None
                 Database.DB_session.flush()
@@ -1338,7 +1411,6 @@ class RHData():
             if heat.class_id != RHUtils.CLASS_ID_NONE:
                 race_class = Database.RaceClass.query.get(heat.class_id)
                 if race_class.results:
-                    self._racecontext.pagecache.set_valid(False)
                     new_result = Results.refresh_source_displayname(self._racecontext, race_class.results, heat.id)
                     race_class.results = None
                     Database.DB_session.flush()
@@ -1347,7 +1419,6 @@ class RHData():
         if 'name' in data and not ('pilot' in data or 'class' in data):
             try:
                 event_results = json.loads(self.get_option("eventResults"))
-                self._racecontext.pagecache.set_valid(False)
                 event_results = Results.refresh_source_displayname(self._racecontext, event_results, heat.id)
                 self.set_option("eventResults", json.dumps(event_results))
             except:
@@ -1681,7 +1752,7 @@ class RHData():
 
         # cache rebuild
         logger.debug('Building Heat {} results'.format(heat.id))
-        build = Results.build_leaderboard_heat(self._racecontext, heat)
+        build = Results.results_flight.run(('heat', heat.id), token, Results.build_leaderboard_heat, self._racecontext, heat)
 
         self.set_results_heat(heat, token, build)
         return build
@@ -1796,6 +1867,16 @@ class RHData():
     def get_heatNodes_by_heat(self, heat_id):
         return Database.HeatNode.query.filter_by(heat_id=heat_id).order_by(Database.HeatNode.node_index).all()
 
+    def get_heatNode_pilots_by_heats(self, heat_ids):
+        '''Returns {heat_id: {node_index: pilot_id}} for the given heats, using a single query'''
+        pilots = {heat_id: {} for heat_id in heat_ids}
+        rows = Database.DB_session.query(Database.HeatNode.heat_id, Database.HeatNode.node_index, \
+            Database.HeatNode.pilot_id).filter(Database.HeatNode.heat_id.in_(heat_ids)) \
+            .order_by(Database.HeatNode.heat_id, Database.HeatNode.node_index)
+        for heat_id, node_index, pilot_id in rows:
+            pilots[heat_id][node_index] = pilot_id
+        return pilots
+
     def add_heatNode(self, heat_id, node_index):
         new_heatNode = Database.HeatNode(
             heat_id=heat_id,
@@ -2064,7 +2145,7 @@ class RHData():
 
         if 'class_name' in data:
             if len(race_list):
-                self._racecontext.pagecache.set_valid(False)
+                self._racecontext.pagecache.invalidate_raceClass(race_class)
 
         if 'class_format' in data or \
            'win_condition' in data or \
@@ -2172,7 +2253,7 @@ class RHData():
 
         # cache rebuild
         logger.info('Building Class {} (id: {}) results'.format(race_class.display_name, race_class.id))
-        build = Results.build_leaderboard_class(self._racecontext, race_class)
+        build = Results.results_flight.run(('class', race_class.id), token, Results.build_leaderboard_class, self._racecontext, race_class)
         self.set_results_raceClass(race_class, token, build)
         return build
 
@@ -2207,7 +2288,7 @@ class RHData():
 
         # cache rebuild
         logger.debug('Building Class {} ranking'.format(race_class.id))
-        build = Results.calc_class_ranking_leaderboard(self._racecontext, class_id=race_class.id)
+        build = Results.results_flight.run(('class_ranking', race_class.id), token, Results.calc_class_ranking_leaderboard, self._racecontext, class_id=race_class.id)
         self.set_ranking_raceClass(race_class.id, token, build)
         return build
 
@@ -3104,7 +3185,7 @@ class RHData():
 
         self.commit()
 
-    def add_savedRaceMeta(self, data):
+    def add_savedRaceMeta(self, data, commit=True):
         if int(data['class_id'] or 0) == 0:
             data['class_id'] = RHUtils.CLASS_ID_NONE
 
@@ -3121,14 +3202,14 @@ class RHData():
             })
         )
         Database.DB_session.add(new_race)
-
-        self.commit()
+        Database.DB_session.flush()  # assigns id
 
         # ensure clean attributes on creation
         for attr in self.get_savedrace_attributes(new_race):
             Database.DB_session.delete(attr)
 
-        self.commit()
+        if commit:  # otherwise committed with race data (see 'add_race_data')
+            self.commit()
 
         logger.info('Race added: Race {0}'.format(new_race.id))
 
@@ -3186,6 +3267,8 @@ class RHData():
                     pilot_race.pilot_id = np.pilot_id
                     break
 
+        self.invalidate_savedRaceListing(race_meta.id)
+
         # renumber rounds
         Database.DB_session.flush()
         old_heat_races = Database.SavedRaceMeta.query.filter_by(heat_id=old_heat_id) \
@@ -3285,6 +3368,11 @@ class RHData():
 
         # cache rebuild
         logger.debug('Building Race {} (Heat {} Round {}) results'.format(race.id, race.heat_id, race.round_id))
+        build = Results.results_flight.run(('race', race.id), token, self._build_results_savedRaceMeta, race)
+        self.set_results_savedRaceMeta(race, token, build)
+        return build
+
+    def _build_results_savedRaceMeta(self, race):
         build = Results.build_leaderboard_race(self._racecontext, heat_id=race.heat_id, round_id=race.round_id)
 
         # calc race points
@@ -3301,7 +3389,6 @@ class RHData():
                 build = self._racecontext.race_points_manager.assign(method_type, build, settings)
                 build['meta']['primary_points'] = True
 
-        self.set_results_savedRaceMeta(race, token, build)
         return build
 
     def set_results_savedRaceMeta(self, savedRaceMeta_or_id, token, results):
@@ -3362,6 +3449,13 @@ class RHData():
                 Database.SavedRaceMeta.round_id
             )).filter_by(heat_id=heat_id).scalar() or 0)
 
+    def get_max_rounds_by_heats(self, heat_ids):
+        '''Returns {heat_id: max_round} for the given heats that have saved races, using a single query'''
+        return dict(Database.DB_session.query(Database.SavedRaceMeta.heat_id, \
+            Database.DB.func.max(Database.SavedRaceMeta.round_id)) \
+            .filter(Database.SavedRaceMeta.heat_id.in_(heat_ids)) \
+            .group_by(Database.SavedRaceMeta.heat_id).all())
+
     def get_round_num_for_heat(self, heat_id):
         if heat_id and heat_id is not RHUtils.HEAT_ID_NONE:
             round_idx = self.get_max_round(heat_id)
@@ -3401,6 +3495,16 @@ class RHData():
     def get_savedPilotRaces_by_savedRaceMeta(self, race_id):
         return Database.SavedPilotRace.query.filter_by(race_id=race_id).all()
 
+    def get_savedPilotRaces_page(self, race_id, after_id=0, limit=None):
+        '''Returns pilot races for a saved race with id greater than 'after_id', in id order (keyset pagination)'''
+        query = Database.SavedPilotRace.query.options(load_only(Database.SavedPilotRace.id, \
+            Database.SavedPilotRace.pilot_id, Database.SavedPilotRace.node_index)) \
+            .filter(Database.SavedPilotRace.race_id == race_id, Database.SavedPilotRace.id > after_id) \
+            .order_by(Database.SavedPilotRace.id)
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
     def alter_savedPilotRace(self, data):
         pilotrace = Database.SavedPilotRace.query.get(data['pilotrace_id'])
 
@@ -3423,12 +3527,84 @@ class RHData():
     def get_savedRaceLaps_by_savedPilotRace(self, pilotrace_id):
         return Database.SavedRaceLap.query.filter_by(pilotrace_id=pilotrace_id).order_by(Database.SavedRaceLap.lap_time_stamp).all()
 
+    def get_savedRaceLap_rows_by_savedPilotRaces(self, pilotrace_ids, columns):
+        '''Returns {pilotrace_id: [row, ...]} of the named lap columns (in time order) for the given
+        pilot races, using a single query; rows support access by column name'''
+        rows = {pilotrace_id: [] for pilotrace_id in pilotrace_ids}
+        lap_columns = [getattr(Database.SavedRaceLap, column) for column in columns]
+        query = Database.DB_session.query(Database.SavedRaceLap.pilotrace_id, *lap_columns) \
+            .filter(Database.SavedRaceLap.pilotrace_id.in_(pilotrace_ids)) \
+            .order_by(Database.SavedRaceLap.pilotrace_id, Database.SavedRaceLap.lap_time_stamp)
+        for row in query:
+            rows[row.pilotrace_id].append(row)
+        return rows
+
     def get_active_savedRaceLaps(self):
         return Database.SavedRaceLap.query.filter(Database.SavedRaceLap.deleted != 1).all()
 
     def get_active_savedRaceLaps_by_savedPilotRace(self, pilotrace_id):
         return Database.SavedRaceLap.query.filter(Database.SavedRaceLap.deleted != 1, Database.SavedRaceLap.pilotrace_id == pilotrace_id).order_by(Database.SavedRaceLap.lap_time_stamp).all()
 
+    # Saved race bulk reads
+    def get_savedRaceData(self, heat_ids=None, class_ids=None, include_laps=True):
+        '''Loads saved races for the given heats and/or classes (all if neither
+        is given) with their pilotraces and laps in one query per table.
+        Pilotraces and laps are returned as lightweight rows, grouped by parent id.'''
+        SavedRaceMeta = Database.SavedRaceMeta
+        SavedPilotRace = Database.SavedPilotRace
+        SavedRaceLap = Database.SavedRaceLap
+
+        race_filters = []
+        if heat_ids is not None:
+            race_filters.append(SavedRaceMeta.heat_id.in_(heat_ids))
+        if class_ids is not None:
+            race_filters.append(SavedRaceMeta.class_id.in_(class_ids))
+        if len(race_filters) > 1:
+            race_filters = [sqlalchemy.or_(*race_filters)]
+
+        races_by_heat = {}
+        pilotraces_by_race = {}
+        laps_by_pilotrace = {}
+
+        races = SavedRaceMeta.query.filter(*race_filters) \
+            .order_by(SavedRaceMeta.heat_id, SavedRaceMeta.round_id).all()
+        for race in races:
+            races_by_heat.setdefault(race.heat_id, []).append(race)
+
+        if races:
+            pilotraces = Database.DB_session.query(
+                    SavedPilotRace.id,
+                    SavedPilotRace.race_id,
+                    SavedPilotRace.node_index,
+                    SavedPilotRace.pilot_id,
+                    SavedPilotRace.frequency,
+                ).join(SavedRaceMeta, SavedPilotRace.race_id == SavedRaceMeta.id) \
+                .filter(*race_filters) \
+                .order_by(SavedPilotRace.race_id, SavedPilotRace.id).all()
+            for pilotrace in pilotraces:
+                pilotraces_by_race.setdefault(pilotrace.race_id, []).append(pilotrace)
+
+            if include_laps:
+                laps = Database.DB_session.query(
+                        SavedRaceLap.id,
+                        SavedRaceLap.pilotrace_id,
+                        SavedRaceLap.lap_time_stamp,
+                        SavedRaceLap.lap_time,
+                        SavedRaceLap.lap_time_formatted,
+                        SavedRaceLap.source,
+                        SavedRaceLap.deleted,
+                    ).join(SavedRaceMeta, SavedRaceLap.race_id == SavedRaceMeta.id) \
+                    .filter(*race_filters) \
+                    .order_by(SavedRaceLap.pilotrace_id, SavedRaceLap.lap_time_stamp, SavedRaceLap.id).all()
+                for lap in laps:
+                    laps_by_pilotrace.setdefault(lap.pilotrace_id, []).append(lap)
+
+        return {
+            'races_by_heat': races_by_heat,
+            'pilotraces_by_race': pilotraces_by_race,
+            'laps_by_pilotrace': laps_by_pilotrace,
+        }
+
     # Race general
     def replace_savedRaceLaps(self, data):
         Database.SavedRaceLap.query.filter_by(pilotrace_id=data['pilotrace_id']).delete()
@@ -3449,37 +3625,114 @@ class RHData():
         self.commit()
         return True
 
+    def get_savedRaceListing(self):
+        '''Loads saved race summaries for the race list, grouped by heat id.
+        Race columns are read in one query; the pilotraces of each race are kept
+        as a cached fragment, reloaded (in batches) only for races saved, resaved
+        or altered since the last call. Fragments of deleted races are dropped.'''
+        SavedRaceMeta = Database.SavedRaceMeta
+        SavedPilotRace = Database.SavedPilotRace
+
+        races = Database.DB_session.query(
+                SavedRaceMeta.id,
+                SavedRaceMeta.heat_id,
+                SavedRaceMeta.round_id,
+                SavedRaceMeta.format_id,
+                SavedRaceMeta.start_time,
+                SavedRaceMeta.start_time_formatted,
+                SavedRaceMeta._cache_status,
+            ).order_by(SavedRaceMeta.heat_id, SavedRaceMeta.round_id).all()
+
+        fragments = self._race_list_fragments
+        tokens = {}
+        stale_ids = []
+        for race in races:
+            try:
+                token = json.loads(race._cache_status)['data_ver']
+            except (TypeError, ValueError, KeyError):
+                token = None  # never matches; reloaded every time
+            tokens[race.id] = token
+            fragment = fragments.get(race.id)
+            if fragment is None or token is None or fragment[0] != token:
+                stale_ids.append(race.id)
+
+        for race_id in [race_id for race_id in fragments if race_id not in tokens]:
+            del fragments[race_id]
+
+        for batch_start in range(0, len(stale_ids), RACE_LIST_FRAGMENT_BATCH):
+            if batch_start:
+                gevent.sleep(0)  # let other greenlets run between batches
+            batch_ids = stale_ids[batch_start:batch_start + RACE_LIST_FRAGMENT_BATCH]
+            pilotraces_by_race = {race_id: [] for race_id in batch_ids}
+            for pilotrace in Database.DB_session.query(
+                    SavedPilotRace.id,
+                    SavedPilotRace.race_id,
+                    SavedPilotRace.node_index,
+                    SavedPilotRace.pilot_id,
+                    SavedPilotRace.frequency,
+                ).filter(SavedPilotRace.race_id.in_(batch_ids)) \
+                .order_by(SavedPilotRace.race_id, SavedPilotRace.id).all():
+                pilotraces_by_race[pilotrace.race_id].append(pilotrace)
+            for race_id, pilotraces in pilotraces_by_race.items():
+                fragments[race_id] = (tokens[race_id], pilotraces)
+
+        races_by_heat = {}
+        for race in races:
+            races_by_heat.setdefault(race.heat_id, []).append(race)
+
+        return {
+            'races_by_heat': races_by_heat,
+            'pilotraces_by_race': {race_id: fragment[1] for race_id, fragment in fragments.items()},
+        }
+
+    def invalidate_savedRaceListing(self, race_id=None):
+        '''Drops cached race list fragment for given race (all races if none given)'''
+        if race_id is None:
+            self._race_list_fragments.clear()
+        else:
+            self._race_list_fragments.pop(race_id, None)
+
     # Race general
     def add_race_data(self, data):
-        for node_index, node_data in data.items():
-            new_pilotrace = Database.SavedPilotRace(
-                race_id=node_data['race_id'],
-                node_index=node_index,
-                pilot_id=node_data['pilot_id'],
-                history_values=node_data['history_values'],
-                history_times=node_data['history_times'],
-                penalty_time=0,
-                enter_at=node_data['enter_at'],
-                exit_at=node_data['exit_at'],
-                frequency=node_data['frequency']
-            )
+        '''Saves pilot races and their laps (by node index) with bulk inserts and a single commit.
+        Optional 'used_frequency' in node data is recorded for the pilot in the same commit.'''
+        node_indexes = list(data.keys())
+        if node_indexes:
+            pilotrace_ids = Database.DB_session.scalars(
+                sqlalchemy.insert(Database.SavedPilotRace).returning(Database.SavedPilotRace.id, sort_by_parameter_order=True),
+                [{
+                    'race_id': data[node_index]['race_id'],
+                    'node_index': node_index,
+                    'pilot_id': data[node_index]['pilot_id'],
+                    'history_values': data[node_index].get('history_values'),
+                    'history_times': data[node_index].get('history_times'),
+                    'penalty_time': 0,
+                    'enter_at': data[node_index]['enter_at'],
+                    'exit_at': data[node_index]['exit_at'],
+                    'frequency': data[node_index].get('frequency'),
+                } for node_index in node_indexes]).all()
+
+            lap_rows = []
+            for node_index, pilotrace_id in zip(node_indexes, pilotrace_ids):
+                node_data = data[node_index]
+                for lap in node_data.get('laps', []):
+                    lap_rows.append({
+                        'race_id': node_data['race_id'],
+                        'pilotrace_id': pilotrace_id,
+                        'node_index': node_index,
+                        'pilot_id': node_data['pilot_id'],
+                        'lap_time_stamp': lap.lap_time_stamp,
+                        'lap_time': lap.lap_time,
+                        'lap_time_formatted': lap.lap_time_formatted,
+                        'source': lap.source,
+                        'deleted': lap.deleted
+                    })
+            if lap_rows:
+                Database.DB_session.execute(sqlalchemy.insert(Database.SavedRaceLap), lap_rows)
 
-            Database.DB_session.add(new_pilotrace)
-            Database.DB_session.flush()
-            Database.DB_session.refresh(new_pilotrace)
-
-            for lap in node_data['laps']:
-                Database.DB_session.add(Database.SavedRaceLap(
-                    race_id=node_data['race_id'],
-                    pilotrace_id=new_pilotrace.id,
-                    node_index=node_index,
-                    pilot_id=node_data['pilot_id'],
-                    lap_time_stamp=lap.lap_time_stamp,
-                    lap_time=lap.lap_time,
-                    lap_time_formatted=lap.lap_time_formatted,
-                    source=lap.source,
-                    deleted=lap.deleted
-                ))
+            for node_data in data.values():
+                if node_data.get('used_frequency'):
+                    self.set_pilot_used_frequency(node_data['pilot_id'], node_data['used_frequency'], commit=False)
 
         self.commit()
         return True
@@ -3490,6 +3743,7 @@ class RHData():
         Database.DB_session.query(Database.SavedRaceLap).delete()
         Database.DB_session.query(Database.SavedPilotRace).delete()
         Database.DB_session.query(Database.SavedRaceMeta).delete()
+        self.invalidate_savedRaceListing()
         for heat in self.get_heats():
             heat.active = True
         self.commit()
@@ -3566,15 +3820,15 @@ class RHData():
         return True if option in self._OptionsCache else False
 
     def get_option(self, option, default_value=None):
-        try:
-            val = self._OptionsCache[option]
-            if val or val == "":
-                output = val
-            else:
-                output = default_value
-        except:
+        val = self._OptionsCache.get(option)
+        if val or val == "":
+            output = val
+        else:
             output = default_value
 
+        if Flt.OPTION_GET not in self._filters.activeTypes:
+            return output
+
         return self._filters.run_filters(Flt.OPTION_GET, output, {
             'option': option,
             'default_value': default_value
@@ -3589,6 +3843,7 @@ class RHData():
             value = '1' if value else '0'
 
         self._OptionsCache[option] = str(value)
+        self._OptionsIntCache.pop(option, None)
 
         settings = Database.GlobalSettings.query.filter_by(option_name=option).one_or_none()
         if settings:
@@ -3599,19 +3854,30 @@ class RHData():
 
     def get_optionInt(self, option, default_value=0):
         try:
-            val = self._OptionsCache[option]
-            if val:
-                output = int(val)
-            else:
-                output = default_value
-        except:
+            output = self._OptionsIntCache[option]
+        except KeyError:
+            output = self._OptionsIntCache[option] = self._parse_optionInt(option)
+
+        if output is None:
             output = default_value
 
+        if Flt.OPTION_GET_INT not in self._filters.activeTypes:
+            return output
+
         return self._filters.run_filters(Flt.OPTION_GET_INT, output, {
             'option': option,
             'default_value': default_value
         })
 
+    def _parse_optionInt(self, option):
+        try:
+            val = self._OptionsCache[option]
+            if val:
+                return int(val)
+        except:
+            pass
+        return None
+
     def delete_option(self, option):
         Database.GlobalSettings.query.filter_by(option_name=option).delete()
         self.commit()
@@ -3669,7 +3935,7 @@ class RHData():
 
         # cache rebuild
         logger.debug('Building Event results')
-        build = Results.build_leaderboard_event(self._racecontext)
+        build = Results.results_flight.run(('event',), token, Results.build_leaderboard_event, self._racecontext)
         self.set_results_event(token, build)
         return build
 
@@ -73,6 +73,7 @@ class RHRace():
         self.coop_best_time = 0.0  # best time achieved in co-op racing mode (seconds)
         self.coop_num_laps = 0     # best # of laps in co-op racing mode
         self.node_laps = {} # current race lap objects, by node
+        self.lap_stats = Results.RaceLapStats() # running lap aggregates, by node
         self.node_has_finished = {}     # True if pilot for node has finished race
         self.node_finished_effect = {}  # True if effect for pilot-finished for node has been triggered
         self.node_fin_effect_wait_count = 0  # number of finished effects waiting for all crossings completed
@@ -432,8 +433,7 @@ class RHRace():
                 self.start_time_formatted = RHTimeFns.datetimeToFormattedStr(self.start_time) # record standard-formatted time
 
                 for node in self._racecontext.interface.nodes:
-                    node.history_values = [] # clear race history
-                    node.history_times = []
+                    node.history.clear() # clear race history
                     node.under_min_lap_count = 0
                     # clear any lingering crossing (if rssi>enterAt then first crossing starts now)
                     if node.crossing_flag and node.frequency > 0 and (
@@ -643,7 +643,7 @@ class RHRace():
                     'start_time_formatted': self.start_time_formatted,
                     }
 
-                new_race = self._racecontext.rhdata.add_savedRaceMeta(new_race_data)
+                new_race = self._racecontext.rhdata.add_savedRaceMeta(new_race_data, commit=False)  # committed with race data
                 self.db_id = new_race.id
 
                 race_data = {}
@@ -656,21 +656,21 @@ class RHRace():
                             race_data[node_index] = {
                                 'race_id': new_race.id,
                                 'pilot_id': pilot_id,
-                                'history_values': json.dumps(self._racecontext.interface.nodes[node_index].history_values),
-                                'history_times': json.dumps(self._racecontext.interface.nodes[node_index].history_times),
+                                'history_values': self._racecontext.interface.nodes[node_index].history_values,
+                                'history_times': self._racecontext.interface.nodes[node_index].history_times,
                                 'enter_at': self._racecontext.interface.nodes[node_index].enter_at_level,
                                 'exit_at': self._racecontext.interface.nodes[node_index].exit_at_level,
                                 'frequency': self._racecontext.interface.nodes[node_index].frequency,
-                                'laps': self.node_laps[node_index]
+                                'laps': self.node_laps[node_index],
+                                'used_frequency': {
+                                    'b': profile_freqs["b"][node_index],
+                                    'c': profile_freqs["c"][node_index],
+                                    'f': profile_freqs["f"][node_index]
+                                    }
                                 }
 
-                            self._racecontext.rhdata.set_pilot_used_frequency(pilot_id, {
-                                'b': profile_freqs["b"][node_index],
-                                'c': profile_freqs["c"][node_index],
-                                'f': profile_freqs["f"][node_index]
-                                })
-
                 self._racecontext.rhdata.add_race_data(race_data)
+                self._racecontext.rhdata.wait_durable()  # saved race is on storage before it is announced
 
                 self._racecontext.events.trigger(Evt.LAPS_SAVE, {
                     'race_id': new_race.id,
@@ -729,18 +729,25 @@ class RHRace():
                     self.set_heat(next_heat)
 
                 # spawn thread for updating results caches
-                gevent.spawn(self.rebuild_page_cache)
+                gevent.spawn(self.rebuild_page_cache, new_race.id)
 
                 self._racecontext.rhui.emit_race_saved(new_race, race_data)
 
-    def rebuild_page_cache(self):
-        self._racecontext.pagecache.set_valid(False)
-        self._racecontext.rhui.emit_result_data()
+    def rebuild_page_cache(self, race_id=None):
+        with self._racecontext.rhdata.get_db_session_handle():  # make sure DB session/connection is cleaned up
+            if race_id is not None:
+                self._racecontext.pagecache.invalidate_savedRaceMeta(race_id)
+            else:
+                self._racecontext.pagecache.set_valid(False)
+        self._racecontext.rhui.emit_result_data(flush=True)  # send new results without coalescing delay
 
     @catchLogExceptionsWrapper
     def build_atomic_result_caches(self, params):
         with self._racecontext.rhdata.get_db_session_handle():  # make sure DB session/connection is cleaned up
-            self._racecontext.pagecache.set_valid(False)
+            if 'race_id' in params:
+                self._racecontext.pagecache.invalidate_savedRaceMeta(params['race_id'])
+            else:
+                self._racecontext.pagecache.set_valid(False)
             Results.build_atomic_results(self._racecontext.rhdata, params)
             self._racecontext.rhui.emit_result_data()
 
@@ -779,11 +786,13 @@ class RHRace():
                             lap_time_stamp = (lap_timestamp_absolute - self.start_time_monotonic)
                             lap_time_stamp *= 1000 # store as milliseconds
 
-                            lap_number = len(self.get_active_laps()[node.index])
+                            seat_laps = self.node_laps[node.index]
+                            lap_number = sum(1 for lap in seat_laps if not lap.deleted)
 
                             if lap_number: # This is a normal completed lap
                                 # Find the time stamp of the last lap completed (including "late" laps for timing)
-                                last_lap_time_stamp = self.get_active_laps(True)[node.index][-1].lap_time_stamp
+                                last_lap_time_stamp = next(lap for lap in reversed(seat_laps) \
+                                                           if lap.deleted == False or lap.late_lap).lap_time_stamp
 
                                 # New lap time is the difference between the current time stamp and the last
                                 lap_time = lap_time_stamp - last_lap_time_stamp
@@ -1076,13 +1085,8 @@ class RHRace():
     @catchLogExceptionsWrapper
     def update_leaderboard_after_done(self):
         gevent.sleep(0.001)
-        wait_count = 0  # if 'calc_leaderboard_fn' in progress then let it finish
-        while Results.is_in_calc_leaderboard_fn():
-            gevent.sleep(0.01)
-            wait_count += 1
-            if wait_count > 1000:  # timeout after 10 seconds
-                logger.error("update_leaderboard_after_done: Timeout waiting for invocation of 'calc_leaderboard()' to finish{}")
-                break
+        # if current leaderboard build in progress then let it finish
+        Results.results_flight.wait(('current_race', id(self)), timeout=10)
         self.clear_results()
         self._racecontext.rhui.emit_current_laps() # update all laps on the race page
         self._racecontext.rhui.emit_current_leaderboard() # generate and update leaderboard
@@ -1101,6 +1105,7 @@ class RHRace():
                 return
 
             self.node_laps[node_index][lap_index].invalid = True
+            self.lap_stats.invalidate(node_index)
 
             time = self.node_laps[node_index][lap_index].lap_time_stamp
 
@@ -1198,6 +1203,7 @@ class RHRace():
             lap_objs.append(lap_data)
 
         self.node_laps[node] = lap_objs
+        self.lap_stats.invalidate(node)
 
         self.clear_lap_results()
         self.clear_results()
@@ -1227,6 +1233,7 @@ class RHRace():
 
             lap_obj.deleted = False
             lap_obj.late_lap = False
+            self.lap_stats.invalidate(node_index)
 
             lap_number = 0  # adjust lap numbers and times as needed
             last_lap_ts = 0
@@ -1312,6 +1319,7 @@ class RHRace():
         self.node_laps = {}
         for idx in range(self.num_nodes):
             self.node_laps[idx] = []
+        self.lap_stats.invalidate()
 
         self.clear_results()
         logger.debug('Database current laps reset')
@@ -1702,7 +1710,7 @@ class RHRace():
 
         # cache rebuild
         # logger.debug('Building current race results')
-        build = Results.calc_leaderboard(self._racecontext, current_race=self, current_profile=self.profile)
+        build = Results.results_flight.run(('current_race', id(self)), token, Results.calc_leaderboard, self._racecontext, current_race=self, current_profile=self.profile)
         self.set_results(token, build)
         return build
 
@@ -1719,7 +1727,7 @@ class RHRace():
             self.clear_team_results(token)
         # cache rebuild
         logger.debug('Building current race results')
-        build = Results.calc_team_leaderboard(self._racecontext)
+        build = Results.results_flight.run(('current_race_team', id(self)), token, Results.calc_team_leaderboard, self._racecontext)
         self.set_team_results(token, build)
         return build
 
@@ -1736,7 +1744,7 @@ class RHRace():
             self.clear_team_results(token)
         # cache rebuild
         logger.debug('Building current race results')
-        build = Results.calc_coop_leaderboard(self._racecontext)
+        build = Results.results_flight.run(('current_race_coop', id(self)), token, Results.calc_coop_leaderboard, self._racecontext)
         self.set_coop_results(token, build)
         return build
 
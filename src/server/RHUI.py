@@ -14,10 +14,13 @@ import os
 import subprocess
 import urllib3
 import re
+import struct
+import functools
 from collections import OrderedDict
 import gevent
 import RHUtils
 from RHUtils import catchLogExceptionsWrapper
+from util.EmitCoalescer import EmitCoalescer
 from Database import ProgramMethod, RoundType
 from RHRace import RacingMode, RaceStatus
 from filtermanager import Flt
@@ -116,7 +119,29 @@ class Markdown():
     name: str
     desc: str
 
+def coalesced_emit(func):
+    '''Collapses bursts of broadcast calls to emitter (see 'EmitCoalescer'); calls
+    with 'flush=True' emit immediately. Replies to requesting client are not delayed.'''
+    @functools.wraps(func)
+    def wrapper(self, **params):
+        if 'nobroadcast' in params or 'noself' in params:
+            return func(self, **params)
+        if params.pop('flush', False):
+            return self._emit_coalescer.runNow(func.__name__, func, self, **params)
+        self._emit_coalescer.request(func.__name__, func, self, **params)
+    return wrapper
+
 class RHUI():
+    # broadcast events that pages subscribe to (via 'subscribe_topics'); payloads are only built and
+    #  sent while clients are subscribed. Clients that never subscribe receive all topics.
+    TOPICS = ('node_data', 'environmental_data', 'cluster_status', 'race_list', 'result_data', \
+              'current_laps', 'leaderboard', 'current_marshal_data')
+
+    # binary heartbeat frame: header, then fixed-size record for each node (little-endian)
+    HEARTBEAT_FRAME_VERSION = 1
+    HEARTBEAT_HEADER = struct.Struct('<BB')  # frame version, node count
+    HEARTBEAT_NODE = struct.Struct('<HHHB')  # current rssi, frequency, loop time, crossing flag
+
     # Language placeholder (Overwritten after module init)
     def __(self, *args):
         return args
@@ -139,6 +164,15 @@ class RHUI():
         self._quickbuttons = []
         self._markdowns = []
         self._UI_server_messages = {}
+        self._delta_clients = set() # sids of clients accepting '_delta' events
+        self._topic_clients = {topic: set() for topic in self.TOPICS} # subscribed sids, by topic
+        self._delta_states = {} # last broadcast payload and sequence number, by event
+        self._delta_resync = {} # sids sent a full payload since last broadcast, by event
+        self._heartbeat_clients = {} # heartbeat room, by sid
+        self._heartbeat_rooms = {} # [binary flag, interval, client count], by heartbeat room
+        self._emit_coalescer = EmitCoalescer(logger, \
+            window=RaceContext.serverconfig.get_item('GENERAL', 'EMIT_COALESCE_MS') / 1000.0, \
+            deferredContext=lambda: self._racecontext.rhdata.get_db_session_handle())
 
     # Pilot Attributes
     def register_pilot_attribute(self, field:UIField):
@@ -703,6 +737,8 @@ class RHUI():
 
     def emit_node_data(self, **params):
         '''Emits node data.'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('node_data'):
+            return
         emit_payload = {
                 'node_peak_rssi': [node.node_peak_rssi for node in self._racecontext.interface.nodes],
                 'node_nadir_rssi': [node.node_nadir_rssi for node in self._racecontext.interface.nodes],
@@ -713,10 +749,12 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('node_data', emit_payload)
         else:
-            self._socket.emit('node_data', emit_payload)
+            self._socket.emit('node_data', emit_payload, to=self.topic_room('node_data'))
 
     def emit_environmental_data(self, **params):
         '''Emits environmental data.'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('environmental_data'):
+            return
         emit_payload = []
         for sensor in self._racecontext.sensors:
             emit_payload.append({sensor.name: sensor.getReadings()})
@@ -726,7 +764,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('environmental_data', emit_payload)
         else:
-            self._socket.emit('environmental_data', emit_payload)
+            self._socket.emit('environmental_data', emit_payload, to=self.topic_room('environmental_data'))
 
     def emit_enter_and_exit_at_levels(self, **params):
         '''Emits enter-at and exit-at levels for nodes.'''
@@ -745,11 +783,14 @@ class RHUI():
 
     def emit_cluster_status(self, **params):
         '''Emits cluster status information.'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('cluster_status'):
+            return
         if self._racecontext.cluster:
             if ('nobroadcast' in params):
                 emit('cluster_status', self._racecontext.cluster.getClusterStatusInfo())
             else:
-                self._socket.emit('cluster_status', self._racecontext.cluster.getClusterStatusInfo())
+                self._socket.emit('cluster_status', self._racecontext.cluster.getClusterStatusInfo(), \
+                                  to=self.topic_room('cluster_status'))
 
     def emit_start_thresh_lower_amount(self, **params):
         '''Emits current start_thresh_lower_amount.'''
@@ -880,8 +921,123 @@ class RHUI():
         else:
             self._socket.emit('min_lap', emit_payload)
 
+    def set_delta_client(self, sid, enabled):
+        '''Sets whether client receives '_delta' events in place of full sequenced payloads.'''
+        if enabled:
+            self._delta_clients.add(sid)
+        else:
+            self._delta_clients.discard(sid)
+
+    @staticmethod
+    def heartbeat_room(binary, interval):
+        return 'heartbeat_{}_{}'.format('bin' if binary else 'json', interval)
+
+    def set_heartbeat_client(self, sid, binary=False, interval=1):
+        '''Sets heartbeat format and interval (in heartbeat ticks, or 0 for none) for client.
+        Returns tuple of (previous, new) heartbeat room names; either may be None.'''
+        old_room = self._heartbeat_clients.pop(sid, None)
+        if old_room:
+            room_info = self._heartbeat_rooms[old_room]
+            room_info[2] -= 1
+            if room_info[2] <= 0:
+                del self._heartbeat_rooms[old_room]
+        new_room = None
+        if interval:
+            new_room = self.heartbeat_room(binary, interval)
+            self._heartbeat_clients[sid] = new_room
+            if new_room in self._heartbeat_rooms:
+                self._heartbeat_rooms[new_room][2] += 1
+            else:
+                self._heartbeat_rooms[new_room] = [binary, interval, 1]
+        return old_room, new_room
+
+    def pack_heartbeat(self, node_data):
+        '''Packs heartbeat node data into binary frame.'''
+        def clamp(value):
+            return min(max(int(value or 0), 0), 0xFFFF)
+
+        num_nodes = len(node_data['current_rssi'])
+        frame = bytearray(self.HEARTBEAT_HEADER.size + num_nodes * self.HEARTBEAT_NODE.size)
+        self.HEARTBEAT_HEADER.pack_into(frame, 0, self.HEARTBEAT_FRAME_VERSION, num_nodes)
+        offset = self.HEARTBEAT_HEADER.size
+        for idx in range(num_nodes):
+            self.HEARTBEAT_NODE.pack_into(frame, offset, clamp(node_data['current_rssi'][idx]), \
+                clamp(node_data['frequency'][idx]), clamp(node_data['loop_time'][idx]), \
+                1 if node_data['crossing_flag'][idx] else 0)
+            offset += self.HEARTBEAT_NODE.size
+        return bytes(frame)
+
+    def emit_heartbeat(self, node_data, tick):
+        '''Emits heartbeat to subscribed clients whose interval is due on this tick
+        ('heartbeat' for JSON, 'heartbeat_bin' for binary frames).'''
+        frame = None
+        for room, (binary, interval, _count) in list(self._heartbeat_rooms.items()):
+            if tick % interval:
+                continue
+            if binary:
+                if frame is None:
+                    frame = self.pack_heartbeat(node_data)
+                self._socket.emit('heartbeat_bin', frame, to=room)
+            else:
+                self._socket.emit('heartbeat', node_data, to=room)
+
+    @staticmethod
+    def topic_room(topic):
+        return 'topic_' + topic
+
+    def set_topic_client(self, sid, topics=None):
+        '''Sets topics client is subscribed to (None for all; empty for none).
+        Returns tuple of (left, joined) room names.'''
+        new_topics = set(self.TOPICS if topics is None else topics).intersection(self.TOPICS)
+        left = []
+        joined = []
+        for topic, clients in self._topic_clients.items():
+            if topic in new_topics:
+                if sid not in clients:
+                    clients.add(sid)
+                    joined.append(self.topic_room(topic))
+            elif sid in clients:
+                clients.discard(sid)
+                left.append(self.topic_room(topic))
+        return left, joined
+
+    def has_topic_clients(self, topic):
+        return bool(self._topic_clients[topic])
+
+    def flush_emits(self):
+        '''Sends any coalesced emits that are waiting.'''
+        self._emit_coalescer.flush()
+
+    def emit_sequenced(self, event, emit_payload, nobroadcast=False):
+        '''Emits payload with a per-event sequence number. Delta clients get only
+        the changes since the previous broadcast (as event + '_delta') and request
+        a full payload via 'load_data' when they detect a missed sequence number.'''
+        state = self._delta_states.get(event)
+        if nobroadcast:
+            # answer requester only; its payload may be newer than the last broadcast (which
+            # deltas are made from), so it gets the next broadcast as a full payload
+            self._delta_resync.setdefault(event, set()).add(request.sid)
+            emit(event, dict(emit_payload, seq=state['seq'] if state else 0))
+            return
+
+        seq = state['seq'] + 1 if state else 1
+        self._delta_states[event] = {'seq': seq, 'payload': emit_payload}
+        room = self.topic_room(event)
+        subscribers = self._topic_clients[event]
+        delta_subscribers = (subscribers & self._delta_clients) - self._delta_resync.pop(event, set())
+        if not state or len(delta_subscribers) < len(subscribers):
+            self._socket.emit(event, dict(emit_payload, seq=seq), to=room, \
+                              skip_sid=list(delta_subscribers) if state else None)
+        if state and delta_subscribers:
+            self._socket.emit(event + '_delta', {
+                'seq': seq,
+                'patch': RHUtils.json_delta(state['payload'], emit_payload)
+            }, to=room, skip_sid=list(subscribers - delta_subscribers))
+
     def emit_current_laps(self, **params):
         '''Emits current laps.'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('current_laps'):
+            return
         emit_payload = {
             'current': {}
         }
@@ -890,52 +1046,45 @@ class RHUI():
         if self._racecontext.last_race is not None:
             emit_payload['last_race'] = self._racecontext.last_race.get_lap_results()
 
-        if ('nobroadcast' in params):
-            emit('current_laps', emit_payload)
-        else:
-            self._socket.emit('current_laps', emit_payload)
+        self.emit_sequenced('current_laps', emit_payload, 'nobroadcast' in params)
 
+    @coalesced_emit
     def emit_race_list(self, **params):
         '''Emits race listing'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('race_list'):
+            return
         profile_freqs = json.loads(self._racecontext.race.profile.frequencies)
         heats = {}
-        races = self._racecontext.rhdata.get_savedRaceMetas()
-        pilotraces_db = self._racecontext.rhdata.get_savedPilotRaces()
-        pilots = self._racecontext.rhdata.get_pilots()
-        race_classes = self._racecontext.rhdata.get_raceClasses()
+        race_data = self._racecontext.rhdata.get_savedRaceListing()
+        pilots = {pilot.id: pilot for pilot in self._racecontext.rhdata.get_pilots()}
+        race_classes = {race_class.id: race_class for race_class in self._racecontext.rhdata.get_raceClasses()}
         for heat in self._racecontext.rhdata.get_heats():
             rounds = {}
-            for race in races:
-                if race.heat_id == heat.id:
-                    pilotraces = []
-                    for pilotrace in pilotraces_db:
-                        if pilotrace.race_id == race.id:
-                            pilot_data = None
-                            for pilot in pilots:
-                                if pilot.id == pilotrace.pilot_id:
-                                    pilot_data = pilot
-                                    break
-
-                            if pilot_data:
-                                nodepilot = pilot_data.callsign
-                            else:
-                                nodepilot = None
-
-                            pilotraces.append({
-                                'pilotrace_id': pilotrace.id,
-                                'callsign': nodepilot,
-                                'pilot_id': pilotrace.pilot_id,
-                                'node_index': pilotrace.node_index,
-                                'pilot_freq': self.get_pilot_freq_info(profile_freqs, pilotrace.frequency, \
-                                                                       pilotrace.node_index)
-                            })
-                    rounds[race.round_id] = {
-                        'race_id': race.id,
-                        'format_id': race.format_id,
-                        'start_time': race.start_time,
-                        'start_time_formatted': race.start_time_formatted,
-                        'pilotraces': pilotraces
-                    }
+            for race in race_data['races_by_heat'].get(heat.id, []):
+                pilotraces = []
+                for pilotrace in race_data['pilotraces_by_race'].get(race.id, []):
+                    pilot_data = pilots.get(pilotrace.pilot_id)
+
+                    if pilot_data:
+                        nodepilot = pilot_data.callsign
+                    else:
+                        nodepilot = None
+
+                    pilotraces.append({
+                        'pilotrace_id': pilotrace.id,
+                        'callsign': nodepilot,
+                        'pilot_id': pilotrace.pilot_id,
+                        'node_index': pilotrace.node_index,
+                        'pilot_freq': self.get_pilot_freq_info(profile_freqs, pilotrace.frequency, \
+                                                               pilotrace.node_index)
+                    })
+                rounds[race.round_id] = {
+                    'race_id': race.id,
+                    'format_id': race.format_id,
+                    'start_time': race.start_time,
+                    'start_time_formatted': race.start_time_formatted,
+                    'pilotraces': pilotraces
+                }
             if rounds:
                 heats[heat.id] = {
                     'heat_id': heat.id,
@@ -944,10 +1093,9 @@ class RHUI():
                     'rounds': rounds,
                 }
                 if heat.class_id:
-                    for race_class in race_classes:
-                        if race_class.id == heat.class_id:
-                            heats[heat.id]['round_type'] = race_class.round_type
-                            break
+                    race_class = race_classes.get(heat.class_id)
+                    if race_class:
+                        heats[heat.id]['round_type'] = race_class.round_type
 
         emit_payload = {
             'heats': heats,
@@ -960,10 +1108,13 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('race_list', emit_payload)
         else:
-            self._socket.emit('race_list', emit_payload)
+            self._socket.emit('race_list', emit_payload, to=self.topic_room('race_list'))
 
+    @coalesced_emit
     def emit_result_data(self, **params):
         ''' kick off non-blocking thread to generate data'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('result_data'):
+            return
         if request:
             gevent.spawn(self.emit_result_data_thread, params, request.sid)
         else:
@@ -978,10 +1129,12 @@ class RHUI():
             if 'nobroadcast' in params and sid != None:
                 emit('result_data', emit_payload, namespace='/', room=sid)
             else:
-                self._socket.emit('result_data', emit_payload, namespace='/')
+                self._socket.emit('result_data', emit_payload, namespace='/', to=self.topic_room('result_data'))
 
     def emit_current_leaderboard(self, **params):
         '''Emits leaderboard.'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('leaderboard'):
+            return
 
         emit_payload = {
             'current': {}
@@ -1030,13 +1183,12 @@ class RHUI():
             elif self._racecontext.last_race.format.team_racing_mode == RacingMode.COOP_ENABLED:
                 emit_payload['last_race']['team_leaderboard'] = self._racecontext.last_race.get_coop_results()
 
-        if ('nobroadcast' in params):
-            emit('leaderboard', emit_payload)
-        else:
-            self._socket.emit('leaderboard', emit_payload)
+        self.emit_sequenced('leaderboard', emit_payload, 'nobroadcast' in params)
 
     def emit_race_marshal_data(self, **params):
         '''Emits current (post-race) marshal data.'''
+        if 'nobroadcast' not in params and not self.has_topic_clients('current_marshal_data'):
+            return False
         race = self._racecontext.race
         nodes = self._racecontext.interface.nodes
 
@@ -1076,7 +1228,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('current_marshal_data', emit_payload)
         else:
-            self._socket.emit('current_marshal_data', emit_payload)
+            self._socket.emit('current_marshal_data', emit_payload, to=self.topic_room('current_marshal_data'))
 
     def emit_expanded_heat(self, heat_id, **params):
         '''Emits abbreviated heat data for more responsive UI.'''
@@ -1203,6 +1355,7 @@ class RHUI():
             if len(self._racecontext.rhdata.get_heats()) <= self._racecontext.serverconfig.get_item_int('UI', 'smallEventThreshold'):
                 self.emit_heat_data()
 
+    @coalesced_emit
     def emit_heat_data(self, **params):
         '''Emits heat data.'''
 
@@ -1380,6 +1533,7 @@ class RHUI():
         else:
             self._socket.emit('recent_heat_data', emit_payload)
 
+    @coalesced_emit
     def emit_class_data(self, **params):
         '''Emits class data.'''
 
@@ -1430,6 +1584,7 @@ class RHUI():
         else:
             self._socket.emit('class_data', emit_payload)
 
+    @coalesced_emit
     def emit_format_data(self, **params):
         '''Emits format data.'''
         formats = []
@@ -1508,6 +1663,7 @@ class RHUI():
         else:
             self._socket.emit('pilot_data', emit_payload)
 
+    @coalesced_emit
     def emit_pilot_data(self, **params):
         '''Emits pilot data.'''
         pilots_list = []
@@ -421,6 +421,30 @@ def getNumericEntry(srcDict, keyObj, defaultVal=0):
             return val
     return defaultVal
 
+# Returns patch that turns JSON-style object 'old' into 'new': {'v': value} replaces;
+#  {'d': {key: patch}, 'r': [keys]} changes/removes dict entries;
+#  {'l': length, 'i': {index: patch}} resizes and changes list items
+def json_delta(old, new):
+    if type(old) is not type(new):
+        return {'v': new}
+    if isinstance(new, dict):
+        changed = {}
+        for key, value in new.items():
+            if key not in old:
+                changed[key] = {'v': value}
+            elif old[key] != value:
+                changed[key] = json_delta(old[key], value)
+        return {'d': changed, 'r': [key for key in old if key not in new]}
+    if isinstance(new, list):
+        changed = {}
+        for idx, value in enumerate(new):
+            if idx >= len(old):
+                changed[idx] = {'v': value}
+            elif old[idx] != value:
+                changed[idx] = json_delta(old[idx], value)
+        return {'l': len(new), 'i': changed}
+    return {'v': new}
+
 # Attempts to launch a web browser on host system
 def launchBrowser(hostStr, httpPortNum=0, pageNameStr=None, launchCmdStr=None):
     try:
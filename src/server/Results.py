@@ -5,7 +5,6 @@ from typing import List
 from RHUI import UIField
 from eventmanager import Evt
 from filtermanager import Flt
-import copy
 import json
 import gevent
 import RHUtils
@@ -14,6 +13,7 @@ import logging
 from time import monotonic
 from Database import RoundType
 from RHRace import RaceStatus, StartBehavior, WinCondition, WinStatus, RacingMode
+from util.SingleFlight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +22,8 @@ APP.app_context().push()
 
 NONE_NONE_PAIR = [None, None]
 
-in_calc_leaderboard_fn_flag = False
+# in-progress result builds, keyed by cache entity
+results_flight = SingleFlight(logger)
 
 class RaceClassRankManager():
     def __init__(self, RHAPI, Events):
@@ -175,6 +176,117 @@ class LapInfo():
     def __repr__(self):
         return json.dumps(self.toJSON())
 
+class PilotLapStats():
+    '''Running lap aggregates (totals, fastest lap, best consecutives) for one pilot'''
+    def __init__(self, source, consecutives_count, first_lap_counts):
+        self.source = source # list of lap objects being tracked (may include deleted laps)
+        self.seen = 0 # number of entries in 'source' already consumed
+        self.consecutives_count = consecutives_count
+        self.first_lap_counts = first_lap_counts # True if first crossing counts as a lap
+        self.crossings = [] # active (non-deleted) laps
+        self.lap_times = [] # times of counted laps
+        self.total_time = 0
+        self.fastest_lap = None
+        self.consecutives = None # best sum of 'consecutives_count' sequential laps
+        self.consecutive_lap_start = None
+        self.update()
+
+    def update(self):
+        '''Consumes laps appended to the source list since the last call; returns the new active laps'''
+        added = []
+        for lap in self.source[self.seen:]:
+            if not lap.deleted:
+                self._add(lap)
+                added.append(lap)
+        self.seen = len(self.source)
+        return added
+
+    def _add(self, lap):
+        if self.crossings or self.first_lap_counts:
+            self.lap_times.append(lap.lap_time)
+            if self.fastest_lap is None or lap.lap_time < self.fastest_lap:
+                self.fastest_lap = lap.lap_time
+
+            lap_count = len(self.lap_times)
+            if self.consecutives_count > 0 and lap_count >= self.consecutives_count:
+                # only the window ending at the new lap can change the best value
+                window_time = sum(self.lap_times[-self.consecutives_count:])
+                # same preference as sorting on (not bool(time), time); keeps earliest on ties
+                if self.consecutives is None or \
+                    (not window_time, window_time) < (not self.consecutives, self.consecutives):
+                    self.consecutives = window_time
+                    self.consecutive_lap_start = lap_count - self.consecutives_count + 1
+
+        self.crossings.append(lap)
+        self.total_time += lap.lap_time
+
+    @property
+    def laps(self):
+        return len(self.lap_times)
+
+    @property
+    def total_time_laps(self):
+        if len(self.crossings) != len(self.lap_times):
+            return self.total_time - self.crossings[0].lap_time
+        return self.total_time
+
+    @property
+    def last_lap(self):
+        return self.crossings[-1] if self.lap_times else None
+
+class RaceLapStats():
+    '''Incremental lap aggregates for each seat of a race in progress'''
+    def __init__(self):
+        self._seats = {}
+        self._config = None
+        self._lap_leaders = {}
+        self._lap_leaders_valid = True
+
+    def get_seat(self, node_index, source, consecutives_count, first_lap_counts):
+        '''Returns up-to-date stats for a seat, consuming only laps added since the last call'''
+        config = (consecutives_count, first_lap_counts)
+        if config != self._config:
+            self.invalidate()
+            self._config = config
+
+        stats = self._seats.get(node_index)
+        if stats is None or stats.source is not source or stats.seen > len(source):
+            stats = PilotLapStats(source, consecutives_count, first_lap_counts)
+            self._seats[node_index] = stats
+            self._lap_leaders_valid = False
+        else:
+            added = stats.update()
+            if self._lap_leaders_valid:
+                for lap in added:
+                    self._add_lap_leader(node_index, lap)
+        return stats
+
+    def invalidate(self, node_index=None):
+        '''Drops stats for a seat (or all seats) so they are rebuilt on next access'''
+        if node_index is None:
+            self._seats = {}
+        else:
+            self._seats.pop(node_index, None)
+        self._lap_leaders_valid = False
+
+    def get_lap_leader(self, lap_number):
+        '''Returns [node_index, lap] for the earliest crossing of the given lap number'''
+        if not self._lap_leaders_valid:
+            self._lap_leaders = {}
+            for node_index, stats in self._seats.items():
+                for lap in stats.crossings:
+                    self._add_lap_leader(node_index, lap)
+            self._lap_leaders_valid = True
+        return self._lap_leaders.get(lap_number, NONE_NONE_PAIR)
+
+    def _add_lap_leader(self, node_index, lap):
+        lnum = lap.lap_number
+        if lnum is not None and (lnum > 0 or (self._config and self._config[1])):
+            ldr_node, ldr_lap = self._lap_leaders.get(lnum, NONE_NONE_PAIR)
+            # if first entry or earliest entry for lap
+            if ldr_lap is None or lap.lap_time_stamp < ldr_lap.lap_time_stamp:
+                self._lap_leaders[lnum] = [ node_index, lap ]
+
 @catchLogExceptionsWrapper
 def build_atomic_results(rhDataObj, params):
     dbg_trace_str = ""
@@ -251,33 +363,13 @@ def build_atomic_results(rhDataObj, params):
         logger.debug('Built result caches in {0}'.format(monotonic() - timing['start']))
         logger.debug("Exiting 'build_atomic_results()'{}".format(dbg_trace_str))
 
-def is_in_calc_leaderboard_fn():
-    return in_calc_leaderboard_fn_flag
-
 def calc_leaderboard(racecontext, **params):
     dbg_trace_str = ""
     if logger.getEffectiveLevel() <= logging.DEBUG:  # if DEBUG msgs actually being logged
         dbg_trace_str = RHUtils.getFnTracebackMsgStr("calc_leaderboard")
         logger.debug("Entered 'calc_leaderboard()', called from: {}".format(dbg_trace_str))
         dbg_trace_str = " (called from: {})".format(dbg_trace_str)
-    global in_calc_leaderboard_fn_flag
-    if in_calc_leaderboard_fn_flag:
-        logger.info("Waiting for previous invocation of 'calc_leaderboard()' to finish{}".format(dbg_trace_str))
-        wait_count = 0
-        while True:
-            gevent.sleep(0.05)
-            if not in_calc_leaderboard_fn_flag:
-                logger.info("Previous invocation of 'calc_leaderboard()' finished; continuing{}".format(dbg_trace_str))
-                break
-            wait_count += 1
-            if wait_count > 6000:
-                logger.error("Timeout waiting for previous invocation of 'calc_leaderboard()' to finish{}".format(dbg_trace_str))
-                break
-    in_calc_leaderboard_fn_flag = True
-    try:
-        lb_result = _do_calc_leaderboard(racecontext, **params)
-    finally:
-        in_calc_leaderboard_fn_flag = False
+    lb_result = _do_calc_leaderboard(racecontext, **params)
     if logger.getEffectiveLevel() <= logging.DEBUG:  # if DEBUG msgs actually being logged
         logger.debug("Exiting 'calc_leaderboard()'{}".format(dbg_trace_str))
     return lb_result
@@ -349,24 +441,13 @@ def _do_calc_leaderboard(racecontext, **params):
 
     leaderboard = []
 
+    first_lap_counts = bool(race_format and race_format.start_behavior == StartBehavior.FIRST_LAP)
+
     # collect data for processing
     if USE_CURRENT and raceObj.current_heat == RHUtils.HEAT_ID_NONE:
         for node_index in range(raceObj.num_nodes):
-            crossings = []
-            laps = []
-
-            if node_index < raceObj.num_nodes and len(raceObj.get_active_laps()):
-                crossings = raceObj.get_active_laps()[node_index]
-
-            if crossings:
-                if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                    total_laps = len(crossings)
-                    laps = crossings
-                else:
-                    total_laps = len(crossings) - 1
-                    laps = crossings[1:]
-            else:
-                total_laps = 0
+            stats = raceObj.lap_stats.get_seat(node_index, raceObj.node_laps.get(node_index, []),
+                                               consecutivesCount, first_lap_counts)
 
             if (profile_freqs["b"][node_index] and profile_freqs["c"][node_index]):
                 callsign = profile_freqs["b"][node_index] + str(profile_freqs["c"][node_index])
@@ -378,62 +459,39 @@ def _do_calc_leaderboard(racecontext, **params):
                     'pilot_id': None,
                     'callsign': callsign,
                     'team_name': None,
-                    'laps': total_laps,
-                    'starts': 1 if len(crossings) > 0 else 0,
+                    'laps': stats.laps,
+                    'starts': 1 if len(stats.crossings) > 0 else 0,
                     'node': node_index,
-                    'pilot_crossings': crossings,
-                    'pilot_laps': laps,
+                    'lap_stats': stats,
                 })
     elif USE_CURRENT:
-        for pilot in rhDataObj.get_pilots():
-            do_gevent_sleep(0)
-            found_pilot = False
-            node_index = 0
-            crossings = []
-            laps = []
+        pilot_nodes = {}
+        if len(raceObj.node_laps):
             for node_index in raceObj.node_pilots:
-                if raceObj.node_pilots[node_index] == pilot.id and node_index < raceObj.num_nodes and len(raceObj.get_active_laps()):
-                    crossings = raceObj.get_active_laps()[node_index]
-                    found_pilot = True
-                    break
-
-            if crossings:
-                if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                    total_laps = len(crossings)
-                    laps = crossings
-                else:
-                    total_laps = len(crossings) - 1
-                    laps = crossings[1:]
-            else:
-                total_laps = 0
+                if node_index < raceObj.num_nodes:
+                    pilot_nodes.setdefault(raceObj.node_pilots[node_index], node_index)
 
-            if found_pilot and profile_freqs["f"][node_index] != RHUtils.FREQUENCY_ID_NONE:
+        for pilot in rhDataObj.get_pilots():
+            node_index = pilot_nodes.get(pilot.id)
+            if node_index is not None and profile_freqs["f"][node_index] != RHUtils.FREQUENCY_ID_NONE:
+                stats = raceObj.lap_stats.get_seat(node_index, raceObj.node_laps.get(node_index, []),
+                                                   consecutivesCount, first_lap_counts)
                 leaderboard.append({
                     'pilot_id': pilot.id,
                     'callsign': pilot.callsign,
                     'team_name': pilot.team,
-                    'laps': total_laps,
-                    'starts': 1 if len(crossings) > 0 else 0,
+                    'laps': stats.laps,
+                    'starts': 1 if len(stats.crossings) > 0 else 0,
                     'node': node_index,
-                    'pilot_crossings': crossings,
-                    'pilot_laps': laps,
+                    'lap_stats': stats,
                 })
     else:
         for pilot_race in racecontext.rhdata.get_savedPilotRaces_by_savedRaceMeta(raceObj.id):
             if pilot_race.pilot_id:
                 pilot = racecontext.rhdata.get_pilot(pilot_race.pilot_id)
-                pilot_laps = []
-                total_laps = 0
 
                 race_crossings = racecontext.rhdata.get_active_savedRaceLaps_by_savedPilotRace(pilot_race.id)
-                total_laps += len(race_crossings)
-
-                if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                    pilot_laps = race_crossings
-                else:
-                    if len(race_crossings):
-                        pilot_laps = race_crossings[1:]
-                        total_laps -= 1
+                stats = PilotLapStats(race_crossings, consecutivesCount, first_lap_counts)
 
                 do_gevent_sleep(0)
 
@@ -441,49 +499,32 @@ def _do_calc_leaderboard(racecontext, **params):
                     'pilot_id': pilot.id,
                     'callsign': pilot.callsign,
                     'team_name': pilot.team,
-                    'laps': total_laps,
+                    'laps': stats.laps,
                     'starts': 1 if len(race_crossings) > 0 else 0,
                     'node': pilot_race.node_index,
-                    'pilot_crossings': race_crossings,
-                    'pilot_laps': pilot_laps,
+                    'lap_stats': stats,
                 })
 
     do_gevent_sleep()
-    # find leader for each lap in race
-    if USE_CURRENT:
-        leader_laps = {}
-        for chk_pilot in leaderboard:
-            chk_laps = chk_pilot.get('pilot_crossings', [])
-            for chk_lap in chk_laps:
-                lnum = chk_lap.lap_number
-                if lnum is not None and (lnum > 0 or (race_format and race_format.start_behavior == StartBehavior.FIRST_LAP)):
-                    ldr_plt, ldr_lap = leader_laps.get(lnum, NONE_NONE_PAIR)
-                    # if first entry or earliest entry for lap
-                    if ldr_lap is None or chk_lap.lap_time_stamp < ldr_lap.lap_time_stamp:
-                        leader_laps[lnum] = [ chk_pilot, chk_lap ]
 
     for result_pilot in leaderboard:
         if logger.getEffectiveLevel() <= logging.DEBUG:  # if DEBUG msgs actually being logged
             logger.debug("Calculating leaderboard data for pilot_id {}".format(result_pilot.get('pilot_id', -1)))
-        do_gevent_sleep()
 
-        # Get the total race time for each pilot
-        l_time_total = 0
-        for lap in result_pilot['pilot_crossings']:
-            l_time_total += lap.lap_time
-        result_pilot['total_time'] = round(l_time_total, 3)
+        stats = result_pilot['lap_stats']
 
-        if len(result_pilot['pilot_crossings']) != len(result_pilot['pilot_laps']):
-            l_time_total -= result_pilot['pilot_crossings'][0].lap_time
-        result_pilot['total_time_laps'] = round(l_time_total, 3)
+        # Get the total race time for each pilot
+        result_pilot['total_time'] = round(stats.total_time, 3)
+        result_pilot['total_time_laps'] = round(stats.total_time_laps, 3)
 
         if result_pilot['laps']:
+            current_lap = stats.last_lap
             # Get the last lap for each pilot
-            result_pilot['last_lap'] = result_pilot['pilot_laps'][-1].lap_time
+            result_pilot['last_lap'] = current_lap.lap_time
             # Get the average lap time for each pilot
             result_pilot['average_lap'] = round(result_pilot['total_time_laps'] / result_pilot['laps'], 3)
             # Get the fastest lap time for each pilot
-            result_pilot['fastest_lap'] = sorted(result_pilot['pilot_laps'], key=lambda val: val.lap_time)[0].lap_time
+            result_pilot['fastest_lap'] = stats.fastest_lap
             # Set lap source info
             source = {
                 'round': round_num,
@@ -491,52 +532,29 @@ def _do_calc_leaderboard(racecontext, **params):
                 'displayname': heat_displayname,
             }
 
-            do_gevent_sleep(0)
-
             # Determine number of seconds behind leader
             result_pilot['time_behind'] = None
             if USE_CURRENT:
-                current_lap = result_pilot['pilot_laps'][-1]
                 cur_lap_num = current_lap.lap_number
                 # check if pilot has completed at least first lap
-                if cur_lap_num > 0 or \
-                        (race_format and race_format.start_behavior == StartBehavior.FIRST_LAP):
-                    ldr_pilot, ldr_lap = leader_laps.get(cur_lap_num, NONE_NONE_PAIR)
+                if cur_lap_num > 0 or first_lap_counts:
+                    ldr_node, ldr_lap = raceObj.lap_stats.get_lap_leader(cur_lap_num)
                     # if another pilot is leader on lap
-                    if ldr_lap is not None and ldr_pilot.get('node') != result_pilot.get('node'):
+                    if ldr_lap is not None and ldr_node != result_pilot.get('node'):
                         ldr_lap_ts = ldr_lap.lap_time_stamp
                         cur_lap_ts = current_lap.lap_time_stamp
                         if cur_lap_ts > ldr_lap_ts:
                             result_pilot['time_behind'] = round(cur_lap_ts - ldr_lap_ts, 3)
 
-                do_gevent_sleep(0)
-
-            # find best consecutive X laps
-            all_consecutives = []
-
-            if result_pilot['laps'] >= consecutivesCount:
-                for i in range(result_pilot['laps'] - (consecutivesCount - 1)):
-                    do_gevent_sleep(0)
-                    all_consecutives.append({
-                        'laps': consecutivesCount,
-                        'time': sum([data.lap_time for data in result_pilot['pilot_laps'][i : i + consecutivesCount]]),
-                        'lap_index': i+1
-                    })
+            # best consecutive X laps
+            if stats.consecutives is not None:
+                result_pilot['consecutives'] = round(stats.consecutives, 3)
+                result_pilot['consecutives_base'] = stats.consecutives_count
+                result_pilot['consecutive_lap_start'] = stats.consecutive_lap_start
             else:
-                all_consecutives.append({
-                    'laps': result_pilot['laps'],
-                    'time': result_pilot['total_time_laps'],
-                    'lap_index': None
-                })
-
-            do_gevent_sleep(0)
-
-            # Sort consecutives
-            all_consecutives.sort(key = lambda x: (-x['laps'], not bool(x['time']), x['time']))
-
-            result_pilot['consecutives'] = round(all_consecutives[0]['time'], 3)
-            result_pilot['consecutives_base'] = all_consecutives[0]['laps']
-            result_pilot['consecutive_lap_start'] = all_consecutives[0]['lap_index']
+                result_pilot['consecutives'] = round(result_pilot['total_time_laps'], 3)
+                result_pilot['consecutives_base'] = result_pilot['laps']
+                result_pilot['consecutive_lap_start'] = None
 
         else:
             result_pilot['last_lap'] = None
@@ -552,12 +570,10 @@ def _do_calc_leaderboard(racecontext, **params):
         result_pilot['consecutives_source'] = source
 
     do_gevent_sleep()
-
     # Combine leaderboard
     for result_pilot in leaderboard:
         # Clean up interim data
-        result_pilot.pop('pilot_crossings')
-        result_pilot.pop('pilot_laps')
+        result_pilot.pop('lap_stats')
 
         # shift output keys
         result_pilot['total_time_raw'] = result_pilot['total_time']
@@ -571,10 +587,11 @@ def _do_calc_leaderboard(racecontext, **params):
         if race_format and race_format.start_behavior == StartBehavior.STAGGERED:
             result_pilot['total_time_raw'] = result_pilot['total_time_laps_raw']
 
+    # rankings are views onto the same pilot rows until ranked
     leaderboard_output = {
-        'by_race_time': copy.deepcopy(leaderboard),
-        'by_fastest_lap': copy.deepcopy(leaderboard),
-        'by_consecutives': copy.deepcopy(leaderboard)
+        'by_race_time': leaderboard,
+        'by_fastest_lap': list(leaderboard),
+        'by_consecutives': list(leaderboard)
     }
 
     if race_format and race_format.win_condition == WinCondition.FASTEST_CONSECUTIVE:
@@ -598,17 +615,21 @@ def _do_calc_leaderboard(racecontext, **params):
     if meta_points_flag:
         leaderboard_output['meta']['primary_points'] = True
 
-    leaderboard_output = sort_and_rank_leaderboards(racecontext, leaderboard_output)
     leaderboard_output = format_leaderboard_times(racecontext, leaderboard_output)
+    leaderboard_output = sort_and_rank_leaderboards(racecontext, leaderboard_output)
     leaderboard_output = add_fastest_race_lap_meta(racecontext, leaderboard_output)
 
     return leaderboard_output
 
 def format_leaderboard_times(racecontext, all_leaderboards):
     time_format = racecontext.serverconfig.get_item('UI', 'timeFormat')
+    formatted = set() # rows shared between rankings are only formatted once
     for key, leaderboard in all_leaderboards.items():
         if key != 'meta':
             for result_pilot in leaderboard:
+                if id(result_pilot) in formatted:
+                    continue
+                formatted.add(id(result_pilot))
                 result_pilot['total_time'] = RHUtils.format_time_to_str(result_pilot['total_time_raw'], time_format)
                 result_pilot['total_time_laps'] = RHUtils.format_time_to_str(result_pilot['total_time_laps_raw'], time_format)
                 result_pilot['average_lap'] = RHUtils.format_time_to_str(result_pilot['average_lap_raw'], time_format)
@@ -624,11 +645,25 @@ def format_leaderboard_times(racecontext, all_leaderboards):
 
     return all_leaderboards
 
+def expand_leaderboard_views(all_leaderboards):
+    '''Gives each ranking its own copy of any pilot row it shares with another ranking'''
+    seen = set()
+    for key, leaderboard in all_leaderboards.items():
+        if key != 'meta':
+            for idx, row in enumerate(leaderboard):
+                if id(row) in seen:
+                    leaderboard[idx] = dict(row)
+                else:
+                    seen.add(id(row))
+    return all_leaderboards
+
 def sort_and_rank_leaderboards(racecontext, all_leaderboards):
     consecutivesCount = all_leaderboards['meta']['consecutives_count']
+    # rank fields differ between rankings; rows may arrive as shared views
+    expand_leaderboard_views(all_leaderboards)
 
     # Sort by race time
-    all_leaderboards['by_race_time'] = sorted(all_leaderboards['by_race_time'], key=lambda x: (
+    all_leaderboards['by_race_time'].sort(key=lambda x: (
         -x['laps'],  # reverse lap count
         x['total_time_raw'] if x['total_time_raw'] and x['total_time_raw'] > 0 else float('inf')
     # total time ascending except 0
@@ -654,7 +689,7 @@ def sort_and_rank_leaderboards(racecontext, all_leaderboards):
 
     do_gevent_sleep()
     # Sort by fastest laps
-    all_leaderboards['by_fastest_lap'] = sorted(all_leaderboards['by_fastest_lap'], key=lambda x: (
+    all_leaderboards['by_fastest_lap'].sort(key=lambda x: (
         x['fastest_lap_raw'] if x['fastest_lap_raw'] and x['fastest_lap_raw'] > 0 else float('inf'),  # fastest lap
         x['total_time_raw'] if x['total_time_raw'] and x['total_time_raw'] > 0 else float('inf')  # total time
     ))
@@ -676,7 +711,7 @@ def sort_and_rank_leaderboards(racecontext, all_leaderboards):
 
     do_gevent_sleep()
     # Sort by consecutive laps
-    all_leaderboards['by_consecutives'] = sorted(all_leaderboards['by_consecutives'], key=lambda x: (
+    all_leaderboards['by_consecutives'].sort(key=lambda x: (
         -x['consecutives_base'] if x['consecutives_base'] else 0,
         x['consecutives_raw'] if x['consecutives_raw'] and x['consecutives_raw'] > 0 else float('inf'),  # fastest consecutives
         -x['laps'],  # reverse lap count
@@ -802,9 +837,22 @@ def build_leaderboard_event(racecontext):
 
     return racecontext.filters.run_filters(Flt.LEADERBOARD_BUILD_EVENT, leaderboard)
 
+def copy_leaderboard(result):
+    '''Copies a results structure deep enough for it to be merged without altering the original'''
+    if not result:
+        return result
+
+    output = {}
+    for key, value in result.items():
+        if key == 'meta':
+            output[key] = dict(value)
+        else:
+            output[key] = [{k: dict(v) if isinstance(v, dict) else v for k, v in row.items()} for row in value]
+    return output
+
 def build_incremental(racecontext, merge_input, source_input, transient=False):
-    merge_result = copy.deepcopy(merge_input)
-    source_result = copy.deepcopy(source_input)
+    merge_result = copy_leaderboard(merge_input)
+    source_result = copy_leaderboard(source_input)
 
     if not source_result:
         return merge_result
@@ -965,10 +1013,10 @@ def calc_team_leaderboard(racecontext):
             })
 
         # sort race_time
-        leaderboard_by_race_time = copy.deepcopy(sorted(leaderboard, key = lambda x: (
+        leaderboard_by_race_time = [dict(row) for row in sorted(leaderboard, key = lambda x: (
             -x['laps'],
             x['average_lap_raw'] if x['average_lap_raw'] > 0 else float('inf'),
-        )))
+        ))]
 
         # determine ranking
         last_rank = None
@@ -984,11 +1032,11 @@ def calc_team_leaderboard(racecontext):
             row['position'] = pos
 
         # sort fastest lap
-        leaderboard_by_fastest_lap = copy.deepcopy(sorted(leaderboard, key = lambda x: (
+        leaderboard_by_fastest_lap = [dict(row) for row in sorted(leaderboard, key = lambda x: (
             -x['contribution_amt'],
             x['average_fastest_lap_raw'] if x['average_fastest_lap_raw'] > 0 else float('inf'),
             -x['laps'],
-        )))
+        ))]
 
         # determine ranking
         last_rank = None
@@ -1004,11 +1052,11 @@ def calc_team_leaderboard(racecontext):
             row['position'] = pos
 
         # sort consecutives
-        leaderboard_by_consecutives = copy.deepcopy(sorted(leaderboard, key = lambda x: (
+        leaderboard_by_consecutives = [dict(row) for row in sorted(leaderboard, key = lambda x: (
             -x['contribution_amt'],
             x['average_consecutives_raw'] if x['average_consecutives_raw'] > 0 else float('inf'),
             -x['laps'],
-        )))
+        ))]
 
         # determine ranking
         last_rank = None
@@ -5,7 +5,9 @@
 
 import logging
 from eventmanager import Evt
-from led_event_manager import LEDEffect, Color, effect_delay
+from led_event_manager import LEDEffect, effect_delay
+from led_framebuffer import LEDFrameCache, image_to_pixels
+import gevent
 
 logger = logging.getLogger(__name__)
 
@@ -25,60 +27,78 @@ class BitmapEffects():
         else:
             return False
 
-        def setPixels(img, panel_w):
-            pos = 0
-            for row in range(0, img.height):
-                for col in range(0, img.width):
-                    if pos >= strip.numPixels():
-                        return
-
-                    c = col
-                    if args['RHAPI'].config.get('LED', 'INVERTED_PANEL_ROWS'):
-                        if row % 2 == 0:
-                            c = (panel_w - 1) - col
-
-                    px = img.getpixel((c, row))
-                    strip.setPixelColor(pos, Color(px[0], px[1], px[2]))
-                    pos += 1
+        frame_cache = getattr(args.get('manager'), 'frame_cache', None)
+        if not isinstance(frame_cache, LEDFrameCache):
+            frame_cache = None
 
         bitmaps = args['bitmaps']
         if bitmaps and bitmaps is not None:
             for bitmap in bitmaps:
-                img = Image.open(bitmap['image'])
+                if frame_cache is not None:
+                    frames = frame_cache.get(self.frameKey(bitmap['image']),
+                                             lambda: self.renderBitmap(bitmap['image']))
+                else:
+                    frames = self.renderBitmap(bitmap['image'])
                 delay = bitmap['delay']
 
-                panel_w = args['RHAPI'].config.get('LED', 'LED_COUNT', as_int=True) // args['RHAPI'].config.get('LED', 'LED_ROWS', as_int=True)
-                panel_h = args['RHAPI'].config.get('LED', 'LED_ROWS', as_int=True)
+                strip.setPixels(frames[0])
+                strip.show()
+                effect_delay(delay, args)
 
-                if args['RHAPI'].config.get('LED', 'PANEL_ROTATE', as_int=True) % 2:
-                    output_w = panel_h
-                    output_h = panel_w
-                else:
-                    output_w = panel_w
-                    output_h = panel_h
+    def frameKey(self, image_path):
+        config = self._rhapi.config
+        return ('bitmap', image_path,
+            config.get('LED', 'LED_COUNT', as_int=True),
+            config.get('LED', 'LED_ROWS', as_int=True),
+            config.get('LED', 'PANEL_ROTATE', as_int=True),
+            config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True))
 
-                size = img.size
+    def renderBitmap(self, image_path):
+        config = self._rhapi.config
+        img = Image.open(image_path)
 
-                ratio_w = output_w / size[0]
-                ratio_h = output_h / size[1]
+        panel_w = config.get('LED', 'LED_COUNT', as_int=True) // config.get('LED', 'LED_ROWS', as_int=True)
+        panel_h = config.get('LED', 'LED_ROWS', as_int=True)
 
-                ratio = min(ratio_w, ratio_h)
+        if config.get('LED', 'PANEL_ROTATE', as_int=True) % 2:
+            output_w = panel_h
+            output_h = panel_w
+        else:
+            output_w = panel_w
+            output_h = panel_h
 
-                img = img.resize((int(size[0]*ratio), int(size[1]*ratio)))
+        size = img.size
 
-                output_img = Image.new(img.mode, (output_w, output_h))
-                size = img.size
-                pad_left = int((output_w - size[0]) / 2)
-                pad_top = int((output_h - size[1]) / 2)
-                output_img.paste(img, (pad_left, pad_top))
-                output_img = output_img.rotate(90 * args['RHAPI'].config.get('LED', 'PANEL_ROTATE', as_int=True), expand=True)
+        ratio_w = output_w / size[0]
+        ratio_h = output_h / size[1]
 
-                setPixels(output_img, panel_w)
-                strip.show()
-                effect_delay(delay, args)
+        ratio = min(ratio_w, ratio_h)
+
+        img = img.resize((int(size[0]*ratio), int(size[1]*ratio)))
+
+        output_img = Image.new(img.mode, (output_w, output_h))
+        size = img.size
+        pad_left = int((output_w - size[0]) / 2)
+        pad_top = int((output_h - size[1]) / 2)
+        output_img.paste(img, (pad_left, pad_top))
+        output_img = output_img.rotate(90 * config.get('LED', 'PANEL_ROTATE', as_int=True), expand=True)
+
+        if output_img.mode != 'RGB':
+            output_img = output_img.convert('RGB')
+        return [image_to_pixels(output_img, config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True))]
+
+    # Loads the registered bitmaps into the frame cache, so effects do not read image files when run
+    def warmFrames(self, frame_cache, effects):
+        for led_effect in effects:
+            for bitmap in led_effect.default_args.get('bitmaps', []):
+                try:
+                    frame_cache.get(self.frameKey(bitmap['image']), lambda: self.renderBitmap(bitmap['image']))
+                except Exception:
+                    logger.exception("Unable to load LED bitmap '{}'".format(bitmap['image']))
+                gevent.sleep(0)
 
     def register_handlers(self, args):
-        for led_effect in [
+        effects = [
             LEDEffect("Image: RotorHazard", self.showBitmap, {
                     'recommended': [Evt.STARTUP]
                 }, {
@@ -129,9 +149,14 @@ class BitmapEffects():
                 },
                 name='bitmapCheckerboard',
             )
-        ]:
+        ]
+
+        for led_effect in effects:
             args['register_fn'](led_effect)
 
+        if args.get('frame_cache') is not None:
+            gevent.spawn(self.warmFrames, args['frame_cache'], effects)
+
 def initialize(rhapi):
     bitmap_effects = BitmapEffects(rhapi)
     rhapi.events.on(Evt.LED_INITIALIZE, bitmap_effects.register_handlers)
@@ -6,14 +6,18 @@
 import logging
 from dataclasses import asdict
 from eventmanager import Evt
-from led_event_manager import LEDEffect, LEDEvent, Color, ColorVal, effect_delay
+from led_event_manager import LEDEffect, LEDEvent, ColorVal, effect_delay
+from led_framebuffer import LEDFrameCache, image_to_pixels
 from RHRace import RaceStatus, Crossing
 
 import gevent
+from functools import lru_cache
 from time import monotonic
 
 logger = logging.getLogger(__name__)
 
+WARM_LAP_COUNT = 20  # lap numbers pre-rendered for each seat when a heat is set
+
 try:
     from PIL import Image, ImageFont, ImageDraw
 except ModuleNotFoundError as ex:
@@ -96,31 +100,37 @@ def printCharacter(args):
         return False
 
     if 'color' in args and args['color']:
-        color = convertColor(args['color'])
+        color = args['color']
     else:
-        color = convertColor(ColorVal.WHITE)
+        color = ColorVal.WHITE
 
-    panel = getPanelImg(strip, args['RHAPI'].config)
+    rhapi = args['RHAPI']
+    frames = getFrames(args, ('text', text, color, panelGeometry(rhapi.config)),
+                       lambda: renderCharacter(rhapi, text, color))
+
+    strip.setPixels(frames[0])
+    strip.show()
+
+def renderCharacter(rhapi, text, color):
+    panel = getPanelImg(None, rhapi.config)
 
     use_small_flag = True
     if panel['height'] >= 16:
-        font = ImageFont.truetype(args['RHAPI'].server.program_dir + '/static/fonts/RotorHazardPanel16.ttf', 16)
+        font = getFont(rhapi.server.program_dir, 16)
         _, _, w, h = font.getbbox(text)
         if w <= panel['width'] - 1:
             use_small_flag = False
             h = 16
 
     if use_small_flag:
-        font = ImageFont.truetype(args['RHAPI'].server.program_dir + '/static/fonts/RotorHazardPanel8.ttf', 8)
+        font = getFont(rhapi.server.program_dir, 8)
         _, _, w, h = font.getbbox(text)
         h = 8
 
-    panel['draw'].text((int((panel['width']-w)/2), int((panel['height']-h)/2)), text, font=font, fill=(color))
-
-    img = panel['im'].rotate(90 * args['RHAPI'].config.get('LED', 'PANEL_ROTATE', as_int=True), expand=True)
+    panel['draw'].text((int((panel['width']-w)/2), int((panel['height']-h)/2)), text, font=font, fill=convertColor(color))
 
-    setPixels(strip, img, panel['width'], args['RHAPI'].config)
-    strip.show()
+    img = panel['im'].rotate(90 * rhapi.config.get('LED', 'PANEL_ROTATE', as_int=True), expand=True)
+    return [getFrame(img, rhapi.config)]
 
 def scrollText(args):
     if 'strip' in args:
@@ -139,30 +149,48 @@ def scrollText(args):
         return False
 
     if 'color' in args and args['color']:
-        color = convertColor(args['color'])
+        color = args['color']
     else:
-        color = convertColor(ColorVal.WHITE)
+        color = ColorVal.WHITE
 
-    panel = getPanelImg(strip, args['RHAPI'].config)
+    rhapi = args['RHAPI']
+    if args['data'] == 'lap_time':
+        # lap times rarely repeat, so render as shown instead of filling the cache
+        frames = iterScrollFrames(rhapi, text, color)
+    else:
+        frames = getFrames(args, ('scroll', text, color, panelGeometry(rhapi.config)),
+                           lambda: list(iterScrollFrames(rhapi, text, color)))
+
+    for frame in frames:
+        strip.setPixels(frame)
+        strip.show()
+        effect_delay(10, args)
 
+def getScrollFont(rhapi, panel):
     if panel['height'] >= 16:
-        font = ImageFont.truetype(args['RHAPI'].server.program_dir + '/static/fonts/RotorHazardPanel16.ttf', 16)
-        _, _, w, h = font.getbbox(text)
-        h = 16
-    else:
-        font = ImageFont.truetype(args['RHAPI'].server.program_dir + '/static/fonts/RotorHazardPanel8.ttf', 8)
-        _, _, w, h = font.getbbox(text)
-        h = 8
+        return getFont(rhapi.server.program_dir, 16), 16
+    return getFont(rhapi.server.program_dir, 8), 8
+
+def iterScrollFrames(rhapi, text, color):
+    panel = getPanelImg(None, rhapi.config)
+    font, h = getScrollFont(rhapi, panel)
+    _, _, w, _ = font.getbbox(text)
 
     draw_y = int((panel['height']-h)/2)
+    fill = convertColor(color)
+    rotation = 90 * rhapi.config.get('LED', 'PANEL_ROTATE', as_int=True)
 
     for i in range(-panel['width'], w + panel['width']):
         panel['draw'].rectangle((0, 0, panel['width'], panel['height']), fill=(0, 0, 0))
-        panel['draw'].text((-i, draw_y), text, font=font, fill=(color))
-        img = panel['im'].rotate(90 * args['RHAPI'].config.get('LED', 'PANEL_ROTATE', as_int=True), expand=True)
-        setPixels(strip, img, panel['width'], args['RHAPI'].config)
-        strip.show()
-        effect_delay(10, args)
+        panel['draw'].text((-i, draw_y), text, font=font, fill=fill)
+        img = panel['im'].rotate(rotation, expand=True)
+        yield getFrame(img, rhapi.config)
+
+def getScrollFrameCount(rhapi, text):
+    panel = getPanelImg(None, rhapi.config)
+    font, _ = getScrollFont(rhapi, panel)
+    _, _, w, _ = font.getbbox(text)
+    return w + 2 * panel['width']
 
 def multiLapGrid(args):
     if 'strip' in args:
@@ -190,10 +218,10 @@ def multiLapGrid(args):
     half_width = panel['width']/2
 
     if panel['height'] >= 32:
-        font = ImageFont.truetype(args['RHAPI'].server.program_dir + '/static/fonts/RotorHazardPanel16.ttf', 16)
+        font = getFont(args['RHAPI'].server.program_dir, 16)
         font_h = 16
     else:
-        font = ImageFont.truetype(args['RHAPI'].server.program_dir + '/static/fonts/RotorHazardPanel8.ttf', 8)
+        font = getFont(args['RHAPI'].server.program_dir, 8)
         font_h = 8
 
     active_nodes = []
@@ -237,7 +265,7 @@ def multiLapGrid(args):
             panel['draw'].text((pos_x + 1, pos_y), text, font=font, fill=color)
 
     img = panel['im'].rotate(90 * args['RHAPI'].config.get('LED', 'PANEL_ROTATE', as_int=True), expand=True)
-    setPixels(strip, img, panel['width'], args['RHAPI'].config)
+    setPixels(strip, img, args['RHAPI'].config)
     strip.show()
 
 def getPanelImg(strip, config):
@@ -259,25 +287,71 @@ def getPanelImg(strip, config):
         'draw': ImageDraw.Draw(im)
     }
 
-def setPixels(strip, img, panel_w, config):
-    pos = 0
-    for row in range(0, img.height):
-        for col in range(0, img.width):
-            if pos >= strip.numPixels():
-                return
-
-            c = col
-            if config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True):
-                if row % 2 == 0:
-                    c = (panel_w - 1) - col
-
-            px = img.getpixel((c, row))
-            strip.setPixelColor(pos, Color(px[0], px[1], px[2]))
-            pos += 1
+def setPixels(strip, img, config):
+    strip.setImage(img, inverted_rows=config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True))
+
+def getFrame(img, config):
+    return image_to_pixels(img, config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True))
+
+@lru_cache(maxsize=None)
+def getFont(program_dir, size):
+    return ImageFont.truetype(program_dir + '/static/fonts/RotorHazardPanel' + str(size) + '.ttf', size)
+
+def panelGeometry(config):
+    return (
+        config.get('LED', 'LED_COUNT', as_int=True),
+        config.get('LED', 'LED_ROWS', as_int=True),
+        config.get('LED', 'PANEL_ROTATE', as_int=True),
+        config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True)
+    )
+
+def getFrames(args, key, render_fn):
+    frame_cache = getattr(args.get('manager'), 'frame_cache', None)
+    if isinstance(frame_cache, LEDFrameCache):
+        return frame_cache.get(key, render_fn)
+    return render_fn()
+
+# Renders the frames likely to be shown during the new heat's races (countdown, and each
+# seat's lap counts, positions and winner message), so they are cached before racing starts.
+# Warmed frames may use up to half the cache; winner scrolls that do not fit are skipped, and
+# the single-character frames (needed without delay when laps are recorded) are added last.
+def warmFrames(args):
+    rhapi = args['RHAPI']
+    frame_cache = args['frame_cache']
+    geometry = panelGeometry(rhapi.config)
+    frame_pixels = geometry[0]
+
+    char_texts = [(str(i), ColorVal.ORANGE) for i in range(10)]
+    char_texts.append(('X', ColorVal.ORANGE))
+    scroll_texts = []
+
+    seat_colors = rhapi.race.seat_colors
+    seat_pilots = [(seat, pilot_id) for seat, pilot_id in rhapi.race.pilots.items() \
+                   if pilot_id and seat < len(seat_colors)]
+    for seat, pilot_id in seat_pilots:
+        color = seat_colors[seat]
+        char_texts.extend((str(lap), color) for lap in range(1, WARM_LAP_COUNT + 1))
+        char_texts.extend((str(pos), color) for pos in range(1, len(seat_pilots) + 1))
+        pilot = rhapi.db.pilot_by_id(pilot_id)
+        if pilot and pilot.callsign:
+            scroll_texts.append((rhapi.__('Winner is') + ' ' + pilot.callsign, color))
+
+    pixels_avail = frame_cache.max_pixels // 2 - len(set(char_texts)) * frame_pixels
+    for text, color in scroll_texts:
+        scroll_pixels = getScrollFrameCount(rhapi, text) * frame_pixels
+        if scroll_pixels > pixels_avail:
+            logger.debug("Not pre-rendering LED scroll '{}'; frame cache too small".format(text))
+            continue
+        pixels_avail -= scroll_pixels
+        frame_cache.get(('scroll', text, color, geometry), lambda: list(iterScrollFrames(rhapi, text, color)))
+        gevent.sleep(0)
+
+    for text, color in char_texts:
+        frame_cache.get(('text', text, color, geometry), lambda: renderCharacter(rhapi, text, color))
+        gevent.sleep(0)
 
 def clearPixels(strip):
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, ColorVal.NONE)
+    strip.fill(ColorVal.NONE)
 
 def convertColor(color):
     return color >> 16, (color >> 8) % 256, color % 256
@@ -402,6 +476,12 @@ def register_handlers(args):
     for led_effect in discover(args['RHAPI']):
         args['register_fn'](led_effect)
 
+    if args.get('frame_cache') is not None:
+        args['RHAPI'].events.on(Evt.HEAT_SET, warmFrames, {
+            'RHAPI': args['RHAPI'],
+            'frame_cache': args['frame_cache']
+            }, name='LED_character_warm')
+
 def initialize(rhapi):
     rhapi.events.on(Evt.LED_INITIALIZE, register_handlers, {'RHAPI': rhapi})
 
@@ -5,7 +5,7 @@
 
 import logging
 from eventmanager import Evt
-from led_event_manager import LEDEffect, LEDEvent, Color, ColorVal, effect_delay
+from led_event_manager import LEDEffect, LEDEvent, ColorVal, effect_delay
 
 logger = logging.getLogger(__name__)
 
@@ -90,24 +90,10 @@ def getPanelImg(strip, args):
     }
 
 def setPixels(strip, img, args):
-    pos = 0
-    for row in range(0, img.height):
-        for col in range(0, img.width):
-            if pos >= strip.numPixels():
-                return
-
-            c = col
-            if args['RHAPI'].config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True):
-                if row % 2 == 0:
-                    c = 15 - col
-
-            px = img.getpixel((c, row))
-            strip.setPixelColor(pos, Color(px[0], px[1], px[2]))
-            pos += 1
+    strip.setImage(img, inverted_rows=args['RHAPI'].config.get('LED', 'INVERTED_PANEL_ROWS', as_int=True))
 
 def clearPixels(strip):
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, ColorVal.NONE)
+    strip.fill(ColorVal.NONE)
 
 def convertColor(color):
     return color >> 16, (color >> 8) % 256, color % 256
@@ -23,16 +23,9 @@ def leaderProxy(args):
 
 def led_on(strip, color=ColorVal.WHITE, pattern=ColorPattern.SOLID, offset=0):
     if pattern == ColorPattern.SOLID:
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, color)
+        strip.fill(color)
     else:
-        patternlength = sum(pattern)
-
-        for i in range(strip.numPixels()):
-            if (i+offset) % patternlength < pattern[0]:
-                strip.setPixelColor(i, color)
-            else:
-                strip.setPixelColor(i, ColorVal.NONE)
+        strip.fillPattern(color, pattern, offset, ColorVal.NONE)
 
     strip.show()
 
@@ -78,8 +71,8 @@ def rainbow(args):
     else:
         return False
 
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, color_wheel(int(i * 256 / strip.numPixels()) & 255))
+    numPixels = strip.numPixels()
+    strip.setPixels([color_wheel(int(i * 256 / numPixels) & 255) for i in range(numPixels)])
     strip.show()
 
 def rainbowCycle(args):
@@ -93,10 +86,13 @@ def rainbowCycle(args):
     if wait_ms <= 0:
         wait_ms = 2
 
+    numPixels = strip.numPixels()
+    wheel = [color_wheel(pos) for pos in range(256)]
+    positions = [int(i * 256 / numPixels) for i in range(numPixels)]
+
     while True:
         for j in range(256):
-            for i in range(strip.numPixels()):
-                strip.setPixelColor(i, color_wheel((int(i * 256 / strip.numPixels()) + j) & 255))
+            strip.setPixels([wheel[(pos + j) & 255] for pos in positions])
             strip.show()
             effect_delay(wait_ms, args)
 
@@ -242,9 +238,7 @@ def sparkle(args):
 
     for i in range(a['iterations'] + decaySteps):
         # fade brightness all LEDs one step
-        for j in range(strip.numPixels()):
-            c = strip.getPixelColor(j)
-            strip.setPixelColor(j, dim(c, a['decay']))
+        strip.dim(a['decay'])
 
         # pick new pixels to light up
         if i < a['iterations']:
@@ -278,10 +272,10 @@ def meteor(args):
     for i in range(strip.numPixels()*2):
 
         # fade brightness all LEDs one step
-        for j in range(strip.numPixels()):
-            if not a['randomDecay'] or random.random() > 0.5:
-                c = strip.getPixelColor(j)
-                strip.setPixelColor(j, dim(c, a['decay']))
+        if a['randomDecay']:
+            strip.dim(a['decay'], [random.random() > 0.5 for _j in range(strip.numPixels())])
+        else:
+            strip.dim(a['decay'])
 
         # draw meteor
         for j in range(a['meteorSize']):
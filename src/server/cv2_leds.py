@@ -34,13 +34,15 @@ class cv2_LED_emulation:
     def getPixelColor(self, i):
         return self.pixels[i]
 
-    def show(self):
-        image = np.zeros((self.height, self.width, 3), np.uint8)
+    def setPixels(self, buffer):
+        self.pixels = buffer.tolist()
 
-        for i in range(len(self.pixels)):
-            c = i % self.width
-            r = i // self.width
-            image[r, c] = tuple(reversed(convertColor(self.pixels[i])))
+    def show(self):
+        pixels = np.zeros(self.height * self.width, np.uint32)
+        count = min(len(self.pixels), len(pixels))
+        pixels[:count] = self.pixels[:count]
+        pixels = pixels.reshape(self.height, self.width)
+        image = np.dstack((pixels & 0xff, (pixels >> 8) & 0xff, (pixels >> 16) & 0xff)).astype(np.uint8)  # BGR
 
         image = cv2.resize(image, (self.width*self.scale, self.height*self.scale), interpolation=cv2.INTER_NEAREST)
 
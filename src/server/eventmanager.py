@@ -4,12 +4,20 @@ RotorHazard event manager
 
 import logging
 import gevent
+import gevent.queue
 import copy
+from collections import deque
 from RHUtils import catchLogExceptionsWrapper
 from time import monotonic
 
 logger = logging.getLogger(__name__)
 
+HANDLER_WORKERS_DEFAULT = 8  # greenlets running queued (priority >= 100) handlers
+HANDLER_STALL_SECS = 2.0  # workers busy longer than this do not count against the pool size
+HANDLER_MAX_RUNNING = 2  # workers that may run the same handler (for an event) at once
+HANDLER_MAX_PENDING = 100  # queued calls per handler (for an event) before further calls are dropped
+QUEUE_WARN_DEPTH = 200  # queue depth at which a warning is logged
+
 class EventManager:
     processEventObj = gevent.event.Event()
 
@@ -19,6 +27,23 @@ class EventManager:
 
     def __init__(self, racecontext):
         self._racecontext = racecontext
+        self._handler_lists = {}  # event -> precomputed handler entries (including 'Evt.ALL' handlers)
+        self._queue = gevent.queue.PriorityQueue()  # (priority, seq, (event, name), handler_fn, args)
+        self._queue_seq = 0
+        self._workers = {}  # worker greenlet -> start time of running handler (None if idle)
+        self._max_workers = None
+        self._pending_by_key = {}  # queued or running calls, by (event, handler name)
+        self._running_by_key = {}
+        self._held_by_key = {}  # calls waiting for a running call of the same handler to finish
+        self._stats = {
+            'queued': 0,
+            'completed': 0,
+            'dropped': 0,
+            'max_depth': 0,
+            'dropped_by_handler': {},
+        }
+        self._warned_depth = False
+        self._warned_behind = set()  # (event, name) of handlers warned as falling behind (until caught up)
 
     def on(self, event, name, handler_fn, default_args=None, priority=200, unique=False):
         if self._racecontext.serverconfig.get_item('LOGGING', 'EVENTS') >= 1:
@@ -38,6 +63,7 @@ class EventManager:
         }
 
         self.eventOrder[event] = [key for key, _value in sorted(self.events[event].items(), key=lambda x: x[1]['priority'])]
+        self._handler_lists.clear()
 
         return True
 
@@ -53,48 +79,149 @@ class EventManager:
         del(self.events[event][name])
 
         self.eventOrder[event] = [key for key, _value in sorted(self.events[event].items(), key=lambda x: x[1]['priority'])]
+        self._handler_lists.clear()
 
         return True
 
+    def get_handler_list(self, event):
+        handler_list = self._handler_lists.get(event)
+        if handler_list is None:
+            handler_list = []
+            for ev in ([event, Evt.ALL] if event != Evt.HEARTBEAT else [event]):
+                for name in self.eventOrder.get(ev, []):
+                    handler = self.events[ev][name]
+                    handler_list.append((name, handler['handler_fn'], handler['default_args'], handler['priority']))
+            handler_list = tuple(handler_list)
+            self._handler_lists[event] = handler_list
+        return handler_list
+
     def trigger(self, event, evt_args=None):
-        if logger.getEffectiveLevel() <= logging.DEBUG and \
-            self._racecontext.serverconfig.get_item('LOGGING', 'EVENTS') >= 2:  # if DEBUG msgs actually being logged
+        debug_flag = logger.getEffectiveLevel() <= logging.DEBUG and \
+            self._racecontext.serverconfig.get_item('LOGGING', 'EVENTS') >= 2  # if DEBUG msgs actually being logged
+        if debug_flag:
             logger.debug("eventmanager.trigger, event={}, evt_args: {}".format(event, str(evt_args)[:80]))
-        evt_list = []
-        if event in self.eventOrder:
-            for name in self.eventOrder[event]:
-                evt_list.append([event, name])
-        if event != Evt.HEARTBEAT and Evt.ALL in self.eventOrder:
-            for name in self.eventOrder[Evt.ALL]:
-                evt_list.append([Evt.ALL, name])
-
-        if len(evt_list):
-            for ev, name in evt_list:
-                handler = self.events[ev][name]
-                args = copy.copy(handler['default_args'])
 
+        for name, handler_fn, default_args, priority in self.get_handler_list(event):
+            if default_args:
+                args = copy.copy(default_args)
                 if evt_args:
-                    if args:
-                        args.update(evt_args)
-                    else:
-                        args = evt_args
+                    args.update(evt_args)
+            elif evt_args:
+                args = evt_args
+            else:
+                args = {}
+
+            args['_eventName'] = event
+
+            if debug_flag:
+                logger.debug("eventmanager.trigger calling handler for event={}, name='{}', priority={}".\
+                             format(event, name, priority))
 
-                args['_eventName'] = event
+            if priority < 100:
+                self.run_handler(handler_fn, args)
+            else:
+                self.queue_handler(event, name, handler_fn, args, priority)
 
-                if handler['unique']:
-                    threadName = name + str(monotonic())
-                else:
-                    threadName = name
+    # Handlers with priority >= 100 are run by a bounded set of worker greenlets, lowest
+    # priority value first (then in trigger order).  Each handler may only occupy a couple
+    # of workers at once, and one that falls too far behind has further calls dropped, so
+    # a slow handler cannot hold up the others.  Limits apply per event, as one name may be
+    # used for a handler on many events (or on 'Evt.ALL').
+    def queue_handler(self, event, name, handler_fn, args, priority):
+        key = (event, name)
+        pending = self._pending_by_key.get(key, 0)
+        if pending >= HANDLER_MAX_PENDING:
+            self._stats['dropped'] += 1
+            dropped_by_handler = self._stats['dropped_by_handler']
+            dropped_by_handler[name] = dropped_by_handler.get(name, 0) + 1
+            if key not in self._warned_behind:
+                self._warned_behind.add(key)
+                logger.warning("Event handler '{}' is falling behind on '{}' ({} calls queued); dropping calls".\
+                               format(name, event, pending))
+            return False
+        self._pending_by_key[key] = pending + 1
 
-                if logger.getEffectiveLevel() <= logging.DEBUG and \
-                    self._racecontext.serverconfig.get_item('LOGGING', 'EVENTS') >= 2:  # if DEBUG msgs actually being logged
-                    logger.debug("eventmanager.trigger calling handler for event={}, name='{}', priority={}".\
-                                 format(event, name, handler['priority']))
+        self._queue_seq += 1
+        self._queue.put((priority, self._queue_seq, key, handler_fn, args))
+        self._stats['queued'] += 1
+
+        depth = self._queue.qsize()
+        if depth > self._stats['max_depth']:
+            self._stats['max_depth'] = depth
+        if depth >= QUEUE_WARN_DEPTH:
+            if not self._warned_depth:
+                self._warned_depth = True
+                logger.warning("Event handler queue depth is {}".format(depth))
+        elif depth < QUEUE_WARN_DEPTH // 2:
+            self._warned_depth = False
+
+        self.check_workers()
+        return True
+
+    def check_workers(self):
+        if self._max_workers is None:
+            self._max_workers = self._racecontext.serverconfig.get_item_int('GENERAL', 'EVENT_WORKERS', \
+                                                                            HANDLER_WORKERS_DEFAULT) or 1
+        now = monotonic()
+        idle_count = 0
+        active_count = 0
+        for start_time in self._workers.values():
+            if start_time is None:
+                idle_count += 1
+            elif now - start_time < HANDLER_STALL_SECS:
+                active_count += 1
+        if self._queue.qsize() > idle_count and idle_count + active_count < self._max_workers:
+            worker = gevent.spawn(self.worker_fn)
+            self._workers[worker] = None
+
+    def worker_fn(self):
+        worker = gevent.getcurrent()
+        try:
+            while True:
+                if len(self._workers) > self._max_workers and not self._queue.qsize():
+                    return  # extra worker (added while others stalled) no longer needed
+                item = self._queue.get()
+                _priority, _seq, key, handler_fn, args = item
+                if self._running_by_key.get(key, 0) >= HANDLER_MAX_RUNNING:
+                    self._held_by_key.setdefault(key, deque()).append(item)
+                    continue
+                self._running_by_key[key] = self._running_by_key.get(key, 0) + 1
+                self._workers[worker] = monotonic()
+                try:
+                    rhdata = getattr(self._racecontext, 'rhdata', None)
+                    if rhdata:
+                        with rhdata.get_db_session_handle():  # make sure DB session/connection is cleaned up
+                            self.run_handler(handler_fn, args)
+                    else:
+                        self.run_handler(handler_fn, args)
+                finally:
+                    self._workers[worker] = None
+                    self._running_by_key[key] -= 1
+                    self._pending_by_key[key] -= 1
+                    if self._pending_by_key[key] < HANDLER_MAX_PENDING // 2:
+                        self._warned_behind.discard(key)  # caught up; warn again if it falls behind
+                    self._stats['completed'] += 1
+                    held = self._held_by_key.get(key)
+                    if held:
+                        self._queue.put(held.popleft())  # keeps its original place in line
+        finally:
+            self._workers.pop(worker, None)
 
-                if handler['priority'] < 100:
-                    self.run_handler(handler['handler_fn'], args)
-                else:
-                    gevent.spawn(self.run_handler, handler['handler_fn'], args)
+    def get_stats(self):
+        '''Returns handler queue metrics'''
+        now = monotonic()
+        stats = copy.deepcopy(self._stats)
+        stats['depth'] = self._queue.qsize()
+        stats['workers'] = len(self._workers)
+        stats['busy_workers'] = sum(1 for start_time in self._workers.values() if start_time is not None)
+        stats['stalled_workers'] = sum(1 for start_time in self._workers.values() \
+                                       if start_time is not None and now - start_time >= HANDLER_STALL_SECS)
+        pending_by_handler = {}
+        for (_event, name), count in self._pending_by_key.items():
+            if count:
+                pending_by_handler[name] = pending_by_handler.get(name, 0) + count
+        stats['pending_by_handler'] = pending_by_handler
+        return stats
 
     @catchLogExceptionsWrapper
     def run_handler(self, handler, args):
@@ -3,6 +3,7 @@ RotorHazard filter manager
 '''
 
 import logging
+from time import perf_counter
 from RHUtils import catchLogExceptionsWrapper
 
 logger = logging.getLogger(__name__)
@@ -11,6 +12,9 @@ class FilterManager:
     def __init__(self, rhapi):
         self.filters = {}
         self.filterOrder = {}
+        self.activeTypes = set()  # filter types with at least one filter registered
+        self.chains = {}  # filter type -> (filter_fn, with_context) tuples in priority order
+        self.stats = {}  # filter type -> [calls, cumulative seconds]
         self._rhapi = rhapi
 
     def add_filter(self, filter_type, name, filter_fn, priority=200, with_context=False):
@@ -28,6 +32,7 @@ class FilterManager:
         }
 
         self.filterOrder[filter_type] = [key for key, _value in sorted(self.filters[filter_type].items(), key=lambda x: x[1]['priority'])]
+        self.compileChain(filter_type)
 
         return True
 
@@ -41,22 +46,45 @@ class FilterManager:
         del(self.filters[filter_type][name])
 
         self.filterOrder[filter_type] = [key for key, _value in sorted(self.filters[filter_type].items(), key=lambda x: x[1]['priority'])]
+        self.compileChain(filter_type)
 
         return True
 
-    def run_filters(self, filter_type, data, context=None):
-        filter_list = []
-        if filter_type in self.filterOrder:
-            for name in self.filterOrder[filter_type]:
-                filter_list.append(name)
+    # Precomputes the call sequence for a filter type; chains are replaced (not modified)
+    # on changes, so a chain being run is unaffected by filters added or removed meanwhile
+    def compileChain(self, filter_type):
+        chain = tuple((self.filters[filter_type][name]['filter_fn'], self.filters[filter_type][name]['with_context']) \
+                      for name in self.filterOrder[filter_type])
+        if chain:
+            self.chains[filter_type] = chain
+            self.activeTypes.add(filter_type)
+        else:
+            self.chains.pop(filter_type, None)
+            self.activeTypes.discard(filter_type)
 
-        if len(filter_list):
-            for name in filter_list:
-                filter = self.filters[filter_type][name]
-                data = self.run_filter(filter['filter_fn'], filter['with_context'], data, context)
+    def run_filters(self, filter_type, data, context=None):
+        chain = self.chains.get(filter_type)
+        if not chain:
+            return data
+
+        start_time = perf_counter()
+        for filter_fn, with_context in chain:
+            data = self.run_filter(filter_fn, with_context, data, context)
+
+        stats = self.stats.get(filter_type)
+        if stats:
+            stats[0] += 1
+            stats[1] += perf_counter() - start_time
+        else:
+            self.stats[filter_type] = [1, perf_counter() - start_time]
 
         return data
 
+    def get_stats(self):
+        '''Returns call count and cumulative time (ms) of filter chains run, by filter type'''
+        return {filter_type: {'calls': calls, 'total_ms': secs * 1000} \
+                for filter_type, (calls, secs) in self.stats.items()}
+
     @catchLogExceptionsWrapper
     def run_filter(self, handler, with_context, data, context):
         # RHAPI <1.4 expect only one argument
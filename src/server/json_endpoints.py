@@ -1,8 +1,11 @@
 # JSON API
 import dataclasses
+import hashlib
 import json
+import gevent
 import Results
 from sqlalchemy.ext.declarative import DeclarativeMeta
+from flask import request, Response, stream_with_context
 from flask.blueprints import Blueprint
 
 class AlchemyEncoder(json.JSONEncoder):
@@ -32,223 +35,402 @@ class AlchemyEncoder(json.JSONEncoder):
 def createBlueprint(RaceContext, serverInfo):
     APP = Blueprint('json', __name__)
 
+    API_RESPONSE_CACHE_SIZE = 256  # max cached response bodies
+    API_PAGE_LIMIT_MAX = 1000  # max items per page
+    API_STREAM_CHUNK = 100  # items fetched per query when streaming
+
+    # serialized response bodies, by request path and query: (version, body, etag)
+    response_cache = {}
+
+    def data_version():
+        return RaceContext.rhdata.get_data_version()
+
+    def json_response(version, build_payload):
+        '''Returns JSON response for current request, rebuilt only when version token has changed.
+        Responses carry a strong ETag (hash of body), so unchanged data is answered with 304 Not Modified.'''
+        cache_key = request.full_path
+        entry = response_cache.get(cache_key)
+        if entry is None or entry[0] != version:
+            body = json.dumps(build_payload(), cls=AlchemyEncoder)
+            entry = (version, body, hashlib.sha1(body.encode('utf-8')).hexdigest())
+            if len(response_cache) >= API_RESPONSE_CACHE_SIZE:
+                response_cache.clear()
+            response_cache[cache_key] = entry
+
+        response = Response(entry[1], 200, mimetype='application/json')
+        response.set_etag(entry[2])
+        response.headers['Cache-Control'] = 'no-cache'  # cacheable, but revalidate on each use
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Expose-Headers'] = 'ETag'
+        return response.make_conditional(request)
+
+    def page_args(all_fields):
+        '''Returns paging options from request query args for bulk endpoints:
+        'cursor' (id of last item on previous page), 'limit' (page size), 'fields'
+        (comma-separated item fields to include) and 'format' ('ndjson' streams items as lines)'''
+        limit = request.args.get('limit', type=int)
+        fields = request.args.get('fields')
+        return {
+            'cursor': request.args.get('cursor', 0, type=int),
+            'limit': max(1, min(limit, API_PAGE_LIMIT_MAX)) if limit else None,
+            'fields': [field for field in all_fields if field in fields.split(',')] if fields else all_fields,
+            'stream': request.args.get('format') == 'ndjson'
+        }
+
+    def ndjson_response(fetch_page, cursor, limit, build_head=None):
+        '''Streams items from 'fetch_page(after_id, limit)' (list of (id, item)) as newline-delimited
+        JSON, querying in chunks and yielding to other greenlets between them. The optional head
+        line comes first; if a limit is given a final '{"next_cursor": ...}' line is added.'''
+        def generate():
+            if build_head:
+                yield json.dumps(build_head(), cls=AlchemyEncoder) + '\n'
+            after_id = cursor
+            remaining = limit
+            while True:
+                size = API_STREAM_CHUNK if remaining is None else min(API_STREAM_CHUNK, remaining)
+                page = fetch_page(after_id, size)
+                for _item_id, item in page:
+                    yield json.dumps(item, cls=AlchemyEncoder) + '\n'
+                if page:
+                    after_id = page[-1][0]
+                if remaining is not None:
+                    remaining -= len(page)
+                if len(page) < size or remaining == 0:
+                    break
+                gevent.sleep(0)
+            if limit:
+                yield json.dumps({'next_cursor': after_id if remaining == 0 else None}) + '\n'
+
+        response = Response(stream_with_context(generate()), 200, mimetype='application/x-ndjson')
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    def next_cursor(page, limit):
+        return page[-1][0] if limit and len(page) == limit else None
+
+    HEAT_FIELDS = ['displayname', 'heat_id', 'class_id', 'nodes_pilots', 'locked']
+
+    def fetch_heats(after_id, limit, fields):
+        heats = RaceContext.rhdata.get_heats_page(after_id, limit)
+        heat_ids = [heat.id for heat in heats]
+        pilots = RaceContext.rhdata.get_heatNode_pilots_by_heats(heat_ids) if 'nodes_pilots' in fields else None
+        rounds = RaceContext.rhdata.get_max_rounds_by_heats(heat_ids) if 'locked' in fields else None
+
+        page = []
+        for heat in heats:
+            values = {}
+            for field in fields:
+                if field == 'displayname':
+                    values[field] = heat.display_name
+                elif field == 'heat_id':
+                    values[field] = heat.id
+                elif field == 'class_id':
+                    values[field] = heat.class_id
+                elif field == 'nodes_pilots':
+                    values[field] = pilots[heat.id]
+                elif field == 'locked':
+                    values[field] = heat.id in rounds
+            page.append((heat.id, values))
+        return page
+
+    RACE_HEAT_FIELDS = ['id', 'rounds']
+
+    def fetch_race_heats(after_id, limit, fields):
+        heats = RaceContext.rhdata.get_heats_page(after_id, limit)
+        rounds = RaceContext.rhdata.get_max_rounds_by_heats([heat.id for heat in heats]) if 'rounds' in fields else None
+
+        page = []
+        for heat in heats:
+            values = {}
+            if 'id' in fields:
+                values['id'] = heat.id
+            if 'rounds' in fields:
+                values['rounds'] = rounds.get(heat.id, 0)
+            page.append((heat.id, values))
+        return page
+
+    PILOTRACE_FIELDS = ['callsign', 'pilot_id', 'node_index', 'laps']
+    LAP_COLUMNS = ['id', 'lap_time_stamp', 'lap_time', 'lap_time_formatted', 'source', 'deleted']
+
+    def fetch_pilotraces(race_id, after_id, limit, fields):
+        pilotraces = RaceContext.rhdata.get_savedPilotRaces_page(race_id, after_id, limit)
+        if 'laps' in fields:
+            laps = RaceContext.rhdata.get_savedRaceLap_rows_by_savedPilotRaces( \
+                [pilotrace.id for pilotrace in pilotraces], LAP_COLUMNS)
+
+        page = []
+        for pilotrace in pilotraces:
+            values = {}
+            for field in fields:
+                if field == 'callsign':
+                    pilot_data = RaceContext.rhdata.get_pilot(pilotrace.pilot_id)
+                    values[field] = pilot_data.callsign if pilot_data else None
+                elif field == 'pilot_id':
+                    values[field] = pilotrace.pilot_id
+                elif field == 'node_index':
+                    values[field] = pilotrace.node_index
+                elif field == 'laps':
+                    values[field] = [{column: getattr(lap, column) for column in LAP_COLUMNS} \
+                                     for lap in laps[pilotrace.id]]
+            page.append((pilotrace.id, values))
+        return page
+
     @APP.route('/api/pilot/all')
     def api_pilot_all():
-        pilots = RaceContext.rhdata.get_pilots()
-        payload = []
-        for pilot in pilots:
-            payload.append(pilot)
+        def build_payload():
+            pilots = RaceContext.rhdata.get_pilots()
+            payload = []
+            for pilot in pilots:
+                payload.append(pilot)
+
+            return {"pilots": payload}
 
-        return json.dumps({"pilots": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/pilot/<int:pilot_id>')
     def api_pilot(pilot_id):
-        pilot = RaceContext.rhdata.get_pilot(pilot_id)
+        def build_payload():
+            pilot = RaceContext.rhdata.get_pilot(pilot_id)
 
-        return json.dumps({"pilot": pilot}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            return {"pilot": pilot}
+
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/heat/all')
     def api_heat_all():
-        all_heats = {}
-        for heat in RaceContext.rhdata.get_heats():
-            heat_id = heat.id
-            displayname = heat.display_name
-            race_class = heat.class_id
-
-            heatnodes = RaceContext.rhdata.get_heatNodes_by_heat(heat.id)
-            pilots = {}
-            for pilot in heatnodes:
-                pilots[pilot.node_index] = pilot.pilot_id
-
-            locked = RaceContext.rhdata.savedRaceMetas_has_heat(heat.id)
-
-            all_heats[heat_id] = {
-                'displayname': displayname,
-                'heat_id': heat_id,
-                'class_id': race_class,
-                'nodes_pilots': pilots,
-                'locked': locked
-            }
+        args = page_args(HEAT_FIELDS)
+        if args['stream']:
+            return ndjson_response(lambda after_id, limit: fetch_heats(after_id, limit, args['fields']), \
+                                   args['cursor'], args['limit'])
 
-        return json.dumps({"heats": all_heats}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        def build_payload():
+            page = fetch_heats(args['cursor'], args['limit'], args['fields'])
+            payload = {"heats": dict(page)}
+            if args['limit']:
+                payload['next_cursor'] = next_cursor(page, args['limit'])
+            return payload
+
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/heat/<int:heat_id>')
     def api_heat(heat_id):
-        heat = RaceContext.rhdata.get_heat(heat_id)
-        if heat:
-            displayname = heat.display_name
-            race_class = heat.class_id
-
-            heatnodes = RaceContext.rhdata.get_heatNodes_by_heat(heat.id)
-            pilots = {}
-            for pilot in heatnodes:
-                pilots[pilot.node_index] = pilot.pilot_id
-
-            locked = RaceContext.rhdata.savedRaceMetas_has_heat(heat.id)
-
-            heat = {
-                'displayname': displayname,
-                'heat_id': heat_id,
-                'class_id': race_class,
-                'nodes_pilots': pilots,
-                'locked': locked
+        def build_payload():
+            heat = RaceContext.rhdata.get_heat(heat_id)
+            if heat:
+                displayname = heat.display_name
+                race_class = heat.class_id
+
+                heatnodes = RaceContext.rhdata.get_heatNodes_by_heat(heat.id)
+                pilots = {}
+                for pilot in heatnodes:
+                    pilots[pilot.node_index] = pilot.pilot_id
+
+                locked = RaceContext.rhdata.savedRaceMetas_has_heat(heat.id)
+
+                heat = {
+                    'displayname': displayname,
+                    'heat_id': heat_id,
+                    'class_id': race_class,
+                    'nodes_pilots': pilots,
+                    'locked': locked
+                }
+            else:
+                heat = None
+
+            payload = {
+                'setup': heat,
+                'leaderboard': RaceContext.rhdata.get_results_heat(heat_id)
             }
-        else:
-            heat = None
 
-        payload = {
-            'setup': heat,
-            'leaderboard': RaceContext.rhdata.get_results_heat(heat_id)
-        }
+            return {"heat": payload}
 
-        return json.dumps({"heat": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/class/all')
     def api_class_all():
-        race_classes = RaceContext.rhdata.get_raceClasses()
-        payload = []
-        for race_class in race_classes:
-            payload.append(race_class)
+        def build_payload():
+            race_classes = RaceContext.rhdata.get_raceClasses()
+            payload = []
+            for race_class in race_classes:
+                payload.append(race_class)
 
-        return json.dumps({"classes": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            return {"classes": payload}
+
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/class/<int:class_id>')
     def api_class(class_id):
-        race_class = RaceContext.rhdata.get_raceClass(class_id)
+        def build_payload():
+            race_class = RaceContext.rhdata.get_raceClass(class_id)
+
+            return {"class": race_class}
 
-        return json.dumps({"class": race_class}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/format/all')
     def api_format_all():
-        formats = RaceContext.rhdata.get_raceFormats()
-        payload = []
-        for race_format in formats:
-            payload.append(race_format)
+        def build_payload():
+            formats = RaceContext.rhdata.get_raceFormats()
+            payload = []
+            for race_format in formats:
+                payload.append(race_format)
 
-        return json.dumps({"formats": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            return {"formats": payload}
+
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/format/<int:format_id>')
     def api_format(format_id):
-        raceformat = RaceContext.rhdata.get_raceFormat(format_id)
+        def build_payload():
+            raceformat = RaceContext.rhdata.get_raceFormat(format_id)
+
+            return {"format": raceformat}
 
-        return json.dumps({"format": raceformat}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/profile/all')
     def api_profile_all():
-        profiles = RaceContext.rhdata.get_profiles()
-        payload = []
-        for profile in profiles:
-            payload.append(profile)
+        def build_payload():
+            profiles = RaceContext.rhdata.get_profiles()
+            payload = []
+            for profile in profiles:
+                payload.append(profile)
 
-        return json.dumps({"profiles": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            return {"profiles": payload}
+
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/profile/<int:profile_id>')
     def api_profile(profile_id):
-        profile = RaceContext.rhdata.get_profile(profile_id)
+        def build_payload():
+            profile = RaceContext.rhdata.get_profile(profile_id)
+
+            return {"profile": profile}
 
-        return json.dumps({"profile": profile}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/race/current')
     def api_race_current():
-        payload = {
-            "raw_laps": dataclasses.asdict(RaceContext.race.node_laps),
-            "leaderboard": RaceContext.race.get_results()
-        }
+        def build_payload():
+            payload = {
+                "raw_laps": dataclasses.asdict(RaceContext.race.node_laps),
+                "leaderboard": RaceContext.race.get_results()
+            }
 
-        return json.dumps({"race": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            return {"race": payload}
+
+        # live race data is not in database; use race results cache tokens
+        version = (data_version(), RaceContext.race.race_status, \
+                   RaceContext.race.lap_cacheStatus.get('data_ver'), RaceContext.race.cacheStatus.get('data_ver'))
+        return json_response(version, build_payload)
 
     @APP.route('/api/race/all')
     def api_race_all():
-        heats = []
-        for heat in RaceContext.rhdata.get_heats():
-            max_rounds = RaceContext.rhdata.get_max_round(heat.id)
-            heats.append({
-                "id": heat.id,
-                "rounds": max_rounds
-            })
-
-        payload = {
-            "heats": heats,
-            "leaderboard": RaceContext.rhdata.get_results_event()
-        }
+        # event leaderboard is only included with first page
+        args = page_args(RACE_HEAT_FIELDS)
+        build_head = None if args['cursor'] else lambda: {"leaderboard": RaceContext.rhdata.get_results_event()}
+        if args['stream']:
+            return ndjson_response(lambda after_id, limit: fetch_race_heats(after_id, limit, args['fields']), \
+                                   args['cursor'], args['limit'], build_head)
+
+        def build_payload():
+            page = fetch_race_heats(args['cursor'], args['limit'], args['fields'])
+            payload = {
+                "heats": [heat for _heat_id, heat in page]
+            }
+            if build_head:
+                payload.update(build_head())
+            if args['limit']:
+                payload['next_cursor'] = next_cursor(page, args['limit'])
+            return {"races": payload}
 
-        return json.dumps({"races": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return json_response(data_version(), build_payload)
 
     @APP.route('/api/race/<int:heat_id>/<int:round_id>')
     def api_race(heat_id, round_id):
+        # race details are only included with first page; 'nodes' are paged by pilot race
+        args = page_args(PILOTRACE_FIELDS)
         race = RaceContext.rhdata.get_savedRaceMeta_by_heat_round(heat_id, round_id)
 
-        pilotraces = []
-        for pilotrace in RaceContext.rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id):
-            laps = []
-            for lap in RaceContext.rhdata.get_savedRaceLaps_by_savedPilotRace(pilotrace.id):
-                laps.append({
-                        'id': lap.id,
-                        'lap_time_stamp': lap.lap_time_stamp,
-                        'lap_time': lap.lap_time,
-                        'lap_time_formatted': lap.lap_time_formatted,
-                        'source': lap.source,
-                        'deleted': lap.deleted
-                    })
-
-            pilot_data = RaceContext.rhdata.get_pilot(pilotrace.pilot_id)
-            if pilot_data:
-                nodepilot = pilot_data.callsign
-            else:
-                nodepilot = None
-
-            pilotraces.append({
-                'callsign': nodepilot,
-                'pilot_id': pilotrace.pilot_id,
-                'node_index': pilotrace.node_index,
-                'laps': laps
-            })
-        payload = {
-            'start_time_formatted': race.start_time_formatted,
-            'nodes': pilotraces,
-            'sort': RaceContext.serverconfig.get_item('UI', 'pilotSort'),
-            'leaderboard': RaceContext.rhdata.get_results_savedRaceMeta(race.id)
-        }
+        def build_head():
+            return {
+                'start_time_formatted': race.start_time_formatted,
+                'sort': RaceContext.serverconfig.get_item('UI', 'pilotSort'),
+                'leaderboard': RaceContext.rhdata.get_results_savedRaceMeta(race.id)
+            }
 
-        return json.dumps({"race": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        def fetch_page(after_id, limit):
+            return fetch_pilotraces(race.id, after_id, limit, args['fields'])
+
+        if args['stream']:
+            return ndjson_response(fetch_page, args['cursor'], args['limit'], \
+                                   None if args['cursor'] else build_head)
+
+        def build_payload():
+            page = fetch_page(args['cursor'], args['limit'])
+            payload = {
+                'nodes': [pilotrace for _pilotrace_id, pilotrace in page]
+            }
+            if not args['cursor']:
+                head = build_head()
+                payload = {
+                    'start_time_formatted': head['start_time_formatted'],
+                    'nodes': payload['nodes'],
+                    'sort': head['sort'],
+                    'leaderboard': head['leaderboard']
+                }
+            if args['limit']:
+                payload['next_cursor'] = next_cursor(page, args['limit'])
+            return {"race": payload}
+
+        version = (data_version(), RaceContext.serverconfig.get_item('UI', 'pilotSort'))
+        return json_response(version, build_payload)
 
     @APP.route('/api/status')
     def api_status():
-        data = {
-            "server_info": {
-                "server_api": serverInfo['server_api'],
-                "json_api": serverInfo['json_api'],
-                "node_api_best": serverInfo['node_api_best'],
-                "release_version": serverInfo['release_version'],
-                "node_api_match": serverInfo['node_api_match'],
-                "node_api_lowest": serverInfo['node_api_lowest'],
-                "node_api_levels": serverInfo['node_api_levels']
-            },
-            "state": {
-                "current_heat": RaceContext.race.current_heat,
-                "num_nodes": RaceContext.race.num_nodes,
-                "race_status": RaceContext.race.race_status,
-                "currentProfile": RaceContext.rhdata.get_option('currentProfile'),
-                "currentFormat": RaceContext.rhdata.get_option('currentFormat'),
-                "currentHeat": RaceContext.rhdata.get_option('currentHeat'),
+        def build_payload():
+            data = {
+                "server_info": {
+                    "server_api": serverInfo['server_api'],
+                    "json_api": serverInfo['json_api'],
+                    "node_api_best": serverInfo['node_api_best'],
+                    "release_version": serverInfo['release_version'],
+                    "node_api_match": serverInfo['node_api_match'],
+                    "node_api_lowest": serverInfo['node_api_lowest'],
+                    "node_api_levels": serverInfo['node_api_levels']
+                },
+                "state": {
+                    "current_heat": RaceContext.race.current_heat,
+                    "num_nodes": RaceContext.race.num_nodes,
+                    "race_status": RaceContext.race.race_status,
+                    "currentProfile": RaceContext.rhdata.get_option('currentProfile'),
+                    "currentFormat": RaceContext.rhdata.get_option('currentFormat'),
+                    "currentHeat": RaceContext.rhdata.get_option('currentHeat'),
+                }
             }
-        }
 
-        return json.dumps({"status": data}), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            return {"status": data}
+
+        version = (data_version(), RaceContext.race.current_heat, RaceContext.race.num_nodes, \
+                   RaceContext.race.race_status, serverInfo['node_api_match'], serverInfo['node_api_lowest'])
+        return json_response(version, build_payload)
 
     @APP.route('/api/options')
     def api_options():
-        opt_query = RaceContext.rhdata.get_options()
-        options = {}
-        if opt_query:
-            for opt in opt_query:
-                if opt.option_name not in ['eventResults', 'secret_key']:
-                    options[opt.option_name] = opt.option_value
-
-            payload = options
-        else:
-            payload = None
-
-        return json.dumps({"options": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        def build_payload():
+            opt_query = RaceContext.rhdata.get_options()
+            options = {}
+            if opt_query:
+                for opt in opt_query:
+                    if opt.option_name not in ['eventResults', 'secret_key']:
+                        options[opt.option_name] = opt.option_value
+
+                payload = options
+            else:
+                payload = None
+
+            return {"options": payload}
+
+        return json_response(data_version(), build_payload)
 
     return APP
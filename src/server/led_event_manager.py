@@ -16,6 +16,7 @@ import RHUtils
 from RHUtils import catchLogExceptionsWrapper, cleanVarName
 import gevent
 from eventmanager import Evt
+from led_framebuffer import LEDFrameBuffer, LEDFrameCache
 from collections import UserDict
 import logging
 
@@ -30,7 +31,8 @@ class LEDEventManager:
 
     def __init__(self, eventmanager, strip, RaceContext, RHAPI):
         self.Events = eventmanager
-        self.strip = strip
+        self.strip = LEDFrameBuffer(strip, max_fps=RaceContext.serverconfig.get_item_int('LED', 'LED_MAX_FPS', 0))
+        self.frame_cache = LEDFrameCache()  # pre-rendered panel frames, shared by effects
         self._racecontext = RaceContext
         self._rhapi = RHAPI
 
@@ -55,7 +57,8 @@ class LEDEventManager:
             ))
 
         self.Events.trigger(Evt.LED_INITIALIZE, {
-            'register_fn': self.registerEffect
+            'register_fn': self.registerEffect,
+            'frame_cache': self.frame_cache
             })
 
     def isEnabled(self):
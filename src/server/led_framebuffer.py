@@ -0,0 +1,292 @@
+'''
+LED framebuffer
+Holds the pixel colors for an LED strip/panel and writes them to the pixel interface
+
+Effects may set pixels one at a time (as with the 'rpi_ws281x' interface) or write
+whole frames at once with the fill, ramp and blit functions.  A frame is written to
+the pixel interface by 'show()', which does nothing if no pixel has changed and is
+limited to a maximum frame rate (a frame shown too soon is written once the frame
+interval has passed).  Uses 'numpy' arrays if available.
+
+Rendered frames (i.e. bitmaps and text for LED panels) may be kept in an
+'LEDFrameCache', so that effects can show them without loading or rendering.
+'''
+
+import logging
+import gevent
+from array import array
+from collections import OrderedDict
+from time import monotonic
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+class LEDFrameBuffer:
+    def __init__(self, strip, max_fps=0):
+        self.strip = strip
+        self.max_fps = max_fps
+        self._count = strip.numPixels()
+        self._pixels = self._new_buffer()
+        self._shown = None  # frame last written to pixel interface (None if unknown)
+        self._dirty = True
+        self._last_show_time = None
+        self._show_greenlet = None
+
+    def _new_buffer(self):
+        if np is not None:
+            return np.zeros(self._count, dtype=np.uint32)
+        return array('I', bytes(4 * self._count))
+
+    def __getattr__(self, name):
+        # pass through anything else (i.e. 'begin()') to the pixel interface
+        if name == 'strip':
+            raise AttributeError(name)
+        return getattr(self.strip, name)
+
+    def _span(self, start, end):
+        if end is None or end > self._count:
+            end = self._count
+        return max(0, start), end
+
+    # per-pixel functions ('rpi_ws281x' compatible)
+
+    def numPixels(self):
+        return self._count
+
+    def setPixelColor(self, i, color):
+        if self._pixels[i] != color:
+            self._pixels[i] = color
+            self._dirty = True
+
+    def getPixelColor(self, i):
+        return int(self._pixels[i])
+
+    def setBrightness(self, brightness):
+        self.strip.setBrightness(brightness)
+        self._dirty = True  # brightness is applied when the next frame is shown
+
+    # whole-frame functions
+
+    def getPixels(self):
+        '''Returns a copy of the current frame (as packed 0xRRGGBB values)'''
+        if np is not None:
+            return self._pixels.copy()
+        return array('I', self._pixels)
+
+    def setPixels(self, colors, start=0):
+        '''Blits the given packed color values into the frame, starting at pixel 'start' '''
+        start, end = self._span(start, start + len(colors))
+        if end <= start:
+            return
+        if np is not None:
+            self._pixels[start:end] = np.asarray(colors, dtype=np.uint32)[:end - start]
+        else:
+            self._pixels[start:end] = array('I', colors[:end - start])
+        self._dirty = True
+
+    def fill(self, color, start=0, end=None):
+        '''Sets pixels from 'start' up to (not including) 'end' to the given color'''
+        start, end = self._span(start, end)
+        if end <= start:
+            return
+        if np is not None:
+            self._pixels[start:end] = color
+        else:
+            self._pixels[start:end] = array('I', [color]) * (end - start)
+        self._dirty = True
+
+    def fillPattern(self, color, pattern, offset=0, off_color=0):
+        '''Fills frame with repeating pattern of [# on, # off] pixels'''
+        pattern_length = sum(pattern)
+        if np is not None:
+            on_mask = (np.arange(offset, self._count + offset) % pattern_length) < pattern[0]
+            self._pixels[:] = np.where(on_mask, np.uint32(color), np.uint32(off_color))
+        else:
+            self._pixels[:] = array('I', [color if (i + offset) % pattern_length < pattern[0] else off_color \
+                                          for i in range(self._count)])
+        self._dirty = True
+
+    def ramp(self, start_color, end_color, start=0, end=None):
+        '''Fills pixels from 'start' up to (not including) 'end' with colors ramping between the two given'''
+        start, end = self._span(start, end)
+        count = end - start
+        if count <= 0:
+            return
+        steps = max(count - 1, 1)
+        if np is not None:
+            frac = np.arange(count, dtype=np.float64) / steps
+            ramp = np.zeros(count, dtype=np.uint32)
+            for shift in (16, 8, 0):
+                c0 = (start_color >> shift) & 0xff
+                c1 = (end_color >> shift) & 0xff
+                ramp |= np.rint(c0 + (c1 - c0) * frac).astype(np.uint32) << shift
+            self._pixels[start:end] = ramp
+        else:
+            ramp = array('I')
+            for i in range(count):
+                color = 0
+                for shift in (16, 8, 0):
+                    c0 = (start_color >> shift) & 0xff
+                    c1 = (end_color >> shift) & 0xff
+                    color |= int(round(c0 + (c1 - c0) * i / steps)) << shift
+                ramp.append(color)
+            self._pixels[start:end] = ramp
+        self._dirty = True
+
+    def dim(self, decay, mask=None):
+        '''Scales the RGB channels of all pixels (or those where 'mask' is true) by 'decay'
+        (channels at 1 or less go to 0)'''
+        if np is not None:
+            scaled = np.zeros(self._count, dtype=np.uint32)
+            for shift in (16, 8, 0):
+                channel = (self._pixels >> shift) & 0xff
+                channel = np.where(channel <= 1, 0, (channel * decay).astype(np.uint32))
+                scaled |= channel.astype(np.uint32) << shift
+            if mask is None:
+                self._pixels[:] = scaled
+            else:
+                self._pixels[:] = np.where(mask, scaled, self._pixels)
+        else:
+            for i, color in enumerate(self._pixels):
+                if mask is None or mask[i]:
+                    dimmed = 0
+                    for shift in (16, 8, 0):
+                        channel = (color >> shift) & 0xff
+                        dimmed |= (0 if channel <= 1 else int(channel * decay)) << shift
+                    self._pixels[i] = dimmed
+        self._dirty = True
+
+    def setImage(self, img, inverted_rows=False, start=0):
+        '''Blits a PIL image into the frame, row by row; with 'inverted_rows' every
+        other row (starting with the first) is reversed, for serpentine-wired panels'''
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        self.setPixels(image_to_pixels(img, inverted_rows), start)
+
+    # output
+
+    def show(self):
+        if not self._dirty:
+            return
+        if self.max_fps and self._last_show_time is not None:
+            wait_time = self._last_show_time + 1.0 / self.max_fps - monotonic()
+            if wait_time > 0:
+                if self._show_greenlet is None:
+                    self._show_greenlet = gevent.spawn_later(wait_time, self._deferred_show)
+                return
+        self.flush()
+
+    def _deferred_show(self):
+        self._show_greenlet = None
+        if self._dirty:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error showing LED frame")
+
+    def flush(self):
+        '''Writes the current frame to the pixel interface now'''
+        self._last_show_time = monotonic()
+        self._dirty = False
+        if self._shown is None:
+            changed = range(self._count)
+        elif np is not None:
+            changed = np.flatnonzero(self._pixels != self._shown)
+        else:
+            changed = [i for i, (new, old) in enumerate(zip(self._pixels, self._shown)) if new != old]
+
+        set_pixels_fn = getattr(self.strip, 'setPixels', None)
+        if set_pixels_fn and len(changed) > 1:
+            set_pixels_fn(self._pixels)  # interface accepts whole buffer
+        else:
+            for i in changed:
+                self.strip.setPixelColor(int(i), int(self._pixels[i]))
+
+        if self._shown is None:
+            self._shown = self._new_buffer()
+        self._shown[:] = self._pixels
+        self.strip.show()
+
+def image_to_pixels(img, inverted_rows=False):
+    '''Converts an RGB PIL image to a list/array of packed 0xRRGGBB values, row by row'''
+    width = img.width
+    raw = img.tobytes()
+    if np is not None:
+        rgb = np.frombuffer(raw, dtype=np.uint8).reshape(img.height, width, 3).astype(np.uint32)
+        if inverted_rows:
+            rgb[0::2] = rgb[0::2, ::-1]
+        return ((rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]).ravel()
+    pixels = array('I')
+    for row in range(img.height):
+        offset = row * width * 3
+        row_pixels = [(raw[i] << 16) | (raw[i + 1] << 8) | raw[i + 2] for i in range(offset, offset + width * 3, 3)]
+        if inverted_rows and row % 2 == 0:
+            row_pixels.reverse()
+        pixels.extend(row_pixels)
+    return pixels
+
+class LEDFrameCache:
+    '''Bounded LRU cache of rendered frames; each entry is a list of frames (packed
+    0xRRGGBB values, as accepted by 'LEDFrameBuffer.setPixels()').  Size is limited by
+    the total number of pixels held, so the memory used does not depend on panel size'''
+    def __init__(self, max_pixels=1 << 20):
+        self.max_pixels = max_pixels
+        self._entries = OrderedDict()
+        self._pixel_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, render_fn=None):
+        '''Returns the frames for 'key', calling 'render_fn()' to render (and cache) them
+        if not present (returns None if not present and no 'render_fn' given)'''
+        frames = self._entries.get(key)
+        if frames is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return frames
+        self.misses += 1
+        if render_fn is None:
+            return None
+        frames = render_fn()
+        if frames is not None:
+            self.put(key, frames)
+        return frames
+
+    def put(self, key, frames):
+        old_frames = self._entries.pop(key, None)
+        if old_frames is not None:
+            self._pixel_count -= self._size(old_frames)
+        size = self._size(frames)
+        if size > self.max_pixels:
+            return  # too large to cache
+        self._entries[key] = frames
+        self._pixel_count += size
+        while self._pixel_count > self.max_pixels:
+            _, evicted = self._entries.popitem(last=False)
+            self._pixel_count -= self._size(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self._pixel_count = 0
+
+    def get_stats(self):
+        return {
+            'entries': len(self._entries),
+            'pixels': self._pixel_count,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    @staticmethod
+    def _size(frames):
+        return sum(len(frame) for frame in frames)
@@ -63,6 +63,12 @@ class LedCtrlrPixel:
     def getPixelColor(self, i):
         return self.pixels[i]
 
+    def setPixels(self, buffer):
+        self.pixels = buffer.tolist()
+        self.num_changed_flag = 0
+        # track if all pixels are set to the same color
+        self.pixels_same_tracker = len(self.pixels) - 1 if len(set(self.pixels)) == 1 else -1
+
     def show(self):
         if self.num_changed_flag == 1:  # if only a single pixel was changed since last 'show'
             self.num_changed_flag = 0
@@ -9,6 +9,7 @@ import subprocess
 import time
 import zipfile
 import gevent
+import gevent.queue
 from datetime import datetime
 
 # Sample configuration:
@@ -27,6 +28,11 @@ from datetime import datetime
 DEF_CONSOLE_STREAM = sys.stdout  # default console-output stream
 DEF_FILELOG_NUM_KEEP = 30        # default number of log files to keep
 
+LOG_QUEUE_SIZE = 1000           # maximum number of log records waiting in queue
+LOG_BATCH_SIZE = 100            # maximum number of log records taken from queue at once
+SOCKET_EMIT_INTERVAL = 0.1      # seconds between log emits to socket
+SOCKET_MAX_PENDING = 5000       # maximum number of log lines waiting for emit to socket
+
 LOG_FILENAME_STR = "rh.log"
 LOG_DIR_NAME = "logs"
 LOGZIP_DIR_NAME = "logs/zip"
@@ -67,17 +73,23 @@ class LogMsgLevelCounters:
 msg_level_counters_obj = LogMsgLevelCounters()
 
 # Log handler that distributes log records to one or more destination handlers via a gevent queue.
+# Records are taken from the queue in batches, and each destination handler is given a batch in a
+# single call (see 'emit_records()'), so heavy logging does not hold up other greenlets.  When the
+# queue is full, new records below WARNING are dropped, while WARNING-and-above records replace the
+# oldest queued record; the number dropped is counted, and reported by the worker via a log message.
 class QueuedLogEventHandler(logging.Handler):
 
     # Creates queued-log-event handler, with given destination log handler.
     def __init__(self, dest_hndlr=None):
         super(QueuedLogEventHandler, self).__init__()
         self.queue_handlers_list = []
-        self.log_record_queue = gevent.queue.Queue(maxsize=99)
+        self.log_record_queue = gevent.queue.Queue(maxsize=LOG_QUEUE_SIZE)
         if dest_hndlr:
             self.queue_handlers_list.append(dest_hndlr)
         self.log_level_callback_lvl_num = logging.NOTSET
         self.log_level_callback_obj = None
+        self.dropped_count = 0
+        self.reported_dropped_count = 0
         gevent.spawn(self.queueWorkerFn)
 
     # Adds given destination log handler.
@@ -93,15 +105,23 @@ class QueuedLogEventHandler(logging.Handler):
         while True:
             try:
                 log_rec = self.log_record_queue.get()  # block until log record put into queue
-                msg_level_counters_obj.inc_count(log_rec.levelname)
+                rec_batch = [log_rec]
+                while len(rec_batch) < LOG_BATCH_SIZE:
+                    try:
+                        rec_batch.append(self.log_record_queue.get_nowait())
+                    except gevent.queue.Empty:
+                        break
+                if self.dropped_count > self.reported_dropped_count:
+                    rec_batch.append(self.makeDroppedRecord())
+                for log_rec in rec_batch:
+                    msg_level_counters_obj.inc_count(log_rec.levelname)
                 for dest_hndlr in self.queue_handlers_list:
-                    if log_rec.levelno >= dest_hndlr.level:
-                        gevent.sleep(0.001)
-                        dest_hndlr.emit(log_rec)
-                if self.log_level_callback_lvl_num > logging.NOTSET and \
-                                    log_rec.levelno >= self.log_level_callback_lvl_num and \
-                                    callable(self.log_level_callback_obj):
-                    self.log_level_callback_obj(log_rec)
+                    emit_records(dest_hndlr, [rec for rec in rec_batch if rec.levelno >= dest_hndlr.level])
+                if self.log_level_callback_lvl_num > logging.NOTSET and callable(self.log_level_callback_obj):
+                    for log_rec in rec_batch:
+                        if log_rec.levelno >= self.log_level_callback_lvl_num:
+                            self.log_level_callback_obj(log_rec)
+                gevent.sleep(0)  # let other greenlets run between batches
             except KeyboardInterrupt:
                 print("Log-event queue worker thread terminated by keyboard interrupt")
                 raise
@@ -113,10 +133,35 @@ class QueuedLogEventHandler(logging.Handler):
 
     def emit(self, record):
         try:
-            self.log_record_queue.put(record, timeout=1)
+            self.log_record_queue.put_nowait(record)
+        except gevent.queue.Full:
+            self.dropRecord(record)
         except Exception as ex:
             print("Error adding record to log-event queue: " + str(ex))
 
+    # Applies the drop policy for a record that does not fit in the (full) queue
+    def dropRecord(self, record):
+        if record.levelno >= logging.WARNING:
+            try:
+                dropped_rec = self.log_record_queue.get_nowait()  # make room by dropping oldest record
+                self.log_record_queue.put_nowait(record)
+                record = dropped_rec
+            except (gevent.queue.Empty, gevent.queue.Full):
+                pass
+        self.dropped_count += 1
+        msg_level_counters_obj.inc_count(record.levelname)  # still count dropped messages by level
+
+    def makeDroppedRecord(self):
+        num_dropped = self.dropped_count - self.reported_dropped_count
+        self.reported_dropped_count = self.dropped_count
+        return logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': "Log-event queue full; dropped {} message(s) (total dropped: {})".\
+                        format(num_dropped, self.dropped_count)
+        })
+
     def waitForQueueEmpty(self):
         try:
             count = 0
@@ -142,14 +187,75 @@ class QueuedLogEventHandler(logging.Handler):
         except Exception as ex:
             print("Error closing QueuedLogEventHandler: " + str(ex))
 
+# Sends given log records to the given handler; stream (console and file) handlers are given all
+#  the records in a single write, handlers with an 'emitBatch()' function are passed the list
+def emit_records(dest_hndlr, records):
+    if not records:
+        return
+    if hasattr(dest_hndlr, 'emitBatch'):
+        dest_hndlr.emitBatch(records)
+    elif isinstance(dest_hndlr, logging.StreamHandler) and dest_hndlr.stream is not None:
+        msg_list = []
+        for record in records:
+            try:
+                msg_list.append(dest_hndlr.format(record) + dest_hndlr.terminator)
+            except Exception:
+                dest_hndlr.handleError(record)
+        dest_hndlr.acquire()
+        try:
+            dest_hndlr.stream.write(''.join(msg_list))
+            dest_hndlr.flush()
+        except Exception:
+            dest_hndlr.handleError(records[-1])
+        finally:
+            dest_hndlr.release()
+    else:
+        for record in records:
+            dest_hndlr.emit(record)
+
+# Forwards log records to the socket; records are gathered and sent as a single (multi-line)
+#  'hardware_log' emit at most every SOCKET_EMIT_INTERVAL seconds
 class SocketForwardHandler(logging.Handler):
 
     def __init__(self, socket, *a, **kw):
         super(SocketForwardHandler, self).__init__(*a, **kw)
         self._socket = socket
+        self._pending_lines = []
+        self._emit_greenlet = None
+        self.dropped_count = 0
 
     def emit(self, record):
-        self._socket.emit("hardware_log", self.format(record))
+        self.emitBatch([record])
+
+    def emitBatch(self, records):
+        for record in records:
+            try:
+                self._pending_lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        num_over = len(self._pending_lines) - SOCKET_MAX_PENDING
+        if num_over > 0:  # socket not keeping up; drop oldest lines
+            del self._pending_lines[:num_over]
+            self.dropped_count += num_over
+        if self._pending_lines and self._emit_greenlet is None:
+            self._emit_greenlet = gevent.spawn_later(SOCKET_EMIT_INTERVAL, self.emitPending)
+
+    def emitPending(self):
+        self._emit_greenlet = None
+        lines = self._pending_lines
+        self._pending_lines = []
+        if lines:
+            try:
+                self._socket.emit("hardware_log", "\n".join(lines))
+            except Exception as ex:
+                print("Error emitting log records to socket: " + str(ex))
+
+    def close(self):
+        if self._emit_greenlet is not None:
+            self._emit_greenlet.kill()
+            self._emit_greenlet = None
+        self.emitPending()
+        super(SocketForwardHandler, self).close()
 
 class StreamToLogger:
     """
@@ -349,8 +455,21 @@ def get_log_level_counts_str():
     for name,count in sorted(msg_level_counters_obj.get_items(), key=get_logging_level_value):
         str_list.append("{}={}".format(name, count))
     str_list.reverse()
+    num_dropped = get_log_dropped_count()
+    if num_dropped > 0:
+        str_list.append("dropped={}".format(num_dropped))
     return ", ".join(str_list)
 
+# Returns the number of log messages dropped because the log queues were full
+def get_log_dropped_count():
+    num_dropped = 0
+    for hndlr_obj in (queued_handler_obj, queued_handler2_obj):
+        if hndlr_obj:
+            num_dropped += hndlr_obj.dropped_count
+            for dest_hndlr in hndlr_obj.queue_handlers_list:
+                num_dropped += getattr(dest_hndlr, 'dropped_count', 0)
+    return num_dropped
+
 def wait_for_queue_empty():
     if queued_handler_obj:
         queued_handler_obj.waitForQueueEmpty()
@@ -1,8 +1,8 @@
 '''RotorHazard server script'''
 RELEASE_VERSION = "4.4.0-beta.2" # Public release version code
-SERVER_API = 47 # Server API version
+SERVER_API = 48 # Server API version
 NODE_API_SUPPORTED = 18 # Minimum supported node version
-NODE_API_BEST = 36 # Most recent node API
+NODE_API_BEST = 37 # Most recent node API
 JSON_API = 3 # JSON API version
 MIN_PYTHON_MAJOR_VERSION = 3 # minimum python version (3.10)
 MIN_PYTHON_MINOR_VERSION = 10
@@ -67,7 +67,7 @@ import urllib3
 
 from flask import Flask, send_from_directory, request, make_response, Response, templating, redirect, abort, copy_current_request_context
 from flask.blueprints import Blueprint
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 
 PROGRAM_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -237,6 +237,7 @@ SERVER_PROCESS_RESTART_FLAG = False
 HEARTBEAT_THREAD = None
 BACKGROUND_THREADS_ENABLED = True
 HEARTBEAT_DATA_RATE_FACTOR = 5
+HEARTBEAT_MAX_INTERVAL_FACTOR = 20  # slowest negotiated heartbeat rate is one per 10 seconds
 
 ERROR_REPORT_INTERVAL_SECS = 600  # delay between comm-error reports to log
 
@@ -717,6 +718,7 @@ def start_background_threads(forceFlag=False):
 
 def stop_background_threads():
     try:
+        RaceContext.rhui.flush_emits()  # send coalesced emits before shutdown/restore
         stop_shutdown_button_thread()
         if RaceContext.cluster:
             RaceContext.cluster.shutdown()  # shut down secondary-timer management threads in this server
@@ -730,6 +732,7 @@ def stop_background_threads():
             HEARTBEAT_THREAD = None
         if RaceContext.interface:
             RaceContext.interface.stop()
+        Database.wait_durable()  # make sure committed data is on storage
     except:
         logger.exception("Error stopping background threads")
 
@@ -745,6 +748,11 @@ def start_background_threads_delayed():
 def connect_handler(auth):
     '''Starts the interface and a heartbeat thread for rssi.'''
     logger.debug('Client connected')
+    # JSON heartbeat at full rate and all topics until client negotiates otherwise
+    #  (see 'set_heartbeat' and 'subscribe_topics')
+    join_room(RaceContext.rhui.set_heartbeat_client(request.sid)[1])
+    for room in RaceContext.rhui.set_topic_client(request.sid)[1]:
+        join_room(room)
     if not RaceContext.serverstate.interface_started:
         start_background_threads()
         RaceContext.serverstate.interface_started = True
@@ -761,6 +769,57 @@ def connect_handler(auth):
 def disconnect_handler(*args):
     '''Emit disconnect event.'''
     logger.debug('Client disconnected')
+    RaceContext.rhui.set_delta_client(request.sid, False)
+    RaceContext.rhui.set_heartbeat_client(request.sid, interval=0)
+    RaceContext.rhui.set_topic_client(request.sid, [])
+
+@SOCKET_IO.on('set_delta_updates')
+@catchLogExcWithDBWrapper
+def on_set_delta_updates(data):
+    '''Client opts in (or out) of receiving leaderboard and lap changes as deltas.'''
+    enabled = bool(data.get('enabled', True)) if isinstance(data, dict) else bool(data)
+    RaceContext.rhui.set_delta_client(request.sid, enabled)
+
+@SOCKET_IO.on('subscribe_topics')
+@catchLogExcWithDBWrapper
+def on_subscribe_topics(data):
+    '''Client sets broadcast topics it receives (see RHUI.TOPICS); others are not sent to it.'''
+    left, joined = RaceContext.rhui.set_topic_client(request.sid, data.get('topics', []))
+    for room in left:
+        leave_room(room)
+    for room in joined:
+        join_room(room)
+
+@SOCKET_IO.on('set_heartbeat')
+@catchLogExcWithDBWrapper
+def on_set_heartbeat(data):
+    '''Client sets heartbeat format and rate: 'rate' in Hz (0 for none; full rate
+    if omitted) and 'binary' for packed frames on 'heartbeat_bin' in place of JSON.'''
+    data = data if isinstance(data, dict) else {}
+    base_rate = HEARTBEAT_DATA_RATE_FACTOR / 0.500
+    max_interval = HEARTBEAT_MAX_INTERVAL_FACTOR * HEARTBEAT_DATA_RATE_FACTOR
+    rate = data.get('rate')
+    if rate is None:
+        interval = 1
+    else:
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            rate = None
+        if rate is None or not 0 <= rate < float('inf'):  # also rejects NaN
+            logger.warning('Ignoring invalid heartbeat rate from client: {}'.format(data.get('rate')))
+            return
+        if rate > 0:
+            rate = min(max(rate, base_rate / max_interval), base_rate)
+            interval = min(max(int(round(base_rate / rate)), 1), max_interval)
+        else:
+            interval = 0
+    old_room, new_room = RaceContext.rhui.set_heartbeat_client(request.sid, bool(data.get('binary')), interval)
+    if old_room != new_room:
+        if old_room:
+            leave_room(old_room)
+        if new_room:
+            join_room(new_room)
 
 # Cluster events
 
@@ -1664,6 +1723,7 @@ def on_reset_database(data):
     reset_type = data.get('reset_type')
     logger.debug('Resetting database, with_archive={}, reset_type={}'.format(with_archive, reset_type))
     RaceContext.pagecache.set_valid(False)
+    RaceContext.rhui.flush_emits()  # don't let coalesced emits of old data land after the reset
 
     on_stop_race()
     on_discard_laps()
@@ -2454,7 +2514,10 @@ def replace_current_laps(data):
 
 @catchLogExcWithDBWrapper
 def build_atomic_result_caches(params):
-    RaceContext.pagecache.set_valid(False)
+    if 'race_id' in params:
+        RaceContext.pagecache.invalidate_savedRaceMeta(params['race_id'])
+    else:
+        RaceContext.pagecache.set_valid(False)
     Results.build_atomic_results(RaceContext.rhdata, params)
     RaceContext.rhui.emit_result_data()
 
@@ -2686,8 +2749,8 @@ def get_pilotrace(data):
                 'callsign': nodepilot,
                 'pilot_id': pilotrace.pilot_id,
                 'node_index': pilotrace.node_index,
-                'history_values': json.loads(pilotrace.history_values),
-                'history_times': json.loads(pilotrace.history_times),
+                'history_values': pilotrace.history_values or [],
+                'history_times': pilotrace.history_times or [],
                 'laps': laps,
                 'enter_at': pilotrace.enter_at,
                 'exit_at': pilotrace.exit_at,
@@ -2887,7 +2950,7 @@ def heartbeat_thread_function():
         try:
             node_data = RaceContext.interface.get_heartbeat_json()
 
-            SOCKET_IO.emit('heartbeat', node_data)
+            RaceContext.rhui.emit_heartbeat(node_data, heartbeat_thread_function.iter_tracker)
             heartbeat_thread_function.iter_tracker += 1
 
             if RaceContext.serverstate.enable_heartbeat_event:
@@ -3915,6 +3978,8 @@ def rh_program_initialize(reg_endpoints_flag=True):
                 logger.warning('Clearing all data after recovery failure:  ' + str(ex))
                 db_reset()
 
+        RaceContext.rhdata.log_query_plans()
+
         # Add plugin-registered setting defaults to DB
         RaceContext.rhui.init_setting_defaults()
 
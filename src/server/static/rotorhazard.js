@@ -1439,6 +1439,71 @@ rotorhazard.timer.race.callbacks.self_resync = function(timer){
 
 /* global page behaviors */
 var socket = false;
+
+/* apply change set produced by server (RHUtils.json_delta) */
+function apply_delta(target, patch) {
+	if ('v' in patch) {
+		return patch.v;
+	}
+	if ('d' in patch) {
+		for (var key in patch.d) {
+			target[key] = apply_delta(target[key], patch.d[key]);
+		}
+		for (var i = 0; i < patch.r.length; i++) {
+			delete target[patch.r[i]];
+		}
+	} else if ('l' in patch) {
+		target.length = Math.min(target.length, patch.l);
+		for (var idx in patch.i) {
+			target[idx] = apply_delta(target[idx], patch.i[idx]);
+		}
+	}
+	return target;
+}
+
+/* heartbeat (node RSSI, etc): sent as binary frames, only while a page has subscribed */
+var heartbeat_handlers = [];
+var heartbeat_rate = 0;
+
+function decode_heartbeat(buffer) {
+	// layout matches RHUI.HEARTBEAT_HEADER and RHUI.HEARTBEAT_NODE (little-endian)
+	var view = new DataView(buffer);
+	var num_nodes = view.getUint8(1);
+	var msg = {
+		'current_rssi': [],
+		'frequency': [],
+		'loop_time': [],
+		'crossing_flag': []
+	};
+	for (var i = 0; i < num_nodes; i++) {
+		var offset = 2 + i * 7;
+		msg.current_rssi.push(view.getUint16(offset, true));
+		msg.frequency.push(view.getUint16(offset + 2, true));
+		msg.loop_time.push(view.getUint16(offset + 4, true));
+		msg.crossing_flag.push(view.getUint8(offset + 6) != 0);
+	}
+	return msg;
+}
+
+function emit_heartbeat_rate() {
+	if (socket && socket.connected) {
+		if (socket.listeners('heartbeat').length > 1) {
+			// page has its own 'heartbeat' listener: keep full-rate JSON heartbeat
+			socket.emit('set_heartbeat', {'binary': false, 'rate': document['hidden'] ? 0 : null});
+		} else {
+			// no heartbeat for background tabs
+			socket.emit('set_heartbeat', {'binary': true, 'rate': document['hidden'] ? 0 : heartbeat_rate});
+		}
+	}
+}
+
+rotorhazard.on_heartbeat = function(handler, rate) {
+	// 'rate' in heartbeats per second
+	heartbeat_handlers.push(handler);
+	heartbeat_rate = Math.max(heartbeat_rate, rate || 10);
+	emit_heartbeat_rate();
+}
+
 var standard_message_queue = [];
 var interrupt_message_queue = [];
 var system_messages = [];
@@ -1663,6 +1728,65 @@ jQuery(document).ready(function($){
  				socket.connect();
 			}
 		}
+		emit_heartbeat_rate();
+	});
+
+	// broadcast topics (see RHUI.TOPICS): subscribe only to those this page handles
+	var topics = ['node_data', 'environmental_data', 'cluster_status', 'race_list', 'result_data',
+		'current_laps', 'leaderboard', 'current_marshal_data'];
+	socket.on('connect', function () {
+		socket.emit('subscribe_topics', {'topics': topics.filter(function (topic) {
+			var own_handlers = sequenced_events.includes(topic) ? 1 : 0;
+			return socket.listeners(topic).length > own_handlers;
+		})});
+	});
+
+	// heartbeat: opt out unless page has subscribed (or listens for 'heartbeat' itself)
+	socket.on('connect', function () {
+		emit_heartbeat_rate();
+	});
+	socket.on('heartbeat_bin', function (buffer) {
+		var msg = decode_heartbeat(buffer);
+		heartbeat_handlers.forEach(function (handler) {
+			handler(msg);
+		});
+	});
+	socket.on('heartbeat', function (msg) {
+		heartbeat_handlers.forEach(function (handler) {
+			handler(msg);
+		});
+	});
+
+	// sequenced events: server sends changes as '<event>_delta' once opted in
+	var sequenced_events = ['current_laps', 'leaderboard'];
+	var delta_state = {};
+	socket.on('connect', function () {
+		delta_state = {};
+		socket.emit('set_delta_updates', {'enabled': true});
+	});
+	sequenced_events.forEach(function (event) {
+		socket.on(event, function (msg) {
+			if (msg && typeof msg.seq !== 'undefined') {
+				delta_state[event] = {'seq': msg.seq, 'payload': JSON.parse(JSON.stringify(msg))};
+			}
+		});
+		socket.on(event + '_delta', function (msg) {
+			var state = delta_state[event];
+			if (!state || msg.seq != state.seq + 1) {
+				// missed an update (or no base payload); request full payload
+				delete delta_state[event];
+				if (socket.listeners(event).length > 1) {
+					socket.emit('load_data', {'load_types': [event]});
+				}
+				return;
+			}
+			state.payload = apply_delta(state.payload, msg.patch);
+			state.seq = msg.seq;
+			state.payload.seq = msg.seq;
+			socket.listeners(event).forEach(function (handler) {
+				handler(JSON.parse(JSON.stringify(state.payload)));
+			});
+		});
 	});
 
 	// display socket status
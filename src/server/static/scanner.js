@@ -123,7 +123,7 @@ function createBandScanner(elementId) {
 }
 
 function registerMessageHandlers(socket, scanners) {
-	socket.on('heartbeat', function (msg) {
+	let handler = function (msg) {
 		for (let i = 0; i < msg.current_rssi.length; i++) {
 			let scanner = scanners[i];
 			if (scanner && scanner.isEnabled) {
@@ -132,5 +132,10 @@ function registerMessageHandlers(socket, scanners) {
 				scanner.update(freq, rssiValue);
 			}
 		}
-	});
+	};
+	if (typeof rotorhazard !== 'undefined' && rotorhazard.on_heartbeat) {
+		rotorhazard.on_heartbeat(handler, 10);
+	} else {
+		socket.on('heartbeat', handler);  // standalone page; JSON heartbeat by default
+	}
 }
@@ -0,0 +1,88 @@
+# EmitCoalescer:  Collapses bursts of repeated emit requests into as few builds as possible
+
+# A request for a key that has not run within the last 'window' seconds runs
+# immediately.  Requests arriving sooner are absorbed into a single pending run
+# (with the latest arguments), made from a separate greenlet once the requests
+# pause for 'window' seconds, but never later than 'maxDelay' seconds after the
+# first absorbed request.  Since the pending run happens after the burst, what
+# it builds reflects the final state.  'runNow()' and 'flush()' run immediately.
+
+import gevent
+from time import monotonic
+
+class _Pending:
+    def __init__(self, firstTime):
+        self.firstTime = firstTime
+        self.dueTime = firstTime
+        self.funct = None
+        self.args = ()
+        self.kwargs = {}
+
+class EmitCoalescer:
+    """ Collapses bursts of repeated emit requests into as few builds as possible. """
+
+    def __init__(self, logger, window=0.075, maxDelay=0.25, deferredContext=None):
+        self.logger = logger
+        self.window = window
+        self.maxDelay = maxDelay
+        self.deferredContext = deferredContext  # context manager factory wrapped around deferred runs
+        self.lastRunTimes = {}
+        self.pendings = {}
+
+    # returns True if run immediately, False if deferred
+    def request(self, key, funct, *args, **kwargs):
+        now = monotonic()
+        pending = self.pendings.get(key)
+        if pending is None:
+            lastRunTime = self.lastRunTimes.get(key)
+            if self.window <= 0 or lastRunTime is None or now - lastRunTime >= self.window:
+                self.runFn(key, funct, args, kwargs)
+                return True
+            pending = _Pending(now)
+            self.pendings[key] = pending
+            gevent.spawn(self.workerFn, key, pending)
+        pending.funct = funct
+        pending.args = args
+        pending.kwargs = kwargs
+        pending.dueTime = min(now + self.window, pending.firstTime + self.maxDelay)
+        return False
+
+    # runs immediately, superseding any pending run for the key
+    def runNow(self, key, funct, *args, **kwargs):
+        self.pendings.pop(key, None)
+        return self.runFn(key, funct, args, kwargs)
+
+    # runs pending requests now (for all keys if none given)
+    def flush(self, key=None):
+        for flushKey in ([key] if key is not None else list(self.pendings)):
+            pending = self.pendings.pop(flushKey, None)
+            if pending:
+                self.runFn(flushKey, pending.funct, pending.args, pending.kwargs)
+
+    def hasPending(self, key=None):
+        if key is None:
+            return bool(self.pendings)
+        return key in self.pendings
+
+    def runFn(self, key, funct, args, kwargs):
+        self.lastRunTimes[key] = monotonic()
+        return funct(*args, **kwargs)
+
+    def workerFn(self, key, pending):
+        try:
+            delay = pending.dueTime - monotonic()
+            while delay > 0:
+                gevent.sleep(delay)
+                delay = pending.dueTime - monotonic()
+            if self.pendings.get(key) is not pending:
+                return  # already run via 'runNow()' or 'flush()'
+            del self.pendings[key]
+            if self.deferredContext:
+                with self.deferredContext():
+                    self.runFn(key, pending.funct, pending.args, pending.kwargs)
+            else:
+                self.runFn(key, pending.funct, pending.args, pending.kwargs)
+        except gevent.GreenletExit:
+            raise
+        except Exception:
+            self.logger.exception("EmitCoalescer error running deferred emit for {}".format(key))
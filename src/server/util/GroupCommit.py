@@ -0,0 +1,77 @@
+# GroupCommit:  Coalesces durability syncs for commits made within a short window
+
+# Commits are made (and visible) immediately on the committing greenlet; only
+# the flush to storage is deferred.  After the first commit in a window, the
+# worker waits for the window to pass and then runs the sync function once (in
+# the GEvent threadpool, so the blocking fsync does not stall other greenlets),
+# covering every commit made before it started.  'barrier()' requests an
+# immediate sync and waits until all commits made so far are durable.
+
+import gevent
+from gevent.event import Event
+
+class GroupCommit:
+    """ Coalesces durability syncs for commits made within a short window. """
+
+    def __init__(self, logger, syncFn, window=0.25):
+        self.logger = logger
+        self.syncFn = syncFn
+        self.window = window
+        self.commitSeq = 0      # number of commits notified
+        self.syncedSeq = 0      # number of commits covered by completed syncs
+        self.wakeEvent = Event()
+        self.urgentEvent = Event()
+        self.syncDoneEvent = Event()
+        self.worker = gevent.spawn(self.workerFn)
+
+    def notify(self):
+        self.commitSeq += 1
+        self.wakeEvent.set()
+
+    def pending(self):
+        return self.commitSeq - self.syncedSeq
+
+    def workerFn(self):
+        while True:
+            try:
+                self.wakeEvent.wait()
+                self.urgentEvent.wait(timeout=self.window)  # gather commits unless a barrier is waiting
+                self.wakeEvent.clear()
+                self.urgentEvent.clear()
+                target = self.commitSeq
+                if target > self.syncedSeq:
+                    try:
+                        gevent.get_hub().threadpool.apply(self.syncFn)
+                    except Exception:
+                        self.logger.exception("GroupCommit error syncing commits")
+                    self.syncedSeq = target
+                doneEvent = self.syncDoneEvent
+                self.syncDoneEvent = Event()
+                doneEvent.set()
+                if self.commitSeq > self.syncedSeq:
+                    self.wakeEvent.set()
+            except gevent.GreenletExit:
+                raise
+            except Exception:
+                self.logger.exception("GroupCommit error processing syncs")
+                gevent.sleep(1)
+
+    # waits until all commits made so far are synced; returns False on timeout
+    def barrier(self, timeout=10):
+        target = self.commitSeq
+        if self.syncedSeq >= target:
+            return True
+        with gevent.Timeout(timeout, False):
+            while self.syncedSeq < target:
+                doneEvent = self.syncDoneEvent
+                self.wakeEvent.set()
+                self.urgentEvent.set()
+                doneEvent.wait()
+            return True
+        self.logger.error("Timeout waiting for database commits to be synced")
+        return False
+
+    # syncs anything pending and stops the worker
+    def stop(self):
+        self.barrier()
+        self.worker.kill()
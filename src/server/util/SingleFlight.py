@@ -0,0 +1,64 @@
+# SingleFlight:  Coalesces concurrent builds of the same keyed entity
+
+# Callers asking for the same key and data version while a build is in
+# progress wait on that build (via a GEvent AsyncResult) and share its result.
+# A caller with a different data version supersedes the in-progress build and
+# starts its own; the stale build may check 'isSuperseded()' to abandon early.
+
+import gevent
+from gevent.event import AsyncResult
+
+class _Flight:
+    def __init__(self, version):
+        self.version = version
+        self.result = AsyncResult()
+
+class SingleFlight:
+    """ Coalesces concurrent builds of the same keyed entity. """
+
+    def __init__(self, logger, timeout=300):
+        self.logger = logger
+        self.timeout = timeout
+        self.flights = {}
+
+    def run(self, key, version, funct, *args, **kwargs):
+        flight = self.flights.get(key)
+        if flight is not None:
+            if flight.version == version:
+                try:
+                    return flight.result.get(timeout=self.timeout)
+                except gevent.Timeout:
+                    self.logger.error("Timeout waiting for in-progress build of {}; building again".format(key))
+
+        flight = _Flight(version)
+        self.flights[key] = flight
+        try:
+            value = funct(*args, **kwargs)
+        except BaseException as ex:
+            flight.result.set_exception(ex)
+            raise
+        finally:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.result.set(value)
+        return value
+
+    # waits (without polling) until no build for the key is in progress
+    def wait(self, key, timeout=None):
+        flight = self.flights.get(key)
+        while flight is not None:
+            flight.result.wait(timeout=(timeout if timeout is not None else self.timeout))
+            if not flight.result.ready():
+                self.logger.error("Timeout waiting for in-progress build of {}".format(key))
+                return False
+            flight = self.flights.get(key)
+        return True
+
+    def isSuperseded(self, key, version):
+        flight = self.flights.get(key)
+        return flight is not None and flight.version != version
+
+    def inFlight(self, key=None):
+        if key is None:
+            return bool(self.flights)
+        return key in self.flights
@@ -15,7 +15,7 @@ class Strip:
     def __init__(self, backend: "WS2812StripDriver"):
         self._led_count = backend.get_led_count()
         self._brightness = 1.0
-        self._pixels: list[Color] = [Color(0, 0, 0)] * self._led_count
+        self._pixels = np.zeros((self._led_count, 3), dtype=np.uint8)  # RGB values
         self._backend = backend
 
     def set_pixel_color(self, i: int, color: Color) -> None:
@@ -26,24 +26,37 @@ class Strip:
         """
         self._pixels[i] = color
 
+    def get_pixel_color(self, i: int) -> Color:
+        """
+        Get the color of a single pixel in the buffer.
+        :param i: The index of the pixel
+        """
+        return Color(*(int(val) for val in self._pixels[i]))
+
+    def set_pixels_packed(self, colors: np.ndarray, start: int = 0) -> None:
+        """
+        Set the colors of a run of pixels in the buffer from packed 0xRRGGBB values.
+        :param colors: A 1D array of packed color values
+        :param start: The index of the first pixel to set
+        """
+        packed = np.asarray(colors, dtype=np.uint32)[: self._led_count - start]
+        end = start + len(packed)
+        self._pixels[start:end, 0] = (packed >> 16) & 0xFF
+        self._pixels[start:end, 1] = (packed >> 8) & 0xFF
+        self._pixels[start:end, 2] = packed & 0xFF
+
     def show(self) -> None:
         """
         Write the current pixel colors to the LED strip.
         """
-        buffer = np.array(
-            [
-                np.array([pixel.g * self._brightness, pixel.r * self._brightness, pixel.b * self._brightness])
-                for pixel in self._pixels
-            ],
-            dtype=np.uint8,
-        )
+        buffer = (self._pixels[:, [1, 0, 2]] * self._brightness).astype(np.uint8)  # GRB order
         self._backend.write(buffer)
 
     def clear(self) -> None:
         """
         Clear the LED strip and the buffer by setting all pixels to off.
         """
-        self._pixels = [Color(0, 0, 0)] * self._led_count
+        self._pixels[:] = 0
         self._backend.clear()
 
     def set_brightness(self, brightness: float) -> None:
@@ -70,7 +83,7 @@ class Strip:
         Set all pixels to the same color. The colors are not written to the LED strip until show() is called.
         :param color: The color to set all pixels to.
         """
-        self._pixels = [color] * self._led_count
+        self._pixels[:] = color
 
 
 class WS2812StripDriver(ABC):
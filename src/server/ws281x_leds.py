@@ -88,10 +88,11 @@ def get_pixel_interface(config, brightness, *args, **kwargs):
         rpi5_strip.getBrightness = lambda : rpi5_strip.get_brightness() * 100.0
 
         def _get_rpi5_pix_clr(i):
-            val = rpi5_strip._pixels[i]
+            val = rpi5_strip.get_pixel_color(i)
             return (val.r << 16) | (val.g << 8) | val.b
 
         rpi5_strip.getPixelColor = lambda i : _get_rpi5_pix_clr(i)
+        rpi5_strip.setPixels = lambda buf : rpi5_strip.set_pixels_packed(buf)  # whole frame of packed colors
 
         rpi5_strip.setBrightness(int(brightness))  # set initial configured brightness
 
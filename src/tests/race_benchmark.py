@@ -0,0 +1,177 @@
+'''Deterministic race simulator and latency benchmark for the lap-processing hot path.
+
+Runs the server headless against a fresh database in a temporary data directory
+and feeds seeded, synthetic pass streams through RHRace.add_lap. Race time is
+simulated, so passes are processed as fast as the server can handle them.
+Latency is reported per stage (p50/p99/max in ms).
+
+    python race_benchmark.py --nodes 8 --pilots 16 --laps 10 --races 6 --seed 1
+    python race_benchmark.py --save baseline.json
+    python race_benchmark.py --compare baseline.json --tolerance 1.25
+
+With '--compare', exits with status 1 if any stage's p50 latency exceeds the
+baseline value by more than the tolerance factor.
+'''
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+from time import perf_counter
+
+sys.path.append('../server')
+sys.path.append('../server/util')
+sys.path.append('../server/plugins')
+sys.path.append('../interface')
+
+STAGES = ['add_lap', 'calc_leaderboard', 'emit_current_laps', 'emit_current_leaderboard', \
+          'save_race', 'page_cache', 'emit_race_list']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Deterministic race simulator and latency benchmark')
+    parser.add_argument('--nodes', type=int, default=8, help='number of (mock) timer nodes')
+    parser.add_argument('--pilots', type=int, default=8, help='number of pilots (spread over heats)')
+    parser.add_argument('--laps', type=int, default=10, help='laps per pilot in each race')
+    parser.add_argument('--races', type=int, default=4, help='number of races to run')
+    parser.add_argument('--seed', type=int, default=1, help='seed for generated pass streams')
+    parser.add_argument('--save', metavar='FILE', help='write results to JSON file')
+    parser.add_argument('--compare', metavar='FILE', help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='allowed p50 ratio versus baseline')
+    return parser.parse_args()
+
+def generate_passes(rng, node_indexes, laps):
+    '''Returns list of (race_secs, node_index) passes, in time order, for one race.'''
+    passes = []
+    for node_index in node_indexes:
+        base_lap = rng.uniform(18.0, 30.0)
+        race_secs = rng.uniform(1.0, 3.0)  # holeshot
+        passes.append((race_secs, node_index))
+        for _ in range(laps):
+            race_secs += base_lap * rng.uniform(0.95, 1.08)
+            passes.append((race_secs, node_index))
+    passes.sort()
+    return passes
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+def summarize(timings):
+    summary = {}
+    for stage in STAGES:
+        values = sorted(timings.get(stage, []))
+        if values:
+            summary[stage] = {
+                'count': len(values),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+    return summary
+
+def run(args):
+    # use fresh data directory (and database) so runs are repeatable and user data is untouched
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='rh_bench_')
+    os.environ['RH_NODES'] = str(args.nodes)
+
+    import gevent
+    import server
+    from RHRace import RaceStatus, WinCondition, StagingTones
+
+    server.rh_program_initialize(reg_endpoints_flag=False)
+    rc = server.RaceContext
+    api = server.RHAPI
+    rc.serverstate.interface_started = True  # keep mock interface from generating its own passes
+    client = server.SOCKET_IO.test_client(server.APP)  # so emitted payloads are encoded
+
+    raceformat = api.db.raceformat_add(name='Benchmark', unlimited_time=1, race_time_sec=0, lap_grace_sec=-1, \
+                                       staging_fixed_tones=0, staging_delay_tones=StagingTones.TONES_NONE, \
+                                       start_delay_min_ms=0, start_delay_max_ms=0, \
+                                       win_condition=WinCondition.MOST_PROGRESS, number_laps_win=0)
+    raceclass = api.db.raceclass_add(name='Benchmark', raceformat=raceformat.id)
+    pilots = [api.db.pilot_add(callsign='Pilot {}'.format(i+1)) for i in range(args.pilots)]
+    heats = []
+    for first in range(0, len(pilots), args.nodes):
+        heat = api.db.heat_add(raceclass=raceclass.id)
+        slots = api.db.slots_by_heat(heat.id)
+        api.db.slots_alter_fast([{'slot_id': slot.id, 'pilot': pilot.id} \
+                                 for slot, pilot in zip(slots, pilots[first:first + args.nodes])])
+        heats.append(heat)
+
+    rng = random.Random(args.seed)
+    timings = {stage: [] for stage in STAGES}
+
+    def timed(stage, fn, *fn_args):
+        start = perf_counter()
+        result = fn(*fn_args)
+        timings[stage].append(perf_counter() - start)
+        return result
+
+    for race_idx in range(args.races):
+        heat = heats[race_idx % len(heats)]
+        api.race.heat = heat.id
+        rc.race.stage(immediate=True)
+        while rc.race.race_status != RaceStatus.RACING:
+            gevent.sleep(0.01)
+
+        nodes = {node.index: node for node in rc.interface.nodes}
+        node_indexes = [idx for idx, pilot_id in rc.race.node_pilots.items() \
+                        if pilot_id and idx in nodes]
+        for race_secs, node_index in generate_passes(rng, node_indexes, args.laps):
+            timed('add_lap', rc.race.add_lap, nodes[node_index], rc.race.start_time_monotonic + race_secs, 0)
+            rc.race.clear_results()
+            timed('calc_leaderboard', rc.race.get_results)
+            timed('emit_current_laps', rc.rhui.emit_current_laps)
+            timed('emit_current_leaderboard', rc.rhui.emit_current_leaderboard)
+            client.get_received()
+            gevent.sleep(0)
+
+        rc.race.stop()
+        timed('save_race', rc.race.do_save_actions)
+        timed('page_cache', rc.pagecache.get_cache)
+        timed('emit_race_list', rc.rhui.emit_race_list)
+        client.get_received()
+
+    client.disconnect()
+    return summarize(timings)
+
+def report(summary, baseline=None, tolerance=1.0):
+    regressions = []
+    print('{:<26}{:>7}{:>11}{:>11}{:>11}{:>10}'.format('stage', 'count', 'p50 ms', 'p99 ms', 'max ms', 'vs base'))
+    for stage, stats in summary.items():
+        ratio_str = ''
+        if baseline and stage in baseline and baseline[stage]['p50_ms'] > 0:
+            ratio = stats['p50_ms'] / baseline[stage]['p50_ms']
+            ratio_str = '{:.2f}x'.format(ratio)
+            if ratio > tolerance:
+                regressions.append(stage)
+                ratio_str += ' !'
+        print('{:<26}{:>7}{:>11.3f}{:>11.3f}{:>11.3f}{:>10}'.format(stage, stats['count'], \
+              stats['p50_ms'], stats['p99_ms'], stats['max_ms'], ratio_str))
+    return regressions
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        with open(os.path.abspath(args.compare), 'r') as f:
+            baseline = json.load(f)['stages']
+    save_path = os.path.abspath(args.save) if args.save else None  # server changes working dir
+
+    summary = run(args)
+
+    regressions = report(summary, baseline, args.tolerance)
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({'params': {key: getattr(args, key) for key in ('nodes', 'pilots', 'laps', 'races', 'seed')}, \
+                       'stages': summary}, f, indent=2)
+    if regressions:
+        print('Regression (p50 over {:.2f}x baseline): {}'.format(args.tolerance, ', '.join(regressions)))
+        sys.exit(1)
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
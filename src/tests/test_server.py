@@ -17,6 +17,42 @@ import server
 from Node import Node
 from RHUI import UIField, UIFieldType
 
+class MockNodeSerial:
+    '''Serial port of a mock multi-node processor; lap stats data for a node is filled with its node index'''
+    def __init__(self, port, reads):
+        self.port = port
+        self.name = port
+        self.baudrate = 921600
+        self.reads = reads  # shared {'active': {port: n}, 'max_port': n, 'max_total': n}
+        self.commands = []
+        self.cur_node = 0
+
+    def flushInput(self):
+        pass
+
+    def write(self, data):
+        from RHInterface import WRITE_CURNODE_INDEX
+        self.commands.append(data[0])
+        if data[0] == WRITE_CURNODE_INDEX:
+            self.cur_node = data[1]
+
+    def read(self, size):
+        from RHInterface import READ_CURNODE_INDEX, READ_ALL_LAP_STATS, LAP_STATS_BLOCK_SIZE
+        active = self.reads['active']
+        active[self.port] = active.get(self.port, 0) + 1
+        self.reads['max_port'] = max(self.reads['max_port'], active[self.port])
+        self.reads['max_total'] = max(self.reads['max_total'], sum(active.values()))
+        gevent.sleep(0.01)
+        active[self.port] -= 1
+        command = self.commands[-1]
+        if command == READ_CURNODE_INDEX:
+            payload = bytes([self.cur_node])
+        elif command == READ_ALL_LAP_STATS:
+            payload = bytes(idx for idx in range((size - 1) // LAP_STATS_BLOCK_SIZE) for _ in range(LAP_STATS_BLOCK_SIZE))
+        else:
+            payload = bytes([self.cur_node] * (size - 1))
+        return payload + bytes([sum(payload) & 0xFF])
+
 class ServerTest(unittest.TestCase):
     def setUp(self):
         self.client = server.SOCKET_IO.test_client(server.APP)
@@ -281,7 +317,7 @@ class ServerTest(unittest.TestCase):
 
     def test_api_root(self):
         self.assertEqual(server.RHAPI.API_VERSION_MAJOR, 1)
-        self.assertEqual(server.RHAPI.API_VERSION_MINOR, 4)
+        self.assertEqual(server.RHAPI.API_VERSION_MINOR, 5)
         self.assertEqual(server.RHAPI.__, server.RHAPI.language.__)
 
     def test_ui_api(self):
@@ -494,6 +530,619 @@ class ServerTest(unittest.TestCase):
         server.RHAPI.race.heat = 1
         self.assertEqual(server.RHAPI.race.heat, 1)
 
+    def test_race_lap_stats(self):
+        from Results import RaceLapStats
+        from RHRace import Crossing
+        seat_laps = []
+        lap_stats = RaceLapStats()
+        for lap_number, lap_time in enumerate([2000, 5000, 4000, 6000, 3000]):
+            seat_laps.append(Crossing(lap_number=lap_number, lap_time=lap_time, lap_time_stamp=lap_time))
+            stats = lap_stats.get_seat(0, seat_laps, 2, False)
+        self.assertEqual(stats.laps, 4)
+        self.assertEqual(stats.total_time, 20000)
+        self.assertEqual(stats.total_time_laps, 18000)
+        self.assertEqual(stats.fastest_lap, 3000)
+        self.assertEqual(stats.consecutives, 9000)
+        self.assertEqual(stats.consecutive_lap_start, 1)
+        seat_laps[1].deleted = True
+        lap_stats.invalidate(0)
+        stats = lap_stats.get_seat(0, seat_laps, 2, False)
+        self.assertEqual(stats.laps, 3)
+        self.assertEqual(stats.consecutives, 9000)
+        self.assertEqual(stats.consecutive_lap_start, 2)
+
+    def add_saved_race(self, heat_id, pilots, lap_times, deleted=()):
+        '''Saves a race for the heat with laps per pilot; deleted holds (pilot index, lap index) pairs'''
+        from RHRace import Crossing
+        rhdata = server.RaceContext.rhdata
+        race = rhdata.add_savedRaceMeta({'round_id': rhdata.get_max_round(heat_id) + 1, 'heat_id': heat_id, \
+            'class_id': rhdata.get_heat(heat_id).class_id, \
+            'format_id': server.RHAPI.db.raceformats[0].id, 'start_time': 0, 'start_time_formatted': ''})
+        race_data = {}
+        for idx, (pilot, times) in enumerate(zip(pilots, lap_times)):
+            laps = []
+            stamp = 0
+            for lap_idx, lap_time in enumerate(times):
+                stamp += lap_time
+                laps.append(Crossing(lap_number=lap_idx, lap_time=lap_time, lap_time_stamp=stamp, \
+                    lap_time_formatted=str(lap_time), source=0, deleted=(idx, lap_idx) in deleted))
+            race_data[idx] = {'race_id': race.id, 'pilot_id': pilot.id, 'enter_at': 0, 'exit_at': 0, 'laps': laps}
+        rhdata.add_race_data(race_data)
+        return race
+
+    def test_leaderboard_rankings(self):
+        heat = server.RHAPI.db.heat_add()
+        pilots = [server.RHAPI.db.pilot_add() for _ in range(3)]
+        pilot_ids = [pilot.id for pilot in pilots]
+        self.add_saved_race(heat.id, pilots, [[1000, 3500, 3500, 3500], [1000, 3000, 9000], [1000, 4000, 4000, 4000, 4000]])
+        row_keys = ['pilot_id', 'callsign', 'team_name', 'laps', 'starts', 'node', 'total_time', 'total_time_laps', \
+            'last_lap', 'average_lap', 'fastest_lap', 'consecutives', 'consecutives_base', 'consecutive_lap_start', \
+            'fastest_lap_source', 'consecutives_source', 'total_time_raw', 'total_time_laps_raw', 'average_lap_raw', \
+            'fastest_lap_raw', 'consecutives_raw', 'last_lap_raw', 'position']
+        expected = {
+            'by_race_time': ([2, 0, 1], row_keys + ['behind']),
+            'by_fastest_lap': ([1, 0, 2], row_keys),
+            'by_consecutives': ([0, 2, 1], row_keys),
+        }
+        heat_page = server.RaceContext.pagecache.get_cache()['heats'][heat.id]
+        for leaderboard in (heat_page['rounds'][0]['leaderboard'], heat_page['leaderboard']):
+            self.assertEqual(list(leaderboard), ['by_race_time', 'by_fastest_lap', 'by_consecutives', 'meta'])
+            for key, (order, keys) in expected.items():
+                self.assertEqual([pilot_ids.index(row['pilot_id']) for row in leaderboard[key]], order)
+                self.assertEqual([row['position'] for row in leaderboard[key]], [1, 2, 3])
+                for row in leaderboard[key]:
+                    self.assertEqual(list(row), keys)
+            # rankings hold their own rows
+            row_ids = [id(row) for key in expected for row in leaderboard[key]]
+            self.assertEqual(len(set(row_ids)), len(row_ids))
+
+    def test_page_cache_fragments(self):
+        pagecache = server.RaceContext.pagecache
+        race_class = server.RHAPI.db.raceclass_add(name='test_page_cache_fragments')
+        heats = [server.RHAPI.db.heat_add(raceclass=race_class.id) for _ in range(2)]
+        pilots = [server.RHAPI.db.pilot_add() for _ in range(2)]
+        for heat in heats:
+            self.add_saved_race(heat.id, pilots, [[1000, 3000, 3000], [1000, 4000]])
+        pagecache.get_cache()
+        self.assertTrue(pagecache.get_valid())
+        fragment_keys = [('heat', heats[0].id), ('heat', heats[1].id), ('class', race_class.id), ('event', None)]
+        fragments = {key: pagecache._fragments[key] for key in fragment_keys}
+
+        rebuilt = []
+        build_heat_fragment = pagecache._build_heat_fragment
+        def record_build(heat, *args):
+            rebuilt.append(heat.id)
+            return build_heat_fragment(heat, *args)
+        pagecache._build_heat_fragment = record_build
+        try:
+            # heat -> class -> event
+            pagecache.invalidate_heat(heats[0])
+            self.assertFalse(pagecache.get_valid())
+            self.assertEqual([pagecache._fragment_valid(key) for key in fragment_keys], [False, True, False, False])
+            pagecache.get_cache()
+            self.assertTrue(pagecache.get_valid())
+            self.assertEqual(rebuilt, [heats[0].id])  # only the stale heat
+            self.assertIs(pagecache._fragments[fragment_keys[1]], fragments[fragment_keys[1]])
+            self.assertIsNot(pagecache._fragments[fragment_keys[0]], fragments[fragment_keys[0]])
+
+            # newer invalidation arriving mid-build supersedes the build in progress
+            newer_builds = []
+            def superseding_build(heat, *args):
+                if not newer_builds:
+                    pagecache.invalidate_heat(heats[1])
+                    newer_builds.append(gevent.spawn(pagecache.update_cache))
+                    gevent.sleep(0)
+                return record_build(heat, *args)
+            pagecache._build_heat_fragment = superseding_build
+            rebuilt.clear()
+            pagecache.invalidate_heat(heats[0])
+            with self.assertLogs('PageCache', 'INFO') as logs:
+                pagecache.update_cache()
+                gevent.joinall(newer_builds)
+            self.assertTrue(any('Abandoning superseded build' in line for line in logs.output))
+            self.assertTrue(pagecache.get_valid())
+            self.assertIn(heats[1].id, rebuilt)
+            self.assertTrue(all(pagecache._fragment_valid(key) for key in fragment_keys))
+        finally:
+            del pagecache._build_heat_fragment
+
+    def test_saved_race_data(self):
+        rhdata = server.RaceContext.rhdata
+        heats = [server.RHAPI.db.heat_add() for _ in range(3)]
+        pilots = [server.RHAPI.db.pilot_add() for _ in range(2)]
+        self.add_saved_race(heats[0].id, pilots, [[1000, 3000, 3000], [1000, 4000]], deleted={(0, 1)})
+        self.add_saved_race(heats[0].id, pilots, [[1000, 2000], []])
+        self.add_saved_race(heats[2].id, pilots[:1], [[1000, 5000, 5000]], deleted={(0, 2)})
+        heat_ids = [heat.id for heat in heats]
+        race_data = rhdata.get_savedRaceData(heat_ids=heat_ids)
+        self.assertNotIn(heats[1].id, race_data['races_by_heat'])  # no saved races
+        for heat_id in heat_ids:
+            races = rhdata.get_savedRaceMetas_by_heat(heat_id)
+            self.assertEqual([race.id for race in race_data['races_by_heat'].get(heat_id, [])], [race.id for race in races])
+            for race in races:
+                pilotraces = rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id)
+                self.assertEqual([(pilotrace.id, pilotrace.node_index, pilotrace.pilot_id, pilotrace.frequency) \
+                        for pilotrace in race_data['pilotraces_by_race'][race.id]], \
+                    [(pilotrace.id, pilotrace.node_index, pilotrace.pilot_id, pilotrace.frequency) for pilotrace in pilotraces])
+                for pilotrace in pilotraces:
+                    laps = rhdata.get_savedRaceLaps_by_savedPilotRace(pilotrace.id)
+                    self.assertEqual([(lap.id, lap.lap_time_stamp, lap.lap_time, lap.lap_time_formatted, lap.source, lap.deleted) \
+                            for lap in race_data['laps_by_pilotrace'].get(pilotrace.id, [])], \
+                        [(lap.id, lap.lap_time_stamp, lap.lap_time, lap.lap_time_formatted, lap.source, lap.deleted) for lap in laps])
+        deleted_laps = [lap for laps in race_data['laps_by_pilotrace'].values() for lap in laps if lap.deleted]
+        self.assertEqual(len(deleted_laps), 2)  # deleted laps are loaded, as by the per-race queries
+        race_data = rhdata.get_savedRaceData(heat_ids=[heats[2].id], include_laps=False)
+        self.assertEqual(list(race_data['races_by_heat']), [heats[2].id])
+        self.assertEqual(race_data['laps_by_pilotrace'], {})
+
+    def make_serial_nodes(self, port, count, api_level, reads, index_offset=0):
+        from serial_node import SerialNode
+        node_serial = MockNodeSerial(port, reads)
+        curnode_index_holder = [-1]
+        nodes = []
+        for idx in range(count):
+            node = SerialNode(index_offset + idx, node_serial)
+            node.api_level = api_level
+            node.api_valid_flag = True
+            node.multi_node_index = idx
+            node.multi_node_count = count
+            node.multi_curnode_index_holder = curnode_index_holder
+            node.frequency = 5658
+            nodes.append(node)
+        return nodes
+
+    def make_interface(self, nodes):
+        from RHInterface import RHInterface
+        from BaseHardwareInterface import BaseHardwareInterface
+        interface = RHInterface.__new__(RHInterface)
+        BaseHardwareInterface.__init__(interface)
+        interface.intf_read_block_count = 0
+        interface.intf_read_error_count = 0
+        interface.intf_write_block_count = 0
+        interface.intf_write_error_count = 0
+        interface.nodes = nodes
+        return interface
+
+    def test_batched_lap_stats(self):
+        from RHInterface import READ_ALL_LAP_STATS, READ_LAP_PASS_STATS, READ_LAP_EXTREMUMS
+        reads = {'active': {}, 'max_port': 0, 'max_total': 0}
+        expected = {idx: bytearray([idx] * 16) for idx in range(3)}
+
+        # one READ_ALL_LAP_STATS exchange, split by multi-node index
+        nodes = self.make_serial_nodes('test_batched_a', 3, 37, reads)
+        interface = self.make_interface(nodes)
+        lap_stats = interface.read_nodes_lap_stats()
+        self.assertEqual({idx: data for idx, (data, _readtime) in lap_stats.items()}, expected)
+        commands = nodes[0].serial.commands
+        self.assertEqual(commands.count(READ_ALL_LAP_STATS), 1)
+        self.assertNotIn(READ_LAP_PASS_STATS, commands)
+        self.assertEqual(len({readtime for _data, readtime in lap_stats.values()}), 1)
+
+        # per-node reads if the batched read fails
+        nodes[0].read_all_lap_stats = lambda interface: None
+        nodes[0].serial.commands.clear()
+        lap_stats = interface.read_nodes_lap_stats()
+        self.assertEqual({idx: data for idx, (data, _readtime) in lap_stats.items()}, expected)
+        self.assertEqual(commands.count(READ_LAP_PASS_STATS), 3)
+        self.assertEqual(commands.count(READ_LAP_EXTREMUMS), 3)
+
+        # per-node reads for firmware without READ_ALL_LAP_STATS
+        nodes = self.make_serial_nodes('test_batched_b', 3, 36, reads)
+        interface = self.make_interface(nodes)
+        lap_stats = interface.read_nodes_lap_stats()
+        self.assertEqual({idx: data for idx, (data, _readtime) in lap_stats.items()}, expected)
+        self.assertNotIn(READ_ALL_LAP_STATS, nodes[0].serial.commands)
+        self.assertEqual(nodes[0].serial.commands.count(READ_LAP_PASS_STATS), 3)
+
+    def test_port_io_locks(self):
+        from serial_node import get_port_io_rlock
+        reads = {'active': {}, 'max_port': 0, 'max_total': 0}
+        nodes_a = self.make_serial_nodes('test_port_a', 2, 36, reads)
+        nodes_b = self.make_serial_nodes('test_port_b', 2, 36, reads, index_offset=2)
+        self.assertIs(nodes_a[0].io_rlock, get_port_io_rlock('test_port_a'))
+        self.assertIs(nodes_a[1].io_rlock, nodes_a[0].io_rlock)
+        self.assertIsNot(nodes_b[0].io_rlock, nodes_a[0].io_rlock)
+        interface = self.make_interface(nodes_a + nodes_b)
+        lap_stats = interface.read_nodes_lap_stats()
+        self.assertEqual(sorted(lap_stats), [0, 1, 2, 3])
+        self.assertEqual(reads['max_total'], 2)  # ports are read concurrently
+        self.assertEqual(reads['max_port'], 1)  # nodes on one port are read in sequence
+
+    def test_single_flight(self):
+        import logging
+        from SingleFlight import SingleFlight
+        flight = SingleFlight(logging.getLogger(__name__))
+        calls = []
+        def build(value):
+            calls.append(value)
+            gevent.sleep(0.05)
+            return value
+        jobs = [gevent.spawn(flight.run, 'key', 1, build, 'a') for _ in range(3)]
+        gevent.sleep(0.01)
+        jobs.append(gevent.spawn(flight.run, 'key', 2, build, 'b'))
+        gevent.joinall(jobs)
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual([job.value for job in jobs], ['a', 'a', 'a', 'b'])
+        self.assertFalse(flight.inFlight())
+
+    def test_group_commit(self):
+        import logging
+        from GroupCommit import GroupCommit
+        syncs = []
+        group_commit = GroupCommit(logging.getLogger(__name__), lambda: syncs.append(True), window=0.05)
+        for _ in range(5):
+            group_commit.notify()
+        self.assertTrue(group_commit.barrier(1))
+        self.assertEqual(len(syncs), 1)
+        self.assertEqual(group_commit.pending(), 0)
+        group_commit.notify()
+        gevent.sleep(0.2)
+        self.assertEqual(len(syncs), 2)
+        group_commit.stop()
+        self.assertTrue(server.RaceContext.rhdata.wait_durable())
+
+    def test_emit_coalescer(self):
+        import logging
+        from EmitCoalescer import EmitCoalescer
+        runs = []
+        coalescer = EmitCoalescer(logging.getLogger(__name__), window=0.05, maxDelay=0.2)
+        for idx in range(5):
+            coalescer.request('key', runs.append, idx)
+        self.assertEqual(runs, [0])  # first runs immediately; rest are collapsed
+        gevent.sleep(0.15)
+        self.assertEqual(runs, [0, 4])
+        coalescer.request('key', runs.append, 5)
+        coalescer.request('key', runs.append, 6)
+        coalescer.runNow('key', runs.append, 7)  # supersedes pending run
+        gevent.sleep(0.15)
+        self.assertEqual(runs, [0, 4, 5, 7])
+        self.assertFalse(coalescer.hasPending())
+
+    def test_rssi_history_encoding(self):
+        from Database import RssiHistoryValues, RssiHistoryTimes
+        values_type = RssiHistoryValues()
+        times_type = RssiHistoryTimes()
+        for values in ([], [40, 120, 255], [-3, 300], [1.5, 2]):
+            stored = values_type.process_bind_param(values, None)
+            self.assertIsInstance(stored, bytes)
+            self.assertEqual(values_type.process_result_value(stored, None), values)
+        times = [1000.0001, 1000.25, 1000.2, 1040.5]
+        stored = times_type.process_bind_param(times, None)
+        for decoded, expected in zip(times_type.process_result_value(stored, None), times):
+            self.assertAlmostEqual(decoded, expected, places=3)
+        self.assertEqual(values_type.process_result_value('[1, 2]', None), [1, 2])
+
+    def test_history_buffer(self):
+        from HistoryBuffer import HistoryBuffer
+        history = HistoryBuffer(4)
+        for time, value in enumerate([10, 20, 20, 20, 30, 40]):
+            history.add(value, time)
+        self.assertEqual(history.values(), [20, 20, 30, 40])
+        self.assertEqual(history.times(), [1, 3, 4, 5])
+        values = history.values()
+        self.assertIs(history.values(), values)  # shared until the history changes
+        history.trim_before(4)
+        self.assertEqual(history.values(), [30, 40])
+        self.assertEqual(values, [20, 20, 30, 40])
+        history.add(50, 6)
+        history.add(60, 7)
+        value_views, time_views = history.views()
+        self.assertEqual([value for view in value_views for value in view.tolist()], [30, 40, 50, 60])
+        self.assertEqual([time for view in time_views for time in view.tolist()], [4, 5, 6, 7])
+
+    def test_delta_emission(self):
+        server.RaceContext.rhui.emit_current_leaderboard()
+        self.client.emit('set_delta_updates', {'enabled': True})
+        self.client.emit('load_data', {'load_types': ['leaderboard']})
+        full = self.get_response('leaderboard')
+        self.client.get_received()
+        server.RaceContext.rhui.emit_current_leaderboard()
+        # requester is sent the next broadcast as a full payload, then deltas
+        received = self.client.get_received()
+        self.assertEqual([resp['name'] for resp in received], ['leaderboard'])
+        self.assertEqual(received[0]['args'][0]['seq'], full['seq'] + 1)
+        server.RaceContext.rhui._delta_states['leaderboard']['payload'] = {}
+        server.RaceContext.rhui.emit_current_leaderboard()
+        resp = self.get_response('leaderboard_delta')
+        self.assertEqual(resp['seq'], full['seq'] + 2)
+        self.assertEqual(set(resp['patch']['d']), set(full) - {'seq'})
+
+        from RHUtils import json_delta
+        patch = json_delta({'a': [1, 2, 3], 'b': 1, 'c': 2}, {'a': [1, 5], 'b': 1, 'd': 3})
+        self.assertEqual(patch, {'d': {'a': {'l': 2, 'i': {1: {'v': 5}}}, 'd': {'v': 3}}, 'r': ['c']})
+
+    def test_heartbeat_subscription(self):
+        rhui = server.RaceContext.rhui
+        node_data = {'current_rssi': [80, 300], 'frequency': [5658, 5732], 'loop_time': [1000, 70000], \
+                     'crossing_flag': [False, True]}
+        frame = rhui.pack_heartbeat(node_data)
+        self.assertEqual(len(frame), rhui.HEARTBEAT_HEADER.size + 2 * rhui.HEARTBEAT_NODE.size)
+        self.assertEqual(rhui.HEARTBEAT_NODE.unpack_from(frame, rhui.HEARTBEAT_HEADER.size + rhui.HEARTBEAT_NODE.size), \
+                         (300, 5732, 0xFFFF, 1))
+
+        self.client.emit('set_heartbeat', {'binary': True, 'rate': 5})
+        self.client.get_received()
+        rhui.emit_heartbeat(node_data, 2)
+        rhui.emit_heartbeat(node_data, 1)
+        received = self.client.get_received()
+        self.assertEqual([resp['name'] for resp in received], ['heartbeat_bin'])
+        self.assertEqual(received[0]['args'][0], frame)
+
+        heartbeat_clients = dict(rhui._heartbeat_clients)
+        with self.assertLogs('server', 'WARNING') as logs:
+            for rate in ('fast', [5], {'hz': 5}, -1):
+                self.client.emit('set_heartbeat', {'binary': False, 'rate': rate})
+        self.assertEqual(len(logs.output), 4)
+        self.assertEqual(rhui._heartbeat_clients, heartbeat_clients)  # invalid rates are ignored
+        self.client.emit('set_heartbeat', {'binary': True, 'rate': '1e-300'})  # clamped to slowest rate
+        self.assertEqual(rhui._heartbeat_rooms[rhui.heartbeat_room(True, server.HEARTBEAT_MAX_INTERVAL_FACTOR \
+                                                                   * server.HEARTBEAT_DATA_RATE_FACTOR)][2], 1)
+
+        self.client.emit('set_heartbeat', {'rate': 0})
+        rhui.emit_heartbeat(node_data, 0)
+        self.assertFalse([resp for resp in self.client.get_received() if resp['name'].startswith('heartbeat')])
+
+    def test_topic_subscriptions(self):
+        rhui = server.RaceContext.rhui
+        self.client.emit('subscribe_topics', {'topics': ['leaderboard']})
+        self.client.get_received()
+        self.assertFalse(rhui.has_topic_clients('node_data'))
+        rhui.emit_node_data()
+        rhui.emit_current_leaderboard()
+        names = [resp['name'] for resp in self.client.get_received()]
+        self.assertNotIn('node_data', names)
+        self.assertIn('leaderboard', names)
+
+        self.client.emit('load_data', {'load_types': ['node_data']})
+        self.assertIn('node_peak_rssi', self.get_response('node_data'))
+
+    def test_query_plans(self):
+        for name, plan in server.RaceContext.rhdata.get_query_plans().items():
+            self.assertFalse([step for step in plan if step.startswith('SCAN')], name)
+
+    def test_json_api_etag(self):
+        from flask import Flask
+        import json_endpoints
+        app = Flask('test_json_api')
+        app.register_blueprint(json_endpoints.createBlueprint(server.RaceContext, server.RaceContext.serverstate.info_dict))
+        with app.test_client() as tc:
+            resp = tc.get('/api/pilot/all')
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            resp = tc.get('/api/pilot/all', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            server.RHAPI.db.pilot_add(callsign='ETag Pilot')
+            resp = tc.get('/api/pilot/all', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+            self.assertIn('ETag Pilot', resp.get_data(as_text=True))
+
+    def test_data_version(self):
+        import Database
+        server.RHAPI.db.heat_add()
+        version = Database.get_data_version()
+        Database.DB_session.commit()  # nothing written
+        heat = Database.Heat.query.first()
+        heat.results = {'test': 1}  # results cache only
+        Database.DB_session.commit()
+        self.assertEqual(Database.get_data_version(), version)
+        server.RHAPI.db.pilot_add(callsign='Version Pilot')
+        self.assertGreater(Database.get_data_version(), version)
+
+    def test_json_api_paging(self):
+        import json
+        from flask import Flask
+        import json_endpoints
+        app = Flask('test_json_api_paging')
+        app.register_blueprint(json_endpoints.createBlueprint(server.RaceContext, server.RaceContext.serverstate.info_dict))
+        server.RHAPI.db.heat_add()
+        server.RHAPI.db.heat_add()
+        heat_ids = [heat.id for heat in server.RHAPI.db.heats]
+        with app.test_client() as tc:
+            resp = tc.get('/api/heat/all?limit=1&fields=heat_id')
+            self.assertEqual(resp.status_code, 200)
+            data = resp.get_json()
+            self.assertEqual(data['heats'], {str(heat_ids[0]): {'heat_id': heat_ids[0]}})
+            resp = tc.get('/api/heat/all?fields=heat_id,locked&cursor={}'.format(data['next_cursor']))
+            self.assertEqual(len(resp.get_json()['heats']), len(heat_ids) - 1)
+            resp = tc.get('/api/heat/all?format=ndjson&fields=heat_id')
+            lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+            self.assertEqual(lines, [{'heat_id': heat_id} for heat_id in heat_ids])
+
+    def test_race_list_fragments(self):
+        rhdata = server.RaceContext.rhdata
+        heat = server.RHAPI.db.heat_add()
+        pilot = server.RHAPI.db.pilot_add()
+        race = rhdata.add_savedRaceMeta({'round_id': 1, 'heat_id': heat.id, 'class_id': 0, \
+            'format_id': server.RHAPI.db.raceformats[0].id, 'start_time': 0, 'start_time_formatted': ''})
+        rhdata.add_race_data({0: {'race_id': race.id, 'pilot_id': pilot.id, 'enter_at': 0, 'exit_at': 0}})
+        pilotraces = rhdata.get_savedRaceListing()['pilotraces_by_race'][race.id]
+        self.assertEqual([pilotrace.node_index for pilotrace in pilotraces], [0])
+        self.assertIs(rhdata.get_savedRaceListing()['pilotraces_by_race'][race.id], pilotraces)  # cached
+        rhdata.clear_results_savedRaceMeta(race)  # resave
+        self.assertIsNot(rhdata.get_savedRaceListing()['pilotraces_by_race'][race.id], pilotraces)
+        rhdata.clear_race_data()
+        self.assertEqual(rhdata.get_savedRaceListing()['pilotraces_by_race'], {})
+
+    def test_option_cache(self):
+        from filtermanager import Flt
+        rhdata = server.RaceContext.rhdata
+        rhdata.set_option('testOptionInt', '7')
+        self.assertEqual(rhdata.get_optionInt('testOptionInt'), 7)
+        rhdata.set_option('testOptionInt', 'x')
+        self.assertEqual(rhdata.get_optionInt('testOptionInt', 3), 3)
+        self.assertEqual(rhdata.get_optionInt('testOptionMissing', 5), 5)
+        filters = server.RaceContext.filters
+        filters.add_filter(Flt.OPTION_GET_INT, 'test_option_cache', lambda value: value + 1)
+        try:
+            self.assertEqual(rhdata.get_optionInt('testOptionMissing', 5), 6)
+        finally:
+            filters.remove_filter(Flt.OPTION_GET_INT, 'test_option_cache')
+        self.assertEqual(rhdata.get_optionInt('testOptionMissing', 5), 5)
+        self.assertEqual(rhdata.get_option('testOptionInt'), 'x')
+
+    def test_filter_stats(self):
+        from filtermanager import Flt
+        filters = server.RaceContext.filters
+        def calls():
+            return filters.get_stats().get(Flt.OPTION_GET_INT, {}).get('calls', 0)
+        start_calls = calls()
+        filters.run_filters(Flt.OPTION_GET_INT, 1)  # no filters registered; not counted
+        self.assertEqual(calls(), start_calls)
+        filters.add_filter(Flt.OPTION_GET_INT, 'test_filter_stats', lambda value: value + 1)
+        try:
+            for _ in range(3):
+                self.assertEqual(filters.run_filters(Flt.OPTION_GET_INT, 1), 2)
+        finally:
+            filters.remove_filter(Flt.OPTION_GET_INT, 'test_filter_stats')
+        filters.run_filters(Flt.OPTION_GET_INT, 1)
+        self.assertEqual(calls(), start_calls + 3)
+
+    def test_event_handler_queue(self):
+        from gevent.event import Event
+        from eventmanager import HANDLER_MAX_PENDING, HANDLER_MAX_RUNNING
+        events = server.RaceContext.events
+        calls = []
+        events.on('testQueue', 'test_low', lambda args: calls.append('low'), priority=200)
+        events.on('testQueue', 'test_high', lambda args: calls.append('high'), priority=120)
+        events.on('testQueue', 'test_inline', lambda args: calls.append('inline'), priority=50)
+        events.trigger('testQueue', {})
+        self.assertEqual(calls, ['inline'])  # queued handlers run after trigger returns
+        gevent.sleep(0.1)
+        self.assertEqual(calls, ['inline', 'high', 'low'])
+        release = Event()
+        events.on('testSlow', 'test_slow', lambda args: release.wait(), priority=200)
+        for _ in range(HANDLER_MAX_PENDING + 5):
+            events.trigger('testSlow')
+        self.assertEqual(events.get_stats()['dropped_by_handler']['test_slow'], 5)
+        gevent.sleep(0.05)
+        self.assertEqual(events.get_stats()['busy_workers'], HANDLER_MAX_RUNNING)  # others stay free for other handlers
+        self.assertEqual(events.get_stats()['pending_by_handler']['test_slow'], HANDLER_MAX_PENDING)
+        release.set()
+        gevent.sleep(0.1)
+        self.assertNotIn('test_slow', events.get_stats()['pending_by_handler'])
+        with self.assertLogs('eventmanager', 'WARNING') as logs:  # warned again once caught up
+            for _ in range(HANDLER_MAX_PENDING + 1):
+                events.trigger('testSlow')
+        self.assertTrue(any('test_slow' in line for line in logs.output))
+        gevent.sleep(0.1)
+        for name in ('test_low', 'test_high', 'test_inline'):
+            events.off('testQueue', name)
+        events.off('testSlow', 'test_slow')
+
+    def test_event_handler_shared_name(self):
+        from gevent.event import Event
+        from eventmanager import Evt, HANDLER_MAX_PENDING
+        events = server.RaceContext.events
+        release = Event()
+        calls = []
+        def shared_handler(args):
+            if args['_eventName'] == 'testSharedSlow':
+                release.wait()
+            calls.append(args['_eventName'])
+        events.on(Evt.ALL, 'test_shared', shared_handler, priority=200)  # one name for every event
+        events.on('testSharedFast', 'test_shared_fast', lambda args: calls.append('fast'), priority=200)
+        try:
+            for _ in range(HANDLER_MAX_PENDING + 5):
+                events.trigger('testSharedSlow')
+            events.trigger('testSharedFast')
+            gevent.sleep(0.05)
+            # a backlog on one event does not hold back or drop the same handler on another event
+            self.assertIn('testSharedFast', calls)
+            self.assertIn('fast', calls)
+            self.assertNotIn('testSharedSlow', calls)
+            release.set()
+            gevent.sleep(0.1)
+            self.assertEqual(calls.count('testSharedSlow'), HANDLER_MAX_PENDING)
+        finally:
+            release.set()
+            events.off(Evt.ALL, 'test_shared')
+            events.off('testSharedFast', 'test_shared_fast')
+
+    def test_led_framebuffer(self):
+        from led_framebuffer import LEDFrameBuffer
+        class RecordingStrip:
+            def __init__(self, count):
+                self.pixels = [0] * count
+                self.writes = 0
+                self.shows = 0
+            def numPixels(self):
+                return len(self.pixels)
+            def setPixelColor(self, i, color):
+                self.pixels[i] = color
+                self.writes += 1
+            def show(self):
+                self.shows += 1
+        strip = RecordingStrip(8)
+        frame = LEDFrameBuffer(strip, max_fps=20)
+        frame.fill(0x0000ff, 2, 5)
+        frame.show()
+        self.assertEqual(strip.pixels, [0, 0, 0xff, 0xff, 0xff, 0, 0, 0])
+        frame.setPixelColor(2, 0x0000ff)
+        frame.show()  # nothing changed
+        self.assertEqual(strip.shows, 1)
+        writes = strip.writes
+        frame.setPixelColor(0, 0x010101)
+        frame.show()  # within frame interval; deferred
+        self.assertEqual(strip.shows, 1)
+        gevent.sleep(0.1)
+        self.assertEqual(strip.shows, 2)
+        self.assertEqual(strip.writes - writes, 1)  # only changed pixel written
+        frame.ramp(0x000000, 0x0000f0, 0, 4)
+        frame.dim(0.5)
+        self.assertEqual([frame.getPixelColor(i) for i in range(4)], [0, 0x28, 0x50, 0x78])
+
+    def test_log_queue(self):
+        import io
+        import logging
+        import log
+        class RecordingSocket:
+            def __init__(self):
+                self.emits = []
+            def emit(self, event, msg):
+                self.emits.append(msg)
+        file_stream = io.StringIO()
+        socket = RecordingSocket()
+        queued_file = log.QueuedLogEventHandler(logging.StreamHandler(file_stream))
+        queued_socket = log.QueuedLogEventHandler(log.SocketForwardHandler(socket))
+        test_logger = logging.getLogger('test_log_queue')
+        test_logger.propagate = False
+        test_logger.setLevel(logging.DEBUG)
+        test_logger.addHandler(queued_file)
+        test_logger.addHandler(queued_socket)
+        for i in range(log.LOG_QUEUE_SIZE + 10):
+            test_logger.debug("debug %d", i)  # does not block when queue is full
+        test_logger.error("error")
+        gevent.sleep(log.SOCKET_EMIT_INTERVAL + 0.2)
+        for hndlr in (queued_file, queued_socket):
+            test_logger.removeHandler(hndlr)
+            self.assertEqual(hndlr.dropped_count, 11)
+        lines = file_stream.getvalue().splitlines()
+        self.assertEqual(len(lines), log.LOG_QUEUE_SIZE + 1)  # queued records plus dropped-count message
+        self.assertEqual(lines[-1], "error")  # error kept, in place of oldest record
+        self.assertEqual(len([line for line in lines if "dropped 11 message" in line]), 1)
+        self.assertEqual(len(socket.emits), 1)  # coalesced into single socket emit
+        self.assertEqual(socket.emits[0].splitlines(), lines)
+
+    def test_led_frame_cache(self):
+        from led_framebuffer import LEDFrameCache
+        renders = []
+        def render(key, frame_count):
+            renders.append(key)
+            return [[key] * 4] * frame_count
+        cache = LEDFrameCache(max_pixels=16)
+        cache.get('a', lambda: render('a', 1))
+        cache.get('b', lambda: render('b', 2))
+        self.assertEqual(cache.get('a', lambda: render('a', 1)), [['a'] * 4])
+        self.assertEqual(renders, ['a', 'b'])  # cached frames not rendered again
+        cache.get('c', lambda: render('c', 2))  # evicts least recently used
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIsNone(cache.get('b'))
+        cache.get('d', lambda: render('d', 5))  # too large to cache
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.get_stats()['pixels'], 12)
+
     def test_attributes(self):
         # Ensure there is a stored pilot, heat, class, and race
         server.RHAPI.db.pilot_add()